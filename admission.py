@@ -0,0 +1,262 @@
+# admission.py
+
+import asyncio
+from typing import NamedTuple
+
+import metrics
+import settings
+from dispatch import TEXT_JOB, MEDIA_JOB
+from ratelimit import TokenBucket
+
+# Reasons a job is turned away
+QUEUE_FULL = "queue_full"  # its job class has no room left
+SENDER_BUSY = "sender_busy"  # its chat or user has too many jobs pending
+RATE_LIMITED = "rate_limited"  # its sender used up their quota for now
+
+COST_FIELDS = ("tokens", "seconds", "bytes")
+
+
+class JobCost(NamedTuple):
+    """
+    What a job is expected to take: tokens to translate, seconds of audio to
+    transcribe and bytes to download.
+    """
+
+    tokens: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+
+
+class QueueLimits(NamedTuple):
+    """
+    The bounds of one job class: jobs admitted at once (waiting or running),
+    jobs one chat or user may have admitted, and the total cost of the
+    admitted jobs. A bound of 0 is no bound.
+    """
+
+    jobs: int
+    per_sender: int
+    tokens: int = 0
+    seconds: float = 0
+    bytes: int = 0
+
+
+class JobRejected(Exception):
+    """
+    Raised when a job is not admitted; `reason` names the limit it hit.
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class Ticket:
+    """
+    An admitted job. It counts as waiting until `start` and holds its share
+    of the queue until `release`.
+    """
+
+    def __init__(self, controller, job_class: str, cost: JobCost, senders: tuple):
+        self.controller = controller
+        self.job_class = job_class
+        self.cost = cost
+        self.senders = senders
+        self._started = asyncio.Event()
+        self._released = False
+
+    def start(self):
+        self.controller._waiting[self.job_class].pop(self, None)
+        self._started.set()
+
+    def position(self) -> int:
+        """
+        Returns the place of a waiting job in its class's queue, from 1; 0
+        once it started.
+        """
+        waiting = self.controller._waiting[self.job_class]
+        if self not in waiting:
+            return 0
+        return list(waiting).index(self) + 1
+
+    async def wait_started(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for the job to start (or be released)
+        and tells whether it did.
+        """
+        try:
+            await asyncio.wait_for(self._started.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+        self._started.set()
+
+
+class AdmissionController:
+    """
+    Decides whether a job is taken on before it waits for its turn. Every
+    job class has a bounded queue: at most so many jobs, and at most so much
+    estimated work (tokens, audio seconds, download bytes), admitted at once.
+    Each chat and user may only have a few jobs of a class pending, and each
+    sender has a rate quota of jobs per minute and audio seconds per hour.
+
+    A job that does not fit is rejected at once instead of queueing without
+    bound, so a flood from one sender or of one kind of job cannot exhaust
+    memory, disk and API quota or delay everyone else.
+    """
+
+    def __init__(
+        self,
+        limits: dict,
+        jobs_per_minute: float = settings.SENDER_JOBS_PER_MINUTE,
+        media_seconds_per_hour: float = settings.SENDER_MEDIA_SECONDS_PER_HOUR,
+    ):
+        self.limits = limits
+        self.jobs_per_minute = jobs_per_minute
+        self.media_seconds_per_hour = media_seconds_per_hour
+        self._admitted = {job_class: 0 for job_class in limits}
+        self._cost = {job_class: JobCost() for job_class in limits}
+        # Admitted jobs that have not started yet, in admission order
+        self._waiting = {job_class: {} for job_class in limits}
+        self._pending = {}
+        self._quotas = {}
+
+    def waiting(self, job_class: str) -> int:
+        return len(self._waiting[job_class])
+
+    def busy(self, job_class: str) -> bool:
+        """
+        Tells whether the queue of `job_class` is more than
+        DEGRADE_QUEUE_SHARE full, so optional work should be skipped.
+        """
+        limit = self.limits[job_class].jobs
+        return bool(
+            limit
+            and settings.DEGRADE_QUEUE_SHARE
+            and self._admitted[job_class] >= limit * settings.DEGRADE_QUEUE_SHARE
+        )
+
+    def _quota(self, key: tuple, rate: float) -> TokenBucket:
+        quota = self._quotas.get(key)
+        if quota is None:
+            if len(self._quotas) > 10_000:
+                self._quotas = {
+                    key: value
+                    for key, value in self._quotas.items()
+                    if not value.is_idle()
+                }
+            # Quotas refill continuously; the capacity is one period's worth
+            period = 60 if key[0] == "jobs" else 3600
+            quota = self._quotas[key] = TokenBucket(rate / period, rate)
+        return quota
+
+    def _check(self, job_class: str, cost: JobCost, senders: tuple, sender):
+        limits = self.limits[job_class]
+        if limits.jobs and self._admitted[job_class] >= limits.jobs:
+            raise JobRejected(QUEUE_FULL, f"The {job_class} queue is full.")
+        queued = self._cost[job_class]
+        for field in COST_FIELDS:
+            limit = getattr(limits, field)
+            # A job larger than the whole budget still runs on its own
+            if (
+                limit
+                and getattr(queued, field)
+                and (getattr(queued, field) + getattr(cost, field) > limit)
+            ):
+                raise JobRejected(
+                    QUEUE_FULL, f"The {job_class} queue has no {field} left."
+                )
+        for key in senders:
+            if (
+                limits.per_sender
+                and self._pending.get((job_class, key), 0) >= limits.per_sender
+            ):
+                raise JobRejected(
+                    SENDER_BUSY,
+                    f"{key[0].title()} {key[1]} has {limits.per_sender} {job_class} "
+                    "jobs pending.",
+                )
+
+        quotas = []
+        if self.jobs_per_minute:
+            quotas.append((self._quota(("jobs", sender), self.jobs_per_minute), 1))
+        if self.media_seconds_per_hour and cost.seconds:
+            quota = self._quota(("seconds", sender), self.media_seconds_per_hour)
+            quotas.append((quota, cost.seconds))
+        if any(
+            quota.available() < min(amount, quota.capacity) for quota, amount in quotas
+        ):
+            raise JobRejected(
+                RATE_LIMITED, f"{sender[0].title()} {sender[1]} used up its quota."
+            )
+        for quota, amount in quotas:
+            quota.try_acquire(amount)
+
+    def admit(
+        self,
+        job_class: str,
+        cost: JobCost,
+        chat_id,
+        user_id=None,
+        force: bool = False,
+    ) -> Ticket:
+        """
+        Admits a job of `job_class` from `user_id` (if known) in `chat_id`
+        and returns its ticket, or raises JobRejected. Jobs that must not be
+        lost, such as ones resumed after a restart, are admitted with
+        `force` whatever the limits.
+        """
+        senders = (("chat", chat_id),)
+        if user_id is not None and user_id != chat_id:
+            senders += (("user", user_id),)
+        if not force:
+            try:
+                self._check(job_class, cost, senders, senders[-1])
+            except JobRejected as e:
+                metrics.jobs_shed.inc(job_class=job_class, reason=e.reason)
+                raise
+
+        ticket = Ticket(self, job_class, cost, senders)
+        self._admitted[job_class] += 1
+        self._cost[job_class] = JobCost(
+            *(a + b for a, b in zip(self._cost[job_class], cost))
+        )
+        self._waiting[job_class][ticket] = None
+        for key in senders:
+            self._pending[(job_class, key)] = self._pending.get((job_class, key), 0) + 1
+        return ticket
+
+    def _release(self, ticket: Ticket):
+        job_class = ticket.job_class
+        self._waiting[job_class].pop(ticket, None)
+        self._admitted[job_class] -= 1
+        self._cost[job_class] = JobCost(
+            *(a - b for a, b in zip(self._cost[job_class], ticket.cost))
+        )
+        for key in ticket.senders:
+            self._pending[(job_class, key)] -= 1
+            if not self._pending[(job_class, key)]:
+                del self._pending[(job_class, key)]
+
+
+admission = AdmissionController(
+    {
+        TEXT_JOB: QueueLimits(
+            jobs=settings.TEXT_QUEUE_LIMIT,
+            per_sender=settings.SENDER_TEXT_JOBS,
+            tokens=settings.TEXT_QUEUE_TOKENS,
+        ),
+        MEDIA_JOB: QueueLimits(
+            jobs=settings.MEDIA_QUEUE_LIMIT,
+            per_sender=settings.SENDER_MEDIA_JOBS,
+            seconds=settings.MEDIA_QUEUE_SECONDS,
+            bytes=settings.MEDIA_QUEUE_BYTES,
+        ),
+    }
+)
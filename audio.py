@@ -0,0 +1,414 @@
+# audio.py
+
+import asyncio
+import logging
+import os
+import re
+from io import BytesIO
+
+import metrics
+import settings
+from media import MediaFile, open_media_file
+
+logger = logging.getLogger(__name__)
+
+# Whisper resamples everything to 16 kHz mono, so anything richer is wasted upload
+SPEECH_FRAME_RATE = 16000
+SEGMENT_BITRATE = "48k"
+PIPE_CHUNK_SIZE = 64 * 1024  # bytes written to or read from ffmpeg at a time
+
+# Mono 16 kHz Opus at 24 kbps keeps speech intelligible for Whisper at a
+# fraction of the size of the source audio track. The lowest encoder
+# complexity roughly halves the encode time at no noticeable cost for speech.
+SPEECH_ENCODER_ARGS = [
+    "-vn",
+    "-ac",
+    "1",
+    "-ar",
+    str(SPEECH_FRAME_RATE),
+    "-c:a",
+    "libopus",
+    "-b:a",
+    "24k",
+    "-application",
+    "voip",
+    "-compression_level",
+    "0",
+    "-f",
+    "ogg",
+]
+
+SEGMENT_ENCODER_ARGS = [
+    "-vn",
+    "-ac",
+    "1",
+    "-ar",
+    str(SPEECH_FRAME_RATE),
+    "-c:a",
+    "libmp3lame",
+    "-b:a",
+    SEGMENT_BITRATE,
+    "-f",
+    "mp3",
+]
+
+# The cuts are planned on the same 16 kHz mono signal that is transcribed
+ANALYSIS_FILTER = f"aresample={SPEECH_FRAME_RATE},aformat=channel_layouts=mono"
+SILENCE_BELOW_MEAN_DB = 16  # pauses are this much quieter than the mean loudness
+SILENT_DB = -91.0  # volumedetect's mean volume of digital silence
+
+
+class AudioExtractionError(Exception):
+    """
+    Raised when ffmpeg cannot extract an audio track.
+    """
+
+
+async def _run_ffmpeg(
+    input_args: list,
+    output,
+    source=None,
+    pass_fds=(),
+    output_args=SPEECH_ENCODER_ARGS,
+    loglevel="error",
+) -> str:
+    """
+    Runs ffmpeg with the given output settings, the speech encoder's by
+    default, feeding it the buffer `source` (if given) through stdin and
+    writing what it produces on stdout to the file `output`, a chunk at a
+    time in both directions. Without an `output`, for analysis filters,
+    nothing is expected on stdout. Returns what ffmpeg logged.
+    """
+    process = await asyncio.create_subprocess_exec(
+        settings.FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        loglevel,
+        "-xerror",
+        *input_args,
+        *output_args,
+        "pipe:1",
+        stdin=(
+            asyncio.subprocess.PIPE
+            if source is not None
+            else asyncio.subprocess.DEVNULL
+        ),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds,
+    )
+
+    async def _feed():
+        try:
+            for offset in range(0, len(source), PIPE_CHUNK_SIZE):
+                process.stdin.write(source[offset : offset + PIPE_CHUNK_SIZE])
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg stopped reading, its exit status tells why
+        finally:
+            process.stdin.close()
+
+    async def _collect():
+        while chunk := await process.stdout.read(PIPE_CHUNK_SIZE):
+            if output is not None:
+                output.write(chunk)
+
+    streams = [_collect(), process.stderr.read()]
+    if source is not None:
+        streams.append(_feed())
+    try:
+        _, stderr, *_ = await asyncio.wait_for(
+            asyncio.gather(*streams), settings.MEDIA_JOB_TIMEOUT
+        )
+        await process.wait()
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+    log = stderr.decode("utf-8", "replace").strip()
+    if process.returncode != 0 or (output is not None and not output.tell()):
+        raise AudioExtractionError(log)
+    return log
+
+
+@metrics.timed("audio_extract")
+async def extract_speech_audio(source, name: str) -> MediaFile:
+    """
+    Extracts the audio track of a video or audio file into a compact mono
+    Opus file suited to Whisper, held in memory up to the spool size.
+    `source` is a binary file: a MediaFile held in memory is piped into
+    ffmpeg's stdin from its buffer, a file on disk is read by ffmpeg from
+    its path, and an anonymous spool file through its file descriptor
+    (POSIX only), so the input is never copied.
+
+    MP4 files whose index sits at the end cannot be demuxed from a pipe; for
+    those the buffer is handed to ffmpeg as an anonymous in-memory file
+    (memfd) instead, where available.
+    """
+    output = await open_media_file(
+        f"{os.path.splitext(name)[0]}.ogg",
+        size=source.size() if isinstance(source, MediaFile) else None,
+        source=source,
+    )
+    try:
+        if isinstance(source, MediaFile) and source.in_memory:
+            with source.getbuffer() as buffer:
+                await _extract_from_buffer(buffer, name, output)
+        elif _path_on_disk(source):
+            await _run_ffmpeg(["-i", source.name], output)
+        else:
+            fd = source.fileno()
+            await _run_ffmpeg(["-i", f"/dev/fd/{fd}"], output, pass_fds=(fd,))
+    except BaseException:
+        output.close()
+        raise
+
+    metrics.bytes_processed.inc(output.tell(), stage="audio_extract")
+    output.seek(0)
+    return output
+
+
+def _path_on_disk(source) -> bool:
+    """
+    Tells whether `source` is a file with a path ffmpeg can open. A
+    MediaFile's name is not a path, and files opened from a descriptor
+    are named by it.
+    """
+    path = getattr(source, "name", None)
+    return (
+        not isinstance(source, MediaFile)
+        and isinstance(path, str)
+        and os.path.isfile(path)
+    )
+
+
+async def _extract_from_buffer(buffer: memoryview, name: str, output):
+    try:
+        await _run_ffmpeg(["-i", "pipe:0"], output, source=buffer)
+    except AudioExtractionError as e:
+        if not hasattr(os, "memfd_create"):
+            raise
+        reason = str(e).splitlines()[-1] if str(e) else "no output"
+        logger.info(
+            f"Piped extraction of {name} failed ({reason}), retrying via memfd."
+        )
+        output.seek(0)
+        output.truncate()
+        fd = os.memfd_create(name)
+        try:
+            with os.fdopen(os.dup(fd), "wb") as memory_file:
+                memory_file.write(buffer)
+            await _run_ffmpeg(["-i", f"/dev/fd/{fd}"], output, pass_fds=(fd,))
+        finally:
+            os.close(fd)
+
+
+def _seekable_input(audio_file) -> tuple:
+    """
+    Returns the ffmpeg input and the file descriptors to pass for reading
+    `audio_file` with input-side seeking, so that every segment is decoded
+    from its own start: a file on disk by its path, a spool file by its
+    descriptor. A MediaFile held in memory is moved to its temporary file
+    first, once, since a pipe would have to be decoded from the start for
+    each segment.
+    """
+    if isinstance(audio_file, MediaFile) and audio_file.in_memory:
+        audio_file.rollover()
+    if _path_on_disk(audio_file):
+        return audio_file.name, ()
+    fd = audio_file.fileno()
+    return f"/dev/fd/{fd}", (fd,)
+
+
+async def analyze_speech_audio(source: str, pass_fds=()) -> tuple:
+    """
+    Measures the audio ffmpeg reads from `source` with two streaming passes
+    instead of decoding it into memory. Returns its length in milliseconds and its pauses, as
+    (start_ms, end_ms) ranges at least TRANSCRIPTION_MIN_SILENCE_MS long and
+    SILENCE_BELOW_MEAN_DB quieter than its mean loudness.
+    """
+
+    async def _analyze(audio_filter: str) -> str:
+        return await _run_ffmpeg(
+            ["-i", source],
+            None,
+            pass_fds=pass_fds,
+            output_args=[
+                "-vn",
+                "-af",
+                f"{ANALYSIS_FILTER},{audio_filter}",
+                "-f",
+                "null",
+            ],
+            loglevel="info",
+        )
+
+    log = await _analyze("volumedetect")
+    # The filter graph may be set up more than once; the last report counts
+    samples = re.findall(r"n_samples: (\d+)", log)
+    mean_volume = re.findall(r"mean_volume: (-?[\d.]+) dB", log)
+    length_ms = int(samples[-1]) * 1000 // SPEECH_FRAME_RATE if samples else 0
+    if not mean_volume or float(mean_volume[-1]) <= SILENT_DB:
+        return length_ms, []
+
+    threshold = float(mean_volume[-1]) - SILENCE_BELOW_MEAN_DB
+    min_silence = settings.TRANSCRIPTION_MIN_SILENCE_MS / 1000
+    log = await _analyze(f"silencedetect=noise={threshold:.1f}dB:d={min_silence}")
+    silences = []
+    silence_start = None
+    for match in re.finditer(r"silence_(start|end): (-?[\d.]+)", log):
+        position_ms = max(0, round(float(match.group(2)) * 1000))
+        if match.group(1) == "start":
+            silence_start = position_ms
+        elif silence_start is not None:
+            silences.append((silence_start, position_ms))
+            silence_start = None
+    # A pause that lasts until the end is only reported as started
+    if silence_start is not None:
+        silences.append((silence_start, length_ms))
+    return length_ms, silences
+
+
+def find_cut_point(silences: list, start_ms: int, target_ms: int) -> int:
+    """
+    Returns a position shortly before `target_ms` that lies in the middle of
+    the longest of the `silences` found there, or `target_ms` when there is
+    no silence.
+    """
+    segment_ms = target_ms - start_ms
+    window_start = max(
+        start_ms + segment_ms // 2,
+        target_ms - settings.TRANSCRIPTION_SILENCE_SEARCH_MS,
+    )
+    pauses = [
+        (max(begin, window_start), min(end, target_ms))
+        for begin, end in silences
+        if begin < target_ms and end > window_start
+    ]
+    pauses = [
+        (begin, end)
+        for begin, end in pauses
+        if end - begin >= settings.TRANSCRIPTION_MIN_SILENCE_MS
+    ]
+    if not pauses:
+        return target_ms
+
+    # Prefer the longest pause, and among equally long ones the latest
+    begin, end = max(pauses, key=lambda pause: (pause[1] - pause[0], pause[0]))
+    return (begin + end) // 2
+
+
+def plan_segments(length_ms: int, silences: list) -> list:
+    """
+    Splits audio of the given length into (start_ms, end_ms) ranges of at
+    most roughly TRANSCRIPTION_SEGMENT_SECONDS, cut at silences. Neighbouring
+    ranges overlap by TRANSCRIPTION_SEGMENT_OVERLAP_MS so no word is lost at
+    a cut.
+    """
+    segment_ms = settings.TRANSCRIPTION_SEGMENT_SECONDS * 1000
+    overlap_ms = settings.TRANSCRIPTION_SEGMENT_OVERLAP_MS
+
+    bounds = []
+    start = 0
+    while start < length_ms:
+        if length_ms - start <= segment_ms:
+            end = length_ms
+        else:
+            end = find_cut_point(silences, start, start + segment_ms)
+        bounds.append((max(0, start - overlap_ms), min(length_ms, end + overlap_ms)))
+        start = end
+    return bounds
+
+
+async def export_segment(
+    source: str, pass_fds, start_ms: int, end_ms: int, index: int
+) -> BytesIO:
+    """
+    Encodes one range of the audio ffmpeg reads from `source` as a compact
+    MP3 ready for upload, seeking to it and decoding only that range.
+    """
+    segment_file = BytesIO()
+    await _run_ffmpeg(
+        [
+            "-ss",
+            f"{start_ms / 1000:.3f}",
+            "-t",
+            f"{(end_ms - start_ms) / 1000:.3f}",
+            "-i",
+            source,
+        ],
+        segment_file,
+        pass_fds=pass_fds,
+        output_args=SEGMENT_ENCODER_ARGS,
+    )
+    segment_file.name = f"segment-{index}.mp3"
+    segment_file.seek(0)
+    return segment_file
+
+
+def _normalized_words(text: str) -> list:
+    return [re.sub(r"\W+", "", word).lower() for word in text.split()]
+
+
+def merge_overlap(previous: str, text: str, max_words: int = 30) -> str:
+    """
+    Drops the words at the start of `text` that repeat the end of `previous`,
+    which happens when both segments transcribed the shared overlap.
+    """
+    previous_words = _normalized_words(previous)[-max_words:]
+    words = text.split()
+    leading_words = _normalized_words(text)[:max_words]
+
+    for size in range(min(len(previous_words), len(leading_words)), 1, -1):
+        if previous_words[-size:] == leading_words[:size]:
+            return " ".join(words[size:])
+    return text
+
+
+async def transcribe_segments(audio_file, transcribe, done: dict = None):
+    """
+    Cuts the audio at silences and transcribes the segments concurrently with
+    the `transcribe` coroutine function, at most TRANSCRIPTION_WORKERS at a
+    time. Yields the segment transcriptions in order as soon as each one and
+    all of its predecessors are done.
+
+    Segments whose transcription is already known, given in `done` by
+    segment index, are yielded from there instead of being transcribed
+    again. The cut points are the same for the same audio.
+
+    The audio is never decoded as a whole: ffmpeg measures it and then cuts
+    and encodes each segment straight from `audio_file`.
+    """
+    done = done or {}
+    source, pass_fds = _seekable_input(audio_file)
+    length_ms, silences = await analyze_speech_audio(source, pass_fds)
+    bounds = plan_segments(length_ms, silences)
+    logger.info(
+        f"Transcribing {length_ms / 1000:.0f}s of audio in {len(bounds)} segments."
+    )
+    semaphore = asyncio.Semaphore(settings.TRANSCRIPTION_WORKERS)
+
+    async def _transcribe(index: int, start_ms: int, end_ms: int) -> str:
+        if index in done:
+            return done[index]
+        async with semaphore:
+            segment_file = await export_segment(
+                source, pass_fds, start_ms, end_ms, index
+            )
+            return await transcribe(segment_file)
+
+    tasks = [
+        asyncio.ensure_future(_transcribe(index, start_ms, end_ms))
+        for index, (start_ms, end_ms) in enumerate(bounds)
+    ]
+    previous = ""
+    try:
+        for index, task in enumerate(tasks):
+            text = await task
+            if index not in done:
+                text = merge_overlap(previous, text)
+            previous = text
+            yield text
+    finally:
+        for task in tasks:
+            task.cancel()
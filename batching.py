@@ -0,0 +1,123 @@
+# batching.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TranslationBatcher:
+    """
+    Coalesces short translation requests that arrive within a few
+    milliseconds of each other into a single structured completion.
+
+    Requests are collected for `window` seconds, or until `max_items` texts
+    or `max_tokens` tokens are pending, and then sent together through
+    `translate_batch(texts) -> list`. A lone request, or a batch whose
+    response cannot be used (`translate_batch` raises ValueError), goes
+    through `translate_one(text)` instead.
+    """
+
+    def __init__(
+        self,
+        translate_batch,
+        translate_one,
+        window: float,
+        max_items: int,
+        max_tokens: int,
+    ):
+        self._translate_batch = translate_batch
+        self._translate_one = translate_one
+        self.window = window
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+
+        self._pending = []
+        self._pending_tokens = 0
+        self._flush_handle = None
+
+        self.requests = 0
+        self.items = 0
+        self.fallbacks = 0
+
+    async def translate(self, text: str, tokens: int) -> str:
+        """
+        Queues `text` (`tokens` long) for the next batch and returns its
+        translation. Raises if the translation failed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        self._pending_tokens = 0
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: list):
+        texts = [text for text, _ in batch]
+        self.items += len(texts)
+        if len(texts) == 1:
+            self.requests += 1
+            results = await asyncio.gather(
+                self._translate_one(texts[0]), return_exceptions=True
+            )
+        else:
+            self.requests += 1
+            try:
+                results = await self._translate_batch(texts)
+            except ValueError as e:
+                logger.warning(
+                    f"Batched translation of {len(texts)} texts failed, "
+                    f"translating them one by one: {e}"
+                )
+                self.fallbacks += 1
+                self.requests += len(texts)
+                results = await asyncio.gather(
+                    *(self._translate_one(text) for text in texts),
+                    return_exceptions=True,
+                )
+            except Exception as e:
+                # API errors such as rate limits go to every caller as they
+                # are, so a throttled API does not get one request per text
+                results = [e] * len(texts)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue  # the caller gave up waiting
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of texts waiting for the next batch.
+        """
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        """
+        Returns how many API requests served how many texts.
+        """
+        return {
+            "requests": self.requests,
+            "items": self.items,
+            "items_per_request": self.items / self.requests if self.requests else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,229 @@
+# benchmarks/edits.py
+"""
+Measures what channel posts and their edits cost when mirrored to several chats.
+
+A source channel posts multi-paragraph texts, which the bot translates for
+every destination chat, and then edits one paragraph of each post. Against
+the local fake Telegram and OpenAI servers, the bot's OpenAI tokens and
+requests and its Telegram calls are counted separately for the posts and
+for the edits, along with the latency of handling an edit. Run from the
+repository root:
+
+    python benchmarks/edits.py --posts 20 --paragraphs 6 --destinations 3
+
+Pass --bot-dir with another checkout of the bot to compare two versions;
+one that cannot fan out gets the posts once per destination chat instead.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services  # noqa: E402
+from load_test import TOKEN, fetch_stats  # noqa: E402
+
+SOURCE_CHAT = -1001
+
+
+def make_post(words: list, paragraphs: int, generator: random.Random) -> list:
+    paragraph_list = []
+    for _ in range(paragraphs):
+        count = generator.randint(20, 60)
+        start = generator.randrange(len(words) - count)
+        paragraph_list.append(" ".join(words[start : start + count]))
+    return paragraph_list
+
+
+def channel_update(update_id: int, chat_id: int, message_id: int, text: str, edited):
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "channel", "title": "Source"},
+        "text": text,
+    }
+    if edited:
+        message["edit_date"] = int(time.time())
+        return {"update_id": update_id, "edited_channel_post": message}
+    return {"update_id": update_id, "channel_post": message}
+
+
+def usage(metrics) -> dict:
+    tokens = {"prompt": 0, "completion": 0}
+    for _, key, _, value in metrics.openai_tokens.samples():
+        tokens[key[1]] += value
+    return tokens
+
+
+async def run(bot, args, sources: list, corpus: str) -> dict:
+    """
+    Sends the posts, then their edits, each phase as fast as the bot takes
+    them, and returns the OpenAI and Telegram usage of each phase and the
+    latencies of the edits.
+    """
+    import metrics
+    from telegram import Update
+
+    generator = random.Random(args.seed)
+    words = corpus.split()
+    pending = {}
+
+    handle_message = bot.handle_message
+
+    async def timed_handle_message(update, context):
+        try:
+            await handle_message(update, context)
+        finally:
+            done = pending.pop(update.update_id, None)
+            if done is not None:
+                done.set_result(time.perf_counter())
+
+    bot.handle_message = timed_handle_message
+    application = bot.build_application()
+    await application.initialize()
+    await application.start()
+
+    posts = [make_post(words, args.paragraphs, generator) for _ in range(args.posts)]
+    update_ids = iter(range(1, 1_000_000))
+
+    async def _phase(edited: bool) -> dict:
+        tokens = usage(metrics)
+        chat = fetch_stats(args.port, "openai").get("chat", 0)
+        telegram = fetch_stats(args.port, "telegram")
+        latencies = []
+        for message_id, paragraphs in enumerate(posts, 1):
+            if edited:
+                paragraphs[generator.randrange(len(paragraphs))] = " ".join(
+                    make_post(words, 1, generator)
+                )
+            futures = []
+            started = time.perf_counter()
+            for chat_id in sources:
+                update_id = next(update_ids)
+                future = pending[update_id] = asyncio.get_running_loop().create_future()
+                futures.append(future)
+                data = channel_update(
+                    update_id, chat_id, message_id, "\n\n".join(paragraphs), edited
+                )
+                await application.update_queue.put(
+                    Update.de_json(data, application.bot)
+                )
+            latencies.append(max(await asyncio.gather(*futures)) - started)
+        after = fetch_stats(args.port, "telegram")
+        return {
+            "tokens": {
+                kind: value - tokens[kind] for kind, value in usage(metrics).items()
+            },
+            "chat_requests": fetch_stats(args.port, "openai").get("chat", 0) - chat,
+            "telegram": {
+                method: count - telegram.get(method, 0)
+                for method, count in after.items()
+                if method not in ("getMe", "getUpdates")
+                and count > telegram.get(method, 0)
+            },
+            "latencies": latencies,
+        }
+
+    results = {"posts": await _phase(edited=False), "edits": await _phase(edited=True)}
+    await application.stop()
+    await application.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--destinations", type=int, default=3)
+    parser.add_argument("--port", type=int, default=18082)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bot-dir", default=ROOT, help="checkout of the bot to run")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "trans.txt"), encoding="utf-8") as f:
+        corpus = f.read()
+    workdir = tempfile.mkdtemp(prefix="bot-edits-")
+    options = {
+        "telegram": {"latency_ms": 20, "jitter_ms": 10},
+        "openai": {"latency_ms": 200, "jitter_ms": 50},
+    }
+    for service in options.values():
+        service.update(error_rate=0, rate_limit_rate=0, per_token_ms=1, per_kib_ms=1)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    services = context.Process(
+        target=fake_services.serve,
+        args=(args.port, options, {}, corpus, args.seed, ready),
+        daemon=True,
+    )
+    services.start()
+    if not ready.wait(30):
+        sys.exit("The fake services did not start.")
+
+    destinations = [SOURCE_CHAT - index for index in range(args.destinations)]
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_API_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": f"{base}/bot",
+            "TELEGRAM_FILE_URL": f"{base}/file/bot",
+            "OPENAI_API_KEY": "edits",
+            "OPENAI_BASE_URL": f"{base}/v1",
+            "ALLOWED_CHANNELS": ",".join(str(chat) for chat in destinations),
+            "FANOUT_CHATS": f"{SOURCE_CHAT}:"
+            + ",".join(str(chat) for chat in destinations),
+            "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+            "JOURNAL_DB_PATH": os.path.join(workdir, "journal.sqlite3"),
+            "SHARED_STORE_URL": "memory://",
+            "METRICS_PORT": "0",
+            "METRICS_LOG_INTERVAL": "0",
+        }
+    )
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    sys.path.insert(0, os.path.abspath(args.bot_dir))
+    import logging
+
+    import bot
+    import settings
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # A bot without fan-out gets every post in each destination chat
+    sources = [SOURCE_CHAT] if hasattr(settings, "FANOUT_CHATS") else destinations
+
+    try:
+        results = asyncio.run(run(bot, args, sources, corpus))
+    finally:
+        services.terminate()
+        services.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"{args.posts} posts of {args.paragraphs} paragraphs to "
+        f"{args.destinations} chats, one paragraph of each edited"
+    )
+    print(
+        f"{'phase':<6} {'prompt tok':>10} {'compl tok':>10} {'requests':>9} "
+        f"{'p50 ms':>7} {'p95 ms':>7}  telegram calls"
+    )
+    for phase, result in results.items():
+        latencies = sorted(result["latencies"])
+        calls = ", ".join(f"{m} {n}" for m, n in sorted(result["telegram"].items()))
+        print(
+            f"{phase:<6} {result['tokens']['prompt']:>10g} "
+            f"{result['tokens']['completion']:>10g} {result['chat_requests']:>9} "
+            f"{statistics.median(latencies) * 1000:>7.0f} "
+            f"{latencies[int(len(latencies) * 0.95)] * 1000:>7.0f}  {calls}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmarks/extract_audio.py
+"""
+Compares the in-memory ffmpeg audio extraction used for videos and video
+notes with the previous moviepy temp-file round trip.
+
+Each method runs in a fresh process so peak RSS is measured in isolation.
+Run from the repository root:
+
+    python benchmarks/extract_audio.py path/to/video_note.mp4 --runs 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import uuid
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def moviepy_extract(data: bytes) -> BytesIO:
+    """
+    The previous video note path: MP4 to disk, moviepy, MP3 to disk, read back.
+    """
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+
+    if not os.path.exists("./tempfiles"):
+        os.makedirs("./tempfiles")
+    base_path = f"./tempfiles/bench-{uuid.uuid4().hex}"
+    mp4_file = f"{base_path}.mp4"
+    mp3_file = f"{base_path}.mp3"
+    try:
+        with open(mp4_file, "wb") as f:
+            f.write(data)
+        video_clip = VideoFileClip(mp4_file)
+        audio_clip = video_clip.audio
+        audio_clip.write_audiofile(mp3_file, logger=None)
+        audio_clip.close()
+        video_clip.close()
+        with open(mp3_file, "rb") as f:
+            return BytesIO(f.read())
+    finally:
+        for file_path in [mp4_file, mp3_file]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+def ffmpeg_extract(data: bytes) -> BytesIO:
+    from audio import extract_speech_audio
+    from media import MediaFile
+
+    async def _extract():
+        with MediaFile("bench.mp4") as source:
+            source.write(data)
+            with await extract_speech_audio(source, "bench.mp4") as output:
+                return BytesIO(output.read())
+
+    return asyncio.run(_extract())
+
+
+METHODS = {"moviepy": moviepy_extract, "ffmpeg-pipe": ffmpeg_extract}
+
+
+def _run(method: str, path: str, runs: int, results):
+    with open(path, "rb") as f:
+        data = f.read()
+    extract = METHODS[method]
+    extract(data)  # warm up imports and codecs
+
+    latencies = []
+    output_size = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        output_size = len(extract(data).getvalue())
+        latencies.append(time.perf_counter() - started)
+
+    results.put(
+        {
+            "method": method,
+            "latencies": latencies,
+            "output_bytes": output_size,
+            # ru_maxrss is in KiB on Linux
+            "rss_self_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "rss_children_mib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            / 1024,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("video", help="sample MP4 file, e.g. a saved video note")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--methods", nargs="+", default=list(METHODS))
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'method':<12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+        f"{'out KiB':>8} {'RSS MiB':>8} {'ffmpeg MiB':>10}"
+    )
+    for method in args.methods:
+        results = context.Queue()
+        process = context.Process(
+            target=_run, args=(method, args.video, args.runs, results)
+        )
+        process.start()
+        result = results.get()
+        process.join()
+
+        latencies = sorted(result["latencies"])
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(
+            f"{method:<12} {statistics.median(latencies) * 1000:>8.1f} "
+            f"{p95 * 1000:>8.1f} {latencies[-1] * 1000:>8.1f} "
+            f"{result['output_bytes'] / 1024:>8.1f} "
+            f"{result['rss_self_mib']:>8.1f} {result['rss_children_mib']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# benchmarks/fake_services.py
+"""
+Local stand-ins for the Telegram Bot API and the OpenAI chat completion and
+transcription endpoints, used by the benchmarks so they run without network
+access or API keys.
+
+Both services answer with plausible payloads after a configurable latency,
+and fail a configurable share of requests with server errors or 429s
+(with Retry-After), so the bot's retry and rate-limit paths are exercised.
+They run in their own process so they do not compete with the bot for its
+event loop.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import time
+
+import tornado.web
+
+TRANSLATION_PREFIX = "ترجمه: "
+
+
+class FaultInjector:
+    """
+    Adds latency and decides which requests fail, from the service options:
+    `latency_ms`, `jitter_ms`, `error_rate` and `rate_limit_rate`.
+    """
+
+    def __init__(self, options: dict, seed: int):
+        self.options = options
+        self.random = random.Random(seed)
+
+    async def delay(self, extra_ms: float = 0):
+        latency = self.options["latency_ms"] + extra_ms
+        latency += self.random.uniform(0, self.options["jitter_ms"])
+        await asyncio.sleep(latency / 1000)
+
+    def fault(self):
+        """
+        Returns "error", "rate_limit" or None for the next request.
+        """
+        roll = self.random.random()
+        if roll < self.options["rate_limit_rate"]:
+            return "rate_limit"
+        if roll < self.options["rate_limit_rate"] + self.options["error_rate"]:
+            return "error"
+        return None
+
+
+def _translate(text: str) -> str:
+    return TRANSLATION_PREFIX + text
+
+
+class TelegramHandler(tornado.web.RequestHandler):
+    """
+    Answers Bot API methods at /bot<token>/<method>. Parameters arrive form
+    encoded, with JSON-encoded values for nested objects.
+    """
+
+    def initialize(self, state: dict):
+        self.state = state
+
+    def _param(self, name: str, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    def _message(self, **fields) -> dict:
+        message = {
+            "message_id": next(self.state["message_ids"]),
+            "date": int(time.time()),
+            "chat": {"id": int(self._param("chat_id", 0)), "type": "private"},
+        }
+        message.update(fields)
+        return message
+
+    async def post(self, token: str, method: str):
+        faults = self.state["faults"]
+        await faults.delay()
+        fault = faults.fault() if method not in ("getMe", "getFile") else None
+        self.state["requests"][method] = self.state["requests"].get(method, 0) + 1
+        if fault == "rate_limit":
+            self.set_status(429)
+            self.write(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }
+            )
+            return
+        if fault == "error":
+            self.set_status(500)
+            self.write(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            )
+            return
+
+        if method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Benchmark",
+                "username": "benchmark_bot",
+            }
+        elif method == "getFile":
+            file_id = self._param("file_id")
+            kind = file_id.split(":", 1)[0]
+            path = self.state["files"][kind]
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": os.path.getsize(path),
+                "file_path": f"{kind}/{os.path.basename(path)}",
+            }
+        elif method == "getUpdates":
+            # The configured updates, to every poller that has not confirmed them
+            offset = self._param("offset", 0) or 0
+            result = [
+                update
+                for update in self.state["updates"]
+                if update["update_id"] >= offset
+            ]
+            if not result:
+                # Hold the long poll a little instead of answering at once
+                await asyncio.sleep(min(float(self._param("timeout", 0) or 0), 1))
+        elif method == "sendMediaGroup":
+            result = [self._message() for _ in self._param("media", [])]
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(text=self._param("text", ""))
+        elif method.startswith("send"):
+            result = self._message()
+        else:
+            result = True
+        self.write({"ok": True, "result": result})
+
+
+class TelegramFileHandler(tornado.web.RequestHandler):
+    """
+    Serves the sample media at /file/bot<token>/<kind>/<name>.
+    """
+
+    def initialize(self, state: dict):
+        self.state = state
+
+    async def get(self, token: str, kind: str, name: str):
+        await self.state["faults"].delay()
+        with open(self.state["files"][kind], "rb") as f:
+            self.write(f.read())
+
+
+class ChatCompletionsHandler(tornado.web.RequestHandler):
+    """
+    Answers /v1/chat/completions, plain, streamed or as a JSON object (for
+    batched translations). Latency grows with the completion length.
+    """
+
+    def initialize(self, state: dict):
+        self.state = state
+
+    def _error(self, fault: str):
+        if fault == "rate_limit":
+            self.set_status(429)
+            self.set_header("retry-after-ms", "200")
+            self.write(
+                {
+                    "error": {
+                        "message": "Rate limit reached",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                }
+            )
+        else:
+            self.set_status(500)
+            self.write({"error": {"message": "Server error", "type": "server_error"}})
+
+    async def post(self):
+        faults = self.state["faults"]
+        body = json.loads(self.request.body)
+        text = body["messages"][-1]["content"].split("\n\n", 1)[-1]
+        self.state["requests"]["chat"] = self.state["requests"].get("chat", 0) + 1
+
+        if body.get("response_format", {}).get("type") == "json_object":
+            segments = json.loads(text)
+            content = json.dumps(
+                {key: _translate(value) for key, value in segments.items()},
+                ensure_ascii=False,
+            )
+        else:
+            content = _translate(text)
+        prompt_tokens = len(self.request.body) // 4
+        completion_tokens = len(content.encode()) // 3 + 1
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        per_token_ms = self.state["per_token_ms"]
+
+        fault = faults.fault()
+        if fault:
+            await faults.delay()
+            self._error(fault)
+            return
+
+        base = {
+            "id": f"chatcmpl-{next(self.state['ids'])}",
+            "created": int(time.time()),
+            "model": body["model"],
+        }
+        if not body.get("stream"):
+            await faults.delay(completion_tokens * per_token_ms)
+            self.write(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+            return
+
+        await faults.delay()
+        self.set_header("Content-Type", "text/event-stream")
+        pieces = [content[i : i + 40] for i in range(0, len(content), 40)]
+        for piece in pieces:
+            await asyncio.sleep(per_token_ms * 10 / 1000)
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                ],
+            }
+            self.write(f"data: {json.dumps(chunk)}\n\n")
+            await self.flush()
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": []}
+            self.write(f"data: {json.dumps({**chunk, 'usage': usage})}\n\n")
+        self.write("data: [DONE]\n\n")
+
+
+class TranscriptionsHandler(tornado.web.RequestHandler):
+    """
+    Answers /v1/audio/transcriptions with a slice of the corpus. Latency
+    grows with the size of the uploaded audio.
+    """
+
+    def initialize(self, state: dict):
+        self.state = state
+
+    async def post(self):
+        faults = self.state["faults"]
+        upload = self.request.files["file"][0]
+        self.state["requests"]["transcription"] = (
+            self.state["requests"].get("transcription", 0) + 1
+        )
+        fault = faults.fault()
+        await faults.delay(len(upload["body"]) / 1024 * self.state["per_kib_ms"])
+        if fault:
+            self.set_status(429 if fault == "rate_limit" else 500)
+            if fault == "rate_limit":
+                self.set_header("retry-after-ms", "200")
+            self.write({"error": {"message": fault, "type": "requests"}})
+            return
+        words = self.state["corpus"].split()
+        start = faults.random.randrange(max(1, len(words) - 120))
+        result = {"text": " ".join(words[start : start + 120])}
+        if self.get_argument("response_format", None) == "verbose_json":
+            # The corpus is Hindi
+            result.update({"language": "hindi", "duration": 8.0, "segments": []})
+        self.write(result)
+
+
+class ModelsHandler(tornado.web.RequestHandler):
+    """
+    Answers /v1/models/<model>, which the bot requests to open its
+    connection at startup.
+    """
+
+    def get(self, model: str):
+        self.write({"id": model, "object": "model", "created": 0, "owned_by": "fake"})
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, state: dict):
+        self.state = state
+
+    def get(self):
+        self.write(self.state["requests"])
+
+
+def make_app(options: dict, files: dict, corpus: str, seed: int):
+    """
+    Builds the tornado application serving both fake services.
+    """
+    telegram = {
+        "faults": FaultInjector(options["telegram"], seed),
+        "files": files,
+        "message_ids": itertools.count(1_000_000),
+        "updates": options["telegram"].get("updates", []),
+        "requests": {},
+    }
+    openai = {
+        "faults": FaultInjector(options["openai"], seed + 1),
+        "per_token_ms": options["openai"]["per_token_ms"],
+        "per_kib_ms": options["openai"]["per_kib_ms"],
+        "corpus": corpus,
+        "ids": itertools.count(1),
+        "requests": {},
+    }
+    return tornado.web.Application(
+        [
+            (r"/bot([^/]+)/(\w+)", TelegramHandler, {"state": telegram}),
+            (
+                r"/file/bot([^/]+)/(\w+)/([^/]+)",
+                TelegramFileHandler,
+                {"state": telegram},
+            ),
+            (r"/v1/chat/completions", ChatCompletionsHandler, {"state": openai}),
+            (r"/v1/audio/transcriptions", TranscriptionsHandler, {"state": openai}),
+            (r"/v1/models/([^/]+)", ModelsHandler),
+            (r"/stats/telegram", StatsHandler, {"state": telegram}),
+            (r"/stats/openai", StatsHandler, {"state": openai}),
+        ]
+    )
+
+
+def serve(port: int, options: dict, files: dict, corpus: str, seed: int, ready):
+    """
+    Runs both fake services on `port` until the process is terminated.
+    Sets the `ready` event once listening.
+    """
+
+    # Failed requests are expected, don't log each of them
+    logging.getLogger("tornado.access").setLevel(logging.CRITICAL)
+
+    async def _main():
+        app = make_app(options, files, corpus, seed)
+        app.listen(port, address="127.0.0.1")
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(_main())
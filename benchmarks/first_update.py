@@ -0,0 +1,190 @@
+# benchmarks/first_update.py
+"""
+Measures how long a freshly launched bot takes to handle its first update.
+
+The bot is started as its own process with long polling against the local
+fake Telegram and OpenAI servers, which hold one text message for it. Each
+run reports the time from launch until the first reply reaches the fake
+Telegram, and the startup milestones the bot logs itself (imports loaded,
+ready for updates, first update handled). Every run gets fresh caches, so
+the message is really translated. Run from the repository root:
+
+    python benchmarks/first_update.py --runs 5
+
+Pass --bot-dir with another checkout of the bot to compare two versions
+against the same fake servers.
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services  # noqa: E402
+from load_test import TOKEN, fetch_stats  # noqa: E402
+
+FIRST_UPDATE_LOG = re.compile(r"First update handled (.*)\.$")
+CHAT_ID = 1
+
+
+def first_update(corpus: str) -> dict:
+    words = corpus.split()[:30]
+    message = {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": CHAT_ID, "type": "private", "first_name": "Startup"},
+        "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Startup"},
+        "text": " ".join(words),
+    }
+    return {"update_id": 1, "message": message}
+
+
+def replies(port: int) -> int:
+    stats = fetch_stats(port, "telegram")
+    return stats.get("sendMessage", 0)
+
+
+def launch(args, workdir: str, run: int) -> dict:
+    """
+    Launches the bot, waits for its first reply and for it to log the first
+    handled update, and stops it. Returns the measured times.
+    """
+    base = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_API_TOKEN=TOKEN,
+        TELEGRAM_API_URL=f"{base}/bot",
+        TELEGRAM_FILE_URL=f"{base}/file/bot",
+        OPENAI_API_KEY="startup",
+        OPENAI_BASE_URL=f"{base}/v1",
+        ALLOWED_USERS=str(CHAT_ID),
+        CACHE_DB_PATH=os.path.join(workdir, f"cache-{run}.sqlite3"),
+        JOURNAL_DB_PATH=os.path.join(workdir, f"journal-{run}.sqlite3"),
+        SHARED_STORE_URL="memory://",
+        METRICS_PORT="0",
+        METRICS_LOG_INTERVAL="0",
+        HF_HUB_OFFLINE="1",
+    )
+    sent = replies(args.port)
+    report = None
+    logged = threading.Event()
+
+    def _read_log(stream):
+        nonlocal report
+        for line in stream:
+            match = FIRST_UPDATE_LOG.search(line.rstrip())
+            if match:
+                report = match.group(1)
+                logged.set()
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "bot.py"],
+        cwd=args.bot_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    reader = threading.Thread(target=_read_log, args=(process.stderr,), daemon=True)
+    reader.start()
+    try:
+        reply = None
+        while time.perf_counter() - started < args.timeout:
+            if replies(args.port) > sent:
+                reply = time.perf_counter() - started
+                break
+            if process.poll() is not None:
+                break
+            time.sleep(0.005)
+        # Versions that do not report their startup never log it
+        logged.wait(2 if reply is not None else 0)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return {"reply": reply, "report": report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--bot-dir", default=ROOT, help="checkout of the bot to run")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per run")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--openai-latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "trans.txt"), encoding="utf-8") as f:
+        corpus = f.read()
+    options = {
+        "telegram": {
+            "latency_ms": args.telegram_latency_ms,
+            "jitter_ms": 0,
+            "error_rate": 0,
+            "rate_limit_rate": 0,
+            "updates": [first_update(corpus)],
+        },
+        "openai": {
+            "latency_ms": args.openai_latency_ms,
+            "jitter_ms": 0,
+            "per_token_ms": 0,
+            "per_kib_ms": 0,
+            "error_rate": 0,
+            "rate_limit_rate": 0,
+        },
+    }
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    services = context.Process(
+        target=fake_services.serve,
+        args=(args.port, options, {}, corpus, 1, ready),
+        daemon=True,
+    )
+    services.start()
+    if not ready.wait(30):
+        sys.exit("The fake services did not start.")
+
+    workdir = tempfile.mkdtemp(prefix="bot-startup-")
+    results = []
+    try:
+        for run in range(args.runs):
+            result = launch(args, workdir, run)
+            results.append(result)
+            reply = result["reply"]
+            print(
+                f"run {run + 1}: first reply "
+                f"{'none' if reply is None else f'{reply:.2f}s'}, "
+                f"bot reports {result['report'] or 'nothing'}"
+            )
+    finally:
+        services.terminate()
+        services.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    times = [result["reply"] for result in results if result["reply"] is not None]
+    if not times:
+        sys.exit("FAILED: the bot never replied")
+    print(
+        f"\nlaunch to first reply: p50 {statistics.median(times):.2f}s, "
+        f"min {min(times):.2f}s, max {max(times):.2f}s over {len(times)} runs"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+# benchmarks/load_test.py
+"""
+Load-tests the bot end to end against local fake Telegram and OpenAI servers.
+
+Synthetic updates (texts, albums, voice messages, video notes, audio files,
+subtitle documents and long transcripts from trans.txt) are fed into the real Application at a
+fixed rate, regardless of how fast the bot keeps up, and every reply goes
+through the bot's Telegram and OpenAI clients, rate limiters and retries to
+the fake servers. Their latency, error rate and share of 429s are
+configurable. Reports p50/p95/p99 latency per message kind, the messages
+turned away by admission control, throughput and peak memory, and needs no
+network access. Run from the repository root:
+
+    python benchmarks/load_test.py --messages 500 --rate 20
+
+YouTube links are not part of the traffic, since downloading them needs the
+network.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services  # noqa: E402
+
+TOKEN = "123456:load-test"
+DEFAULT_MIX = "text=60,long=10,album=10,voice=10,video_note=5,audio=5"
+KINDS = ["text", "long", "album", "voice", "video_note", "audio", "document"]
+ALBUM_SIZE = 4
+SUBTITLE_CUES = 60
+
+# ffmpeg arguments producing the sample media served by the fake Telegram
+SAMPLES = {
+    "voice": (
+        "voice.ogg",
+        ["-f", "lavfi", "-i", "sine=frequency=220:duration=8"]
+        + ["-ac", "1", "-c:a", "libopus", "-b:a", "24k"],
+    ),
+    "video_note": (
+        "video_note.mp4",
+        ["-f", "lavfi", "-i", "testsrc=size=240x240:rate=25:duration=10"]
+        + ["-f", "lavfi", "-i", "sine=frequency=330:duration=10"]
+        + ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest"],
+    ),
+    "audio": (
+        "audio.mp3",
+        ["-f", "lavfi", "-i", "sine=frequency=440:duration=150"]
+        + ["-ac", "1", "-c:a", "libmp3lame", "-b:a", "32k"],
+    ),
+}
+
+
+def parse_mix(mix: str) -> dict:
+    """
+    Parses "kind=weight,..." into a dict of weights.
+    """
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown message kind: {kind}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def make_samples(directory: str, kinds: set, corpus: str) -> dict:
+    """
+    Generates the sample media the mix needs with ffmpeg, and a subtitle
+    file cut from the corpus, and returns their paths by kind.
+    """
+    ffmpeg = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+    files = {}
+    for kind in kinds & set(SAMPLES):
+        name, args = SAMPLES[kind]
+        path = os.path.join(directory, name)
+        subprocess.run(
+            [ffmpeg, "-y", "-loglevel", "error", *args, path],
+            check=True,
+        )
+        files[kind] = path
+    if "document" in kinds:
+        words = corpus.split()
+        path = os.path.join(directory, "subtitles.srt")
+        with open(path, "w", encoding="utf-8") as f:
+            for cue in range(SUBTITLE_CUES):
+                text = " ".join(words[cue * 8 : cue * 8 + 8])
+                f.write(
+                    f"{cue + 1}\n00:00:{cue:02d},000 --> 00:00:{cue:02d},900\n"
+                    f"{text}\n\n"
+                )
+        files["document"] = path
+    return files
+
+
+class TrafficGenerator:
+    """
+    Produces the raw update dicts of the synthetic traffic.
+    """
+
+    def __init__(self, corpus: str, chats: int, files: dict, seed: int):
+        self.words = corpus.split()
+        self.corpus = " ".join(self.words)
+        self.chats = chats
+        self.files = files
+        self.random = random.Random(seed)
+        self.update_id = 0
+        self.message_id = 0
+
+    def _text(self, min_words: int, max_words: int) -> str:
+        count = self.random.randint(min_words, max_words)
+        start = self.random.randrange(max(1, len(self.words) - count))
+        return " ".join(self.words[start : start + count])
+
+    def _file(self, kind: str, **fields) -> dict:
+        unique = f"{kind}-{self.update_id}"
+        return {
+            "file_id": f"{kind}:{unique}",
+            "file_unique_id": unique,
+            "file_size": os.path.getsize(self.files[kind]),
+            **fields,
+        }
+
+    def _update(self, chat_id: int, **fields) -> dict:
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            **fields,
+        }
+        return {"update_id": self.update_id, "message": message}
+
+    def make(self, kind: str) -> list:
+        """
+        Returns the updates of one message of `kind`; an album is several.
+        """
+        chat_id = self.random.randint(1, self.chats)
+        if kind == "text":
+            return [self._update(chat_id, text=self._text(5, 40))]
+        if kind == "long":
+            # A long transcript, split by the bot into translated chunks
+            start = self.random.randrange(max(1, len(self.corpus) - 4000))
+            return [self._update(chat_id, text=self.corpus[start : start + 4000])]
+        if kind == "album":
+            group_id = f"album-{self.update_id}"
+            updates = []
+            for index in range(ALBUM_SIZE):
+                photo = {
+                    "file_id": f"photo:{self.update_id}",
+                    "file_unique_id": f"photo-{self.update_id}",
+                    "width": 1280,
+                    "height": 720,
+                }
+                updates.append(
+                    self._update(
+                        chat_id,
+                        media_group_id=group_id,
+                        photo=[photo],
+                        caption=self._text(3, 15) if index == 0 else None,
+                    )
+                )
+            return updates
+        if kind == "voice":
+            return [self._update(chat_id, voice=self._file("voice", duration=8))]
+        if kind == "video_note":
+            video_note = self._file("video_note", length=240, duration=10)
+            return [self._update(chat_id, video_note=video_note)]
+        if kind == "audio":
+            return [self._update(chat_id, audio=self._file("audio", duration=150))]
+        if kind == "document":
+            document = self._file(
+                "document", file_name="subtitles.srt", mime_type="application/x-subrip"
+            )
+            return [self._update(chat_id, document=document)]
+        raise ValueError(kind)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_load(bot, args, weights: dict, files: dict, corpus: str) -> dict:
+    """
+    Feeds the traffic into the bot and returns the measured latencies by
+    message kind, the wall time, the messages turned away by admission
+    control and the messages that never finished.
+    """
+    from telegram import Update
+
+    generator = TrafficGenerator(corpus, args.chats, files, args.seed)
+    started_at = {}  # update id or media group id -> (kind, start time)
+    latencies = {kind: [] for kind in weights}
+    shed = {kind: 0 for kind in weights}
+    finished = asyncio.Event()
+    remaining = args.messages
+
+    def _done(key, admitted=True):
+        nonlocal remaining
+        entry = started_at.pop(key, None)
+        if entry is None:
+            return
+        kind, started = entry
+        if admitted:
+            latencies[kind].append(time.perf_counter() - started)
+        else:
+            shed[kind] += 1
+        remaining -= 1
+        if not remaining:
+            finished.set()
+
+    handle_message = bot.handle_message
+    process_media_group = bot.process_media_group
+    admit_update = bot.admit_update
+
+    async def timed_handle_message(update, context):
+        try:
+            await handle_message(update, context)
+        finally:
+            if not update.effective_message.media_group_id:
+                _done(update.update_id)
+
+    async def timed_process_media_group(media_group_id, chat_id, context, ticket):
+        try:
+            await process_media_group(media_group_id, chat_id, context, ticket)
+        finally:
+            _done(media_group_id)
+
+    async def counted_admit_update(update, job_class):
+        ticket = await admit_update(update, job_class)
+        if ticket is None:
+            _done(update.update_id, admitted=False)
+        return ticket
+
+    # Handlers are bound when the application is built
+    bot.handle_message = timed_handle_message
+    bot.process_media_group = timed_process_media_group
+    bot.admit_update = counted_admit_update
+    application = bot.build_application()
+    await application.initialize()
+    await application.start()
+
+    kinds = list(weights)
+    interval = 1 / args.rate
+    begin = time.perf_counter()
+    for index in range(args.messages):
+        # Open loop: messages arrive on schedule however far behind the bot is
+        delay = begin + index * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = generator.random.choices(kinds, [weights[k] for k in kinds])[0]
+        updates = generator.make(kind)
+        message = updates[0]["message"]
+        key = message.get("media_group_id") or updates[0]["update_id"]
+        started_at[key] = (kind, time.perf_counter())
+        for data in updates:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    try:
+        await asyncio.wait_for(finished.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    wall_time = time.perf_counter() - begin
+
+    await application.stop()
+    await application.shutdown()
+    return {
+        "latencies": latencies,
+        "shed": shed,
+        "wall_time": wall_time,
+        "unfinished": len(started_at),
+    }
+
+
+def fetch_stats(port: int, service: str) -> dict:
+    url = f"http://127.0.0.1:{port}/stats/{service}"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10, help="messages per second")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--telegram-jitter-ms", type=float, default=20)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-429-rate", type=float, default=0.01)
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-jitter-ms", type=float, default=200)
+    parser.add_argument("--openai-per-token-ms", type=float, default=2)
+    parser.add_argument("--openai-per-kib-ms", type=float, default=5)
+    parser.add_argument("--openai-error-rate", type=float, default=0.01)
+    parser.add_argument("--openai-429-rate", type=float, default=0.02)
+    parser.add_argument(
+        "--max-p95-ms", type=float, help="fail if any kind's p95 is above this"
+    )
+    parser.add_argument("--max-rss-mb", type=float, help="fail if the bot used more")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    weights = args.mix
+
+    with open(os.path.join(ROOT, "trans.txt"), encoding="utf-8") as f:
+        corpus = f.read()
+    workdir = tempfile.mkdtemp(prefix="bot-load-test-")
+    files = make_samples(workdir, set(weights), corpus)
+
+    options = {
+        "telegram": {
+            "latency_ms": args.telegram_latency_ms,
+            "jitter_ms": args.telegram_jitter_ms,
+            "error_rate": args.telegram_error_rate,
+            "rate_limit_rate": args.telegram_429_rate,
+        },
+        "openai": {
+            "latency_ms": args.openai_latency_ms,
+            "jitter_ms": args.openai_jitter_ms,
+            "per_token_ms": args.openai_per_token_ms,
+            "per_kib_ms": args.openai_per_kib_ms,
+            "error_rate": args.openai_error_rate,
+            "rate_limit_rate": args.openai_429_rate,
+        },
+    }
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    services = context.Process(
+        target=fake_services.serve,
+        args=(args.port, options, files, corpus, args.seed, ready),
+        daemon=True,
+    )
+    services.start()
+    if not ready.wait(30):
+        sys.exit("The fake services did not start.")
+
+    # The bot reads its configuration when imported
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_API_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": f"{base}/bot",
+            "TELEGRAM_FILE_URL": f"{base}/file/bot",
+            "OPENAI_API_KEY": "load-test",
+            "OPENAI_BASE_URL": f"{base}/v1",
+            "ALLOWED_USERS": ",".join(str(i) for i in range(1, args.chats + 1)),
+            "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+            "JOURNAL_DB_PATH": os.path.join(workdir, "journal.sqlite3"),
+            "SHARED_STORE_URL": "memory://",
+            "METRICS_PORT": "0",
+            "METRICS_LOG_INTERVAL": "0",
+        }
+    )
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    import logging
+
+    import bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        result = asyncio.run(run_load(bot, args, weights, files, corpus))
+        telegram_stats = fetch_stats(args.port, "telegram")
+        openai_stats = fetch_stats(args.port, "openai")
+    finally:
+        services.terminate()
+        services.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # ru_maxrss is in KiB on Linux; children are ffmpeg and the fake services
+    rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss_mib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    latencies = result["latencies"]
+    done = sum(len(values) for values in latencies.values())
+    shed = sum(result["shed"].values())
+    report = {
+        "messages": args.messages,
+        "completed": done,
+        "shed": shed,
+        "unfinished": result["unfinished"],
+        "wall_time_s": round(result["wall_time"], 2),
+        "throughput_per_s": round(done / result["wall_time"], 2),
+        "rss_mib": round(rss_mib, 1),
+        "children_rss_mib": round(children_rss_mib, 1),
+        "telegram_requests": telegram_stats,
+        "openai_requests": openai_stats,
+        "kinds": {
+            kind: {
+                "count": len(values),
+                "shed": result["shed"][kind],
+                "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+            for kind, values in latencies.items()
+        },
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(
+            f"{'kind':<12} {'count':>6} {'shed':>5} "
+            f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        )
+        for kind, row in report["kinds"].items():
+            print(
+                f"{kind:<12} {row['count']:>6} {row['shed']:>5} {row['p50_ms']:>9.1f} "
+                f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+            )
+        print(
+            f"\n{done}/{args.messages} messages in {report['wall_time_s']}s "
+            f"({report['throughput_per_s']}/s), {shed} turned away, "
+            f"{result['unfinished']} unfinished"
+        )
+        print(
+            f"peak RSS: bot {report['rss_mib']} MiB, "
+            f"ffmpeg and fake services {report['children_rss_mib']} MiB"
+        )
+        print(f"Telegram requests: {telegram_stats}")
+        print(f"OpenAI requests: {openai_stats}")
+
+    failures = []
+    if result["unfinished"]:
+        failures.append(f"{result['unfinished']} messages did not finish")
+    if args.max_p95_ms is not None:
+        for kind, row in report["kinds"].items():
+            if row["p95_ms"] > args.max_p95_ms:
+                failures.append(f"{kind} p95 {row['p95_ms']} ms > {args.max_p95_ms}")
+    if args.max_rss_mb is not None and rss_mib > args.max_rss_mb:
+        failures.append(f"peak RSS {rss_mib:.1f} MiB > {args.max_rss_mb}")
+    if failures:
+        sys.exit("FAILED: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# benchmarks/split_message.py
+"""
+Compares the message splitter with the previous line-concatenating one on
+multi-megabyte Persian transcripts.
+
+The transcript is synthetic: Persian sentences with zero-width non-joiners,
+diacritics, emoji and numbers, in paragraphs and long unbroken lines, as
+Whisper produces them. Besides the time, every chunk is checked against
+Telegram's limit of 4096 UTF-16 code units and for graphemes cut in two.
+Run from the repository root:
+
+    python benchmarks/split_message.py --megabytes 4 --runs 5
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from utils import _joins_previous, split_message, utf16_length  # noqa: E402
+
+SENTENCES = [
+    "امروز بازار طلا با نوسان زیادی همراه بود و قیمت‌ها به سطح حمایت رسیدند.",
+    "معامله‌گران منتظر انتشار داده‌های تورم آمریکا هستند 📊",
+    "اگر قیمت بالای ۲۳۵۰ دلار بسته شود، می‌توانیم انتظار رشد بیشتری داشته باشیم!",
+    "مدیریت ریسک را فراموش نکنید؛ حد ضرر همیشه لازم است 👍🏽",
+    "بِسْمِ اللَّهِ، این جلسه درباره‌ی تحلیل تکنیکال و الگوهای شمعی است.",
+    "آیا روند صعودی ادامه پیدا می‌کند؟ نظر شما چیست 🤔",
+    "حجم معاملات در جلسه‌ی آسیایی کمتر از میانگین هفته‌ی گذشته بود.",
+    "🇮🇷 بازار سهام تهران امروز با رشد ۱٫۲ درصدی بسته شد.",
+]
+
+
+def make_transcript(megabytes: float, seed: int) -> str:
+    generator = random.Random(seed)
+    parts = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        # Whisper output often has no line breaks for minutes of speech
+        count = generator.choice([3, 8, 40, 200])
+        paragraph = " ".join(generator.choice(SENTENCES) for _ in range(count))
+        parts.append(paragraph)
+        size += len(paragraph.encode("utf-8"))
+    return "\n\n".join(parts)
+
+
+def previous_split_message(message, max_length=4096):
+    """
+    The previous splitter, counting characters and cutting long lines at
+    fixed offsets.
+    """
+    if len(message) <= max_length:
+        return [message]
+
+    chunks = []
+    current_chunk = ""
+
+    for line in message.split("\n"):
+        if len(current_chunk) + len(line) + 1 > max_length:
+            if current_chunk:
+                chunks.append(current_chunk)
+                current_chunk = ""
+        if len(line) + 1 > max_length:
+            for i in range(0, len(line), max_length):
+                chunks.append(line[i : i + max_length])
+        else:
+            current_chunk += line + "\n"
+
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
+
+
+METHODS = {
+    "previous": previous_split_message,
+    "split_message": split_message,
+    "split_html": lambda text: split_message(text, html=True),
+}
+
+
+def check(text: str, chunks: list) -> tuple:
+    """
+    Counts the chunks over Telegram's limit and the graphemes cut in two.
+    """
+    too_long = sum(1 for chunk in chunks if utf16_length(chunk) > 4096)
+    broken = 0
+    position = 0
+    for chunk in chunks[:-1]:
+        position = text.index(chunk, position) + len(chunk)
+        if position < len(text) and (
+            _joins_previous(text[position]) or text[position - 1] in "\u200c\u200d"
+        ):
+            broken += 1
+    return too_long, broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megabytes", type=float, default=4)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--methods", nargs="+", default=list(METHODS))
+    args = parser.parse_args()
+
+    text = make_transcript(args.megabytes, args.seed)
+    print(
+        f"{len(text.encode('utf-8')) / 1024 / 1024:.1f} MiB transcript, "
+        f"{len(text)} characters, {utf16_length(text)} UTF-16 code units"
+    )
+    print(
+        f"{'method':<14} {'p50 ms':>8} {'max ms':>8} {'MiB/s':>8} "
+        f"{'chunks':>7} {'too long':>9} {'cut graphemes':>14}"
+    )
+    for method in args.methods:
+        split = METHODS[method]
+        latencies = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            chunks = split(text)
+            latencies.append(time.perf_counter() - started)
+        too_long, broken = check(text, chunks)
+        median = statistics.median(latencies)
+        print(
+            f"{method:<14} {median * 1000:>8.1f} {max(latencies) * 1000:>8.1f} "
+            f"{args.megabytes / median:>8.1f} {len(chunks):>7} {too_long:>9} "
+            f"{broken:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
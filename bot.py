@@ -3,11 +3,21 @@
 import os
 import logging
 import asyncio
+import json
+import math
+import multiprocessing
 import re
-from io import BytesIO
-from moviepy.video.io.VideoFileClip import VideoFileClip
+import signal
+import socket
+import tempfile
+import time
+from urllib.parse import urlparse
+
+# Imported first, to take the launch time before the other modules load
+import startup
 
 from telegram import (
+    Message,
     Update,
     InputMediaPhoto,
     InputMediaVideo,
@@ -20,11 +30,49 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.error import BadRequest, RetryAfter
+from dispatch import ChatOrderedUpdateProcessor, TEXT_JOB, MEDIA_JOB
+from admission import (
+    JobCost,
+    JobRejected,
+    admission,
+    QUEUE_FULL,
+    SENDER_BUSY,
+    RATE_LIMITED,
+)
+from chunking import count_tokens, warm_up_tokenizer
+from connections import SharedHTTPXRequest, close_http_client, prewarm_connections
+from audio import extract_speech_audio
+from posts import join_translation, load_post, save_post, translate_paragraphs
+from media import MediaFile, download_media, media_budget, stream_download
+from documents import (
+    DocumentError,
+    document_format,
+    translate_document,
+    translated_file_name,
+)
+from ratelimit import TelegramRateLimiter, openai_limiter
+from store import shared_store
+from journal import journal, REPLIED, TRANSLATED, SENT, FAILED
+from workers import document_pool, media_pool
+from translators import local_translator
+from transcribers import local_transcriber
+import metrics
 from utils import (
+    fast_translator,
+    local_translation_enabled,
+    translation_batcher,
     translate_text,
-    transcribe_audio,
+    translate_text_stream,
+    translate_transcription,
+    transcribe_cached,
+    transcribe_stream,
+    transcribe_youtube,
+    youtube_transcription_key,
+    iter_message_chunks,
+    openai_client,
     split_message,
-    download_youtube_audio,
+    TRANSLATION_ERROR,
 )
 import settings
 
@@ -34,11 +82,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Dictionary to keep track of media groups
-media_groups = {}
+# Media groups are collected in the shared store, since the items of one
+# album may reach different bot processes
 MEDIA_GROUP_TIMEOUT = (
     settings.MEDIA_GROUP_TIMEOUT
-)  # seconds to wait before processing media group
+)  # longest time to wait for the rest of a media group
+MEDIA_GROUP_DEBOUNCE = (
+    settings.MEDIA_GROUP_DEBOUNCE
+)  # a media group is complete once no item arrived for this long
+MEDIA_GROUP_MAX_SIZE = 10  # Telegram albums hold at most 10 items
+MEDIA_GROUP_POLL_INTERVAL = 0.1  # seconds between checks for new group items
+MEDIA_GROUP_STATE_TTL = 10 * MEDIA_GROUP_TIMEOUT  # seconds
+STREAM_PLACEHOLDER = "…"
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # bytes
+YOUTUBE_AUDIO_BYTES_PER_SECOND = 16 * 1024  # a 128 kbit/s audio stream
+QUEUED_NOTICE_DELAY = 2  # seconds a media job may wait before its sender is told
+REJECTION_NOTICES = {
+    QUEUE_FULL: "The bot is busy right now. Please send this again in a few minutes.",
+    SENDER_BUSY: (
+        "Too many of your messages are still waiting. "
+        "Please send this again once they are done."
+    ),
+    RATE_LIMITED: "You are sending too much at once. Please wait before sending more.",
+}
+
+# When each chat was last told that the bot is busy
+rejection_notices_sent = {}
+
+# Journaled jobs taken over from a stopped bot process, by update id
+resumed_jobs = {}
 
 
 def is_youtube_url(text: str) -> bool:
@@ -49,6 +121,171 @@ def is_youtube_url(text: str) -> bool:
     return bool(re.search(youtube_regex, text))
 
 
+def downloadable_document_format(document):
+    """
+    Returns the format of a document the bot can download and translate,
+    or None when only its caption is translated.
+    """
+    format = document_format(document.file_name, document.mime_type)
+    # Bots can only download files up to 20 MB
+    if format and (
+        not document.file_size or document.file_size <= TELEGRAM_DOWNLOAD_LIMIT
+    ):
+        return format
+    return None
+
+
+def needs_download(message) -> bool:
+    """
+    Tells whether handling a message downloads or transcribes media, rather
+    than only translating its text or caption.
+    """
+    if message.audio or message.voice or message.video_note:
+        return True
+    if message.video:
+        return not message.video.file_size or (
+            message.video.file_size <= TELEGRAM_DOWNLOAD_LIMIT
+        )
+    if message.document:
+        return downloadable_document_format(message.document) is not None
+    return bool(message.text and is_youtube_url(message.text))
+
+
+def classify_update(update: Update) -> str:
+    """
+    Sorts an update into the text or media job lane of the dispatcher.
+    Anything that needs a download or transcription is a media job;
+    captions, album items and texts are text jobs.
+    """
+    message = update.effective_message
+    if message is None:
+        return TEXT_JOB
+    if settings.EDIT_TRACKING and message.edit_date:
+        # Only the text or caption of an edited message is translated again
+        return TEXT_JOB
+    if message.media_group_id:
+        # Album items are only collected, so an album is never held up
+        # behind transcriptions; the album is then handled as a text job
+        return TEXT_JOB
+    return MEDIA_JOB if needs_download(message) else TEXT_JOB
+
+
+def estimate_job_cost(message) -> JobCost:
+    """
+    Estimates the work a message causes from what Telegram reports before
+    anything is downloaded: the tokens of its text or caption, the length
+    of its audio and the size of its file.
+    """
+    text = message.text or message.caption
+    tokens = count_tokens(text) if text else 0
+    if (settings.EDIT_TRACKING and message.edit_date) or not needs_download(message):
+        return JobCost(tokens=tokens)
+    if message.text and is_youtube_url(message.text):
+        seconds = settings.YOUTUBE_COST_SECONDS
+        return JobCost(
+            seconds=seconds, bytes=int(seconds * YOUTUBE_AUDIO_BYTES_PER_SECOND)
+        )
+    media = (
+        message.audio
+        or message.video
+        or message.voice
+        or message.video_note
+        or message.document
+    )
+    return JobCost(
+        tokens=tokens,
+        seconds=getattr(media, "duration", None) or 0,
+        bytes=min(media.file_size or 0, TELEGRAM_DOWNLOAD_LIMIT),
+    )
+
+
+async def admit_update(update: Update, job_class: str):
+    """
+    Admits an update into the queue of its job class on arrival, before it
+    waits for its turn. Returns its admission ticket, or None when it is
+    turned away; its sender is then told the bot is busy. Media jobs that
+    cannot start right away tell their sender their place in the queue.
+    """
+    message = update.effective_message
+    if message is None or not is_authorized(message) or message.media_group_id:
+        # Dropped right away by handle_message, or an album item, which is
+        # only collected; the album is admitted once, as a whole, by
+        # collect_media_group_item
+        return admission.admit(job_class, JobCost(), None, force=True)
+
+    user_id = message.from_user.id if message.from_user else None
+    try:
+        ticket = admission.admit(
+            job_class,
+            estimate_job_cost(message),
+            message.chat.id,
+            user_id,
+            # Jobs interrupted by a restart were admitted before
+            force=update.update_id in resumed_jobs,
+        )
+    except JobRejected as e:
+        logger.warning(f"Turned away update {update.update_id}: {e}")
+        asyncio.create_task(notify_rejected(message, e))
+        return None
+    if job_class == MEDIA_JOB:
+        asyncio.create_task(notify_queued(message, ticket))
+    return ticket
+
+
+async def notify_queued(message, ticket):
+    """
+    Tells the sender of a job that is still waiting after
+    QUEUED_NOTICE_DELAY seconds its place in the queue.
+    """
+    if await ticket.wait_started(QUEUED_NOTICE_DELAY):
+        return
+    try:
+        await message.get_bot().send_message(
+            chat_id=message.chat.id,
+            text=f"⏳ Busy, queued at position {ticket.position()}. "
+            "Your message will be handled in turn.",
+            reply_to_message_id=message.message_id,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to send queue position: {e}")
+
+
+async def notify_rejected(message, error: JobRejected):
+    """
+    Tells the sender of a job that was turned away why, at most once every
+    ADMISSION_NOTICE_INTERVAL seconds per chat.
+    """
+    chat_id = message.chat.id
+    now = time.monotonic()
+    if now - rejection_notices_sent.get(chat_id, -math.inf) < (
+        settings.ADMISSION_NOTICE_INTERVAL
+    ):
+        return
+    if len(rejection_notices_sent) > 10_000:
+        rejection_notices_sent.clear()
+    rejection_notices_sent[chat_id] = now
+    try:
+        await message.get_bot().send_message(
+            chat_id=chat_id,
+            text=REJECTION_NOTICES[error.reason],
+            reply_to_message_id=message.message_id,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to send busy notice: {e}")
+
+
+def message_kind(message) -> str:
+    """
+    Names the kind of content a message carries, for metrics.
+    """
+    for kind in ["photo", "video", "audio", "document", "voice", "video_note"]:
+        if getattr(message, kind):
+            return kind
+    if message.text:
+        return "youtube" if is_youtube_url(message.text) else "text"
+    return "other"
+
+
 def is_authorized(message) -> bool:
     """
     Check if the message is from an authorized source (allowed user, channel, or group).
@@ -68,6 +305,221 @@ def is_authorized(message) -> bool:
     return False
 
 
+def destinations(message) -> list:
+    """
+    Returns the chats the translation of `message` is sent to: the
+    FANOUT_CHATS destinations of its chat, or else the chat itself.
+    """
+    return settings.FANOUT_CHATS.get(message.chat.id) or [message.chat.id]
+
+
+async def deliver(message, send) -> dict:
+    """
+    Sends the translation of `message`, computed once, to all its
+    destinations concurrently with the coroutine function
+    `send(chat_id, reply_to_message_id)`, which returns the ids of the
+    messages it sent. Only the message's own chat gets a reply; the others
+    get a new message. Returns the sent message ids by destination. Failed
+    destinations are logged and left out, unless all of them failed.
+    """
+    chats = destinations(message)
+    results = await asyncio.gather(
+        *(
+            send(chat_id, message.message_id if chat_id == message.chat.id else None)
+            for chat_id in chats
+        ),
+        return_exceptions=True,
+    )
+    replies = {}
+    for chat_id, result in zip(chats, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, Exception):
+            logger.error(f"Failed to send translation to chat {chat_id}: {result}")
+        else:
+            replies[chat_id] = result
+    if not replies:
+        raise results[0]
+    return replies
+
+
+def reply_chunks(text: str) -> list:
+    """
+    Cuts a translation into the texts of its reply messages.
+    """
+    chunks = (chunk.strip() for chunk in split_message(text, max_length=4096))
+    return [chunk for chunk in chunks if chunk]
+
+
+async def send_chunks(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    chunks: list,
+    reply_to_message_id: int = None,
+) -> list:
+    """
+    Sends each chunk as a message, in order, and returns their ids.
+    """
+    message_ids = []
+    for chunk in chunks:
+        sent = await context.bot.send_message(
+            chat_id=chat_id, text=chunk, reply_to_message_id=reply_to_message_id
+        )
+        message_ids.append(sent.message_id)
+    return message_ids
+
+
+def text_sender(context: ContextTypes.DEFAULT_TYPE, text: str):
+    """
+    Returns a `deliver` callback that sends `text` as one message.
+    """
+
+    async def _send(chat_id: int, reply_to_message_id: int) -> list:
+        sent = await context.bot.send_message(
+            chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id
+        )
+        return [sent.message_id]
+
+    return _send
+
+
+async def edit_chunks(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    message_ids: list,
+    old_chunks: list,
+    new_chunks: list,
+    reply_to_message_id: int = None,
+) -> list:
+    """
+    Makes the messages `message_ids`, which show `old_chunks`, show
+    `new_chunks` instead: only messages whose text changed are edited,
+    missing ones are sent and surplus ones deleted. Returns the ids of the
+    messages that now show the chunks.
+    """
+    for index, message_id in enumerate(message_ids[: len(new_chunks)]):
+        if index < len(old_chunks) and old_chunks[index] == new_chunks[index]:
+            continue
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=new_chunks[index]
+            )
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Failed to edit translated message: {e}")
+    sent = await send_chunks(
+        context, chat_id, new_chunks[len(message_ids) :], reply_to_message_id
+    )
+    for message_id in message_ids[len(new_chunks) :]:
+        try:
+            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except BadRequest as e:
+            logger.warning(f"Failed to delete translated message: {e}")
+    return message_ids[: len(new_chunks)] + sent
+
+
+def paragraph_translator(chat_id: int):
+    """
+    Returns a coroutine function that translates one paragraph for
+    `translate_paragraphs`.
+    """
+
+    async def _translate(text: str):
+        translation = await translate_text(text, chat_id)
+        return None if translation == TRANSLATION_ERROR else translation
+
+    return _translate
+
+
+async def translate_post(text: str, chat_id: int) -> list:
+    """
+    Translates a new post or caption in one request, so that the whole text
+    is translated in context, and returns it as a single segment. Only when
+    the post is edited is it translated paragraph by paragraph.
+    """
+    translation = await translate_text(text, chat_id)
+    return [[text, None if translation == TRANSLATION_ERROR else translation]]
+
+
+async def send_translated_post(context: ContextTypes.DEFAULT_TYPE, message):
+    """
+    Translates a text message and sends the translation to all its
+    destinations, keeping it for later edits of the message.
+    """
+    segments = await translate_post(message.text, message.chat.id)
+    chunks = reply_chunks(join_translation(segments, TRANSLATION_ERROR))
+    replies = await deliver(
+        message,
+        lambda chat_id, reply_to: send_chunks(context, chat_id, chunks, reply_to),
+    )
+    await save_post(message.chat.id, message.message_id, "text", segments, replies)
+
+
+async def handle_edited_message(message, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Updates the translation of an edited message in place. The edited text
+    is translated paragraph by paragraph: from the second edit on, only the
+    paragraphs that changed are translated again. Only the messages whose
+    text changed are edited, in every chat the translation went to.
+    An edited text whose translation is not known (any more) is translated
+    like a new message; other untracked edits are ignored rather than
+    transcribing their media again.
+    """
+    chat_id = message.chat.id
+    post = await load_post(chat_id, message.message_id)
+    if post is None:
+        if message.text and not is_youtube_url(message.text):
+            await handle_single_message(message, context)
+        else:
+            logger.info(
+                f"Ignoring edit of message {message.message_id} in chat {chat_id}."
+            )
+        return
+
+    text = (message.text if post["kind"] == "text" else message.caption) or ""
+    segments = await translate_paragraphs(
+        text, paragraph_translator(chat_id), post["segments"]
+    )
+    old = join_translation(post["segments"], TRANSLATION_ERROR)
+    new = join_translation(segments, TRANSLATION_ERROR)
+    replies = post["replies"]
+    if new != old:
+        old_chunks, new_chunks = reply_chunks(old), reply_chunks(new)
+
+        async def _update(destination: int, message_ids: list) -> list:
+            if post["kind"] != "text":
+                await context.bot.edit_message_caption(
+                    chat_id=destination, message_id=message_ids[0], caption=new or None
+                )
+                return message_ids
+            return await edit_chunks(
+                context,
+                destination,
+                message_ids,
+                old_chunks,
+                new_chunks,
+                message.message_id if destination == chat_id else None,
+            )
+
+        results = await asyncio.gather(
+            *(_update(*reply) for reply in replies.items()), return_exceptions=True
+        )
+        for destination, result in zip(list(replies), results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Failed to update translation in chat {destination}: {result}"
+                )
+            else:
+                replies[destination] = result
+    await save_post(chat_id, message.message_id, post["kind"], segments, replies)
+    logger.info(
+        f"Updated translation of edited message {message.message_id} "
+        f"in chat {chat_id}."
+    )
+
+
 async def send_long_message(
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
@@ -75,22 +527,284 @@ async def send_long_message(
     reply_to_message_id: int = None,
 ):
     """
-    Sends a long message by splitting it into chunks if necessary.
+    Sends a long HTML message in chunks of at most 4096 characters, in
+    order. Each chunk is cut while the previous one is being sent.
     """
-    chunks = split_message(text, max_length=4096)
 
-    for chunk in chunks:
+    async def _send(chunk: str):
         try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=chunk,
-                reply_to_message_id=reply_to_message_id,
-                parse_mode="HTML",
-            )
-            await asyncio.sleep(0.1)
+            try:
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=chunk,
+                    reply_to_message_id=reply_to_message_id,
+                    parse_mode="HTML",
+                )
+            except BadRequest as e:
+                if "parse entities" not in str(e).lower():
+                    raise
+                # Not valid HTML after all, send the text as it is
+                for part in iter_message_chunks(chunk, max_length=4096):
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=part,
+                        reply_to_message_id=reply_to_message_id,
+                    )
         except Exception as e:
             logger.error(f"Failed to send message chunk: {e}")
 
+    sending = None
+    try:
+        for chunk in iter_message_chunks(text, max_length=4096, html=True):
+            if sending is not None:
+                await sending
+            sending = asyncio.ensure_future(_send(chunk))
+            # Let the request go out before cutting the next chunk
+            await asyncio.sleep(0)
+        if sending is not None:
+            await sending
+    finally:
+        if sending is not None and not sending.done():
+            sending.cancel()
+
+
+async def stream_translation(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    text: str,
+    reply_to_message_id: int = None,
+):
+    """
+    Translates `text` as a token stream and shows it progressively: a
+    placeholder reply is posted right away and edited at most every
+    STREAM_EDIT_INTERVAL seconds as tokens arrive. Text beyond 4096
+    characters rolls over into follow-up messages. Returns the ids of the
+    messages and the translation.
+    """
+    messages = [
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=STREAM_PLACEHOLDER,
+            reply_to_message_id=reply_to_message_id,
+        )
+    ]
+    shown = [STREAM_PLACEHOLDER]
+    parts = []
+
+    async def _render(final: bool):
+        for index, chunk in enumerate(reply_chunks("".join(parts))):
+            if index >= len(messages):
+                messages.append(
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=chunk,
+                        reply_to_message_id=reply_to_message_id,
+                    )
+                )
+                shown.append(chunk)
+            elif shown[index] != chunk:
+                try:
+                    # Interim edits are not worth waiting for under flood control
+                    await context.bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=messages[index].message_id,
+                        text=chunk,
+                        rate_limit_args=None if final else {"max_retries": 0},
+                    )
+                    shown[index] = chunk
+                except RetryAfter as e:
+                    if not final:
+                        return  # Skip this update, a later one will catch up
+                    await asyncio.sleep(e.retry_after)
+                    await _render(final)
+                    return
+                except BadRequest as e:
+                    logger.warning(f"Failed to edit streamed message: {e}")
+
+    loop = asyncio.get_running_loop()
+    last_render = loop.time()
+    async for delta in translate_text_stream(text, chat_id):
+        parts.append(delta)
+        if loop.time() - last_render >= settings.STREAM_EDIT_INTERVAL:
+            await _render(final=False)
+            last_render = loop.time()
+    await _render(final=True)
+    return [message.message_id for message in messages], "".join(parts)
+
+
+async def send_translated_segments(
+    context: ContextTypes.DEFAULT_TYPE,
+    message,
+    segments,
+    job=None,
+    transcription_key: str = None,
+):
+    """
+    Translates the transcription segments of `message` as they arrive and
+    sends them in order to all its destinations (see `deliver`), so the
+    first paragraphs reach the chats while later segments are still being
+    transcribed. Segments of audio transcribed under `transcription_key`
+    that was detected as Persian are sent as they are.
+
+    With a journal `job`, translated and sent segments are recorded, and a
+    resumed job neither translates nor sends them again.
+    """
+    chat_id = message.chat.id
+    translated = job.results(TRANSLATED) if job else {}
+    sent = job.results(SENT) if job else {}
+    pending = asyncio.Queue()
+
+    async def _translate(index: int, segment: str) -> str:
+        if index in translated:
+            return translated[index]
+        translation = await translate_transcription(segment, transcription_key, chat_id)
+        if job:
+            job.record(TRANSLATED, index, translation)
+        return translation
+
+    async def _deliver():
+        while (item := await pending.get()) is not None:
+            index, translation = item
+            text = await translation
+            await deliver(
+                message,
+                lambda destination, reply_to: send_long_message(
+                    context, destination, text, reply_to
+                ),
+            )
+            if job:
+                job.record(SENT, index)
+
+    delivery = asyncio.create_task(_deliver())
+    try:
+        index = 0
+        async for segment in segments:
+            if segment.strip() and index not in sent:
+                translation = asyncio.create_task(_translate(index, segment))
+                await pending.put((index, translation))
+            index += 1
+    finally:
+        await pending.put(None)
+        await delivery
+
+
+async def download_telegram_file(
+    context: ContextTypes.DEFAULT_TYPE, file_id: str, filename: str
+) -> MediaFile:
+    """
+    Streams a Telegram file into a MediaFile once its size fits in the
+    media memory budget.
+    """
+    with metrics.track("telegram_download"):
+        new_file = await context.bot.get_file(file_id)
+        media_file = await download_media(
+            new_file.file_path, filename, new_file.file_size
+        )
+    metrics.bytes_processed.inc(media_file.size(), stage="telegram_download")
+    return media_file
+
+
+async def download_telegram_audio(
+    context: ContextTypes.DEFAULT_TYPE, file_id: str, filename: str
+) -> MediaFile:
+    """
+    Downloads a Telegram audio or voice file for transcription.
+    """
+    return await download_telegram_file(context, file_id, filename)
+
+
+async def download_speech_audio(
+    context: ContextTypes.DEFAULT_TYPE, file_id: str, filename: str
+) -> MediaFile:
+    """
+    Downloads a Telegram video or video note and extracts its audio track
+    for transcription with ffmpeg, which reads the video from the buffer or
+    temporary file it was downloaded into.
+    """
+    with await download_telegram_file(context, file_id, filename) as video_file:
+        return await extract_speech_audio(video_file, filename)
+
+
+async def send_translated_document(
+    context: ContextTypes.DEFAULT_TYPE, message, format: str, job=None
+):
+    """
+    Downloads a txt, srt, pdf or docx document to a temporary file,
+    translates it as it is parsed and sends the translated file to all
+    destinations of the message. A status reply shows the progress and is
+    removed when the file is sent.
+    """
+    chat_id = message.chat.id
+    document = message.document
+    file_name = document.file_name or f"document.{format}"
+    if job and job.completed(SENT):
+        return
+
+    status = await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"Translating {file_name}…",
+        reply_to_message_id=message.message_id,
+    )
+    loop = asyncio.get_running_loop()
+    last_update = loop.time()
+
+    async def _progress(share: float):
+        nonlocal last_update
+        if loop.time() - last_update < settings.DOCUMENT_PROGRESS_INTERVAL:
+            return
+        last_update = loop.time()
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=status.message_id,
+                text=f"Translating {file_name}… {share:.0%}",
+                rate_limit_args={"max_retries": 0},
+            )
+        except (BadRequest, RetryAfter) as e:
+            logger.warning(f"Failed to update document progress: {e}")
+
+    with tempfile.TemporaryDirectory(prefix="document-") as directory:
+        source = os.path.join(directory, "source")
+        output_name = translated_file_name(file_name, format)
+        output = os.path.join(directory, output_name)
+
+        with metrics.track("telegram_download"):
+            new_file = await context.bot.get_file(document.file_id)
+            with open(source, "wb") as file:
+                size = await stream_download(new_file.file_path, file)
+        metrics.bytes_processed.inc(size, stage="telegram_download")
+
+        with metrics.track("translate_document"):
+            await translate_document(
+                source,
+                format,
+                output,
+                lambda text: translate_text(text, chat_id),
+                _progress,
+            )
+        caption = (
+            await translate_text(message.caption, chat_id) if message.caption else None
+        )
+
+        async def _send_document(destination: int, reply_to_message_id: int):
+            with open(output, "rb") as file:
+                sent = await context.bot.send_document(
+                    chat_id=destination,
+                    document=file,
+                    filename=output_name,
+                    caption=caption,
+                    reply_to_message_id=reply_to_message_id,
+                )
+            return [sent.message_id]
+
+        await deliver(message, _send_document)
+    if job:
+        job.complete(SENT)
+    try:
+        await context.bot.delete_message(chat_id=chat_id, message_id=status.message_id)
+    except BadRequest as e:
+        logger.warning(f"Failed to remove document status message: {e}")
+
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -104,24 +818,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.warning(f"Unauthorized access attempt from chat {message.chat.id}")
             return  # Silently ignore unauthorized messages
 
-        chat_id = message.chat.id
+        job = resumed_jobs.pop(update.update_id, None)
+        if job is not None:
+            await run_journaled_job(job, message, context)
+            return
 
-        # Check if the message is part of a media group
-        if message.media_group_id:
-            media_group_id = message.media_group_id
+        # Telegram redelivers webhook updates it considers unanswered
+        if not await shared_store.add(
+            f"update:{update.update_id}", str(os.getpid()), settings.UPDATE_DEDUPE_TTL
+        ):
+            logger.info(f"Skipping already handled update {update.update_id}.")
+            return
+
+        if settings.EDIT_TRACKING and message.edit_date:
+            with metrics.track("handle_edit"):
+                await handle_edited_message(message, context)
 
-            if media_group_id not in media_groups:
-                # Initialize a new media group entry with a timeout
-                media_groups[media_group_id] = {"messages": [], "chat_id": chat_id}
-                # Schedule processing after a delay
-                asyncio.create_task(process_media_group(media_group_id, context))
+        # Check if the message is part of a media group
+        elif message.media_group_id:
+            await collect_media_group_item(message, context)
 
-            # Append the current message to the media group
-            media_groups[media_group_id]["messages"].append(message)
+        elif classify_update(update) == MEDIA_JOB:
+            # Long jobs are journaled so a restart can resume them
+            job = journal.begin(update.update_id, message.chat.id, update.to_json())
+            if job is None:
+                logger.info(f"Update {update.update_id} was already journaled.")
+                return
+            await run_journaled_job(job, message, context)
 
         else:
             # Handle single media messages or text
-            await handle_single_message(message, context)
+            with metrics.track(f"handle_{message_kind(message)}"):
+                await handle_single_message(message, context)
 
     except Exception as e:
         logger.error(f"Error handling message: {e}")
@@ -130,66 +858,189 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text="An error occurred while processing your message.",
             reply_to_message_id=update.effective_message.message_id,
         )
+    finally:
+        startup.mark(startup.FIRST_UPDATE)
+
+
+def media_group_keys(media_group_id: str) -> tuple:
+    """
+    Returns the shared store keys of a media group: its items, the time the
+    last item arrived, and the process that owns the group.
+    """
+    prefix = f"media_group:{media_group_id}"
+    return f"{prefix}:messages", f"{prefix}:arrived", f"{prefix}:owner"
+
+
+async def collect_media_group_item(message, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Adds a media group item to the shared store. The process that receives
+    the first item of a group owns it and, if the group is admitted as a
+    text job, schedules its processing.
+    """
+    messages_key, arrived_key, owner_key = media_group_keys(message.media_group_id)
+    await shared_store.append(messages_key, message.to_json(), MEDIA_GROUP_STATE_TTL)
+    await shared_store.set(arrived_key, str(time.time()), MEDIA_GROUP_STATE_TTL)
+    if await shared_store.add(owner_key, str(os.getpid()), MEDIA_GROUP_STATE_TTL):
+        try:
+            ticket = admission.admit(
+                TEXT_JOB,
+                JobCost(tokens=count_tokens(message.caption or "")),
+                message.chat.id,
+                message.from_user.id if message.from_user else None,
+            )
+        except JobRejected as e:
+            # The group state expires on its own, so later items are ignored
+            logger.warning(f"Turned away media group {message.media_group_id}: {e}")
+            await notify_rejected(message, e)
+            return
+        asyncio.create_task(
+            process_media_group(
+                message.media_group_id, message.chat.id, context, ticket
+            )
+        )
+
+
+async def run_journaled_job(job, message, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles a journaled message and marks its job as finished. A job that
+    is interrupted by a shutdown stays open and is resumed on the next start.
+    """
+    try:
+        with metrics.track(f"handle_{message_kind(message)}"):
+            await handle_single_message(message, context, job)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        job.finish(FAILED)
+        raise
+    job.finish()
+
+
+async def resume_journaled_jobs(application):
+    """
+    Queues the jobs that were still running when a previous bot process
+    stopped. They go through the usual dispatching and continue after
+    their last completed stage.
+    """
+    for job in journal.orphaned_jobs():
+        update = Update.de_json(json.loads(job.payload), application.bot)
+        logger.info(
+            f"Resuming interrupted job for update {job.update_id} "
+            f"in chat {update.effective_chat.id}."
+        )
+        resumed_jobs[job.update_id] = job
+        await application.update_queue.put(update)
+
+
+async def wait_for_media_group(media_group_id: str) -> list:
+    """
+    Waits until a media group is complete and returns its items as stored:
+    no new item arrived within MEDIA_GROUP_DEBOUNCE seconds, the group
+    reached the album size limit, or MEDIA_GROUP_TIMEOUT seconds passed
+    since the first item.
+    """
+    messages_key, arrived_key, _ = media_group_keys(media_group_id)
+    deadline = time.time() + MEDIA_GROUP_TIMEOUT
+
+    while True:
+        items = await shared_store.members(messages_key)
+        last_arrival = float(await shared_store.get(arrived_key) or 0)
+        now = time.time()
+        quiet_until = last_arrival + MEDIA_GROUP_DEBOUNCE
+        if len(items) >= MEDIA_GROUP_MAX_SIZE or now >= min(quiet_until, deadline):
+            return items
+        await asyncio.sleep(
+            min(MEDIA_GROUP_POLL_INTERVAL, quiet_until - now, deadline - now)
+        )
 
 
-async def process_media_group(media_group_id: str, context: ContextTypes.DEFAULT_TYPE):
+async def translate_caption(caption: str, chat_id: int = None) -> str:
     """
-    Waits for a timeout and then processes the media group by translating captions and resending.
+    Translates a caption, or returns an empty string when there is none.
     """
-    await asyncio.sleep(MEDIA_GROUP_TIMEOUT)  # Wait for more messages in the group
+    if not caption:
+        return ""
+    return await translate_text(caption, chat_id)
 
-    group = media_groups.pop(media_group_id, {})
-    messages = group.get("messages", [])
-    chat_id = group.get("chat_id")
 
+async def process_media_group(
+    media_group_id: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, ticket
+):
+    """
+    Waits for the media group to be complete and then processes it by
+    translating captions and resending, in a text lane slot like any other
+    text job. Releases the group's admission `ticket` when done.
+    """
+    try:
+        items = await wait_for_media_group(media_group_id)
+        messages = {}
+        for item in items:
+            msg = Message.de_json(json.loads(item), context.bot)
+            messages[msg.message_id] = msg
+        async with context.application.update_processor.slot(TEXT_JOB, ticket):
+            with metrics.track("media_group"):
+                await send_translated_media_group(
+                    [messages[message_id] for message_id in sorted(messages)],
+                    chat_id,
+                    context,
+                )
+    except Exception as e:
+        logger.error(f"Failed to process media group {media_group_id}: {e}")
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Failed to send the translated media group.",
+        )
+    finally:
+        ticket.release()
+        await shared_store.delete(*media_group_keys(media_group_id))
+
+
+async def send_translated_media_group(
+    messages: list, chat_id: int, context: ContextTypes.DEFAULT_TYPE
+):
+    """
+    Resends the items of a media group with their captions translated to all
+    destinations of the group. All captions of the group are translated
+    concurrently.
+    """
     if not messages:
-        logger.warning(f"No messages found for media group {media_group_id}.")
+        logger.warning(f"No messages found for media group in chat {chat_id}.")
         return
 
+    translated_captions = await asyncio.gather(
+        *(translate_caption(msg.caption, chat_id) for msg in messages)
+    )
+
     media = []
     reply_to_message_id = messages[
         0
     ].message_id  # Reply to the first message in the group
 
-    for msg in messages:
+    for msg, translated_caption in zip(messages, translated_captions):
         media_item = None
-        translated_caption = ""
 
         # Determine the media type and prepare InputMedia objects
         if msg.photo:
             # For photos, choose the highest resolution
             photo = msg.photo[-1]
-            # Translate caption if exists
-            if msg.caption:
-                # translated_caption = await translate_text(msg.caption)
-                translated_caption = "ترجمه شد!"
             media_item = InputMediaPhoto(
                 media=photo.file_id,
                 caption=translated_caption if translated_caption else None,
             )
         elif msg.video:
             video = msg.video
-            if msg.caption:
-                # translated_caption = await translate_text(msg.caption)
-                translated_caption = "ترجمه شد!"
             media_item = InputMediaVideo(
                 media=video.file_id,
                 caption=translated_caption if translated_caption else None,
             )
         elif msg.audio:
             audio = msg.audio
-            if msg.caption:
-                # translated_caption = await translate_text(msg.caption)
-                translated_caption = "اهنگ ترجمه شد!"
             media_item = InputMediaAudio(
                 media=audio.file_id,
                 caption=translated_caption if translated_caption else None,
             )
         elif msg.document:
             document = msg.document
-            if msg.caption:
-                # translated_caption = await translate_text(msg.caption)
-                translated_caption = "ترجمه شد!"
             media_item = InputMediaDocument(
                 media=document.file_id,
                 caption=translated_caption if translated_caption else None,
@@ -198,9 +1049,7 @@ async def process_media_group(media_group_id: str, context: ContextTypes.DEFAULT
             voice = msg.voice
             transcription = "متن"
 
-            await context.bot.send_message(
-                chat_id=chat_id, text=transcription, reply_to_message_id=msg.message_id
-            )
+            await deliver(msg, text_sender(context, transcription))
         else:
             # Unsupported media type; skip
             logger.warning(f"Unsupported media type in message {msg.message_id}.")
@@ -210,12 +1059,20 @@ async def process_media_group(media_group_id: str, context: ContextTypes.DEFAULT
             media.append(media_item)
 
     if media:
-        try:
-            await context.bot.send_media_group(
-                chat_id=chat_id, media=media, reply_to_message_id=reply_to_message_id
+
+        async def _send_media_group(destination: int, reply_to_message_id: int):
+            sent = await context.bot.send_media_group(
+                chat_id=destination,
+                media=media,
+                reply_to_message_id=reply_to_message_id,
             )
+            return [item.message_id for item in sent]
+
+        try:
+            replies = await deliver(messages[0], _send_media_group)
             logger.info(
-                f"Sent translated media group with {len(media)} items to chat {chat_id}."
+                f"Sent translated media group with {len(media)} items "
+                f"to chats {list(replies)}."
             )
         except Exception as e:
             logger.error(f"Failed to send media group: {e}")
@@ -226,9 +1083,10 @@ async def process_media_group(media_group_id: str, context: ContextTypes.DEFAULT
             )
 
 
-async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
+async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE, job=None):
     """
-    Handles single text or media messages.
+    Handles single text or media messages. Long transcription jobs record
+    their progress in the journal `job`, if given.
     """
     chat_id = message.chat.id
     if any(
@@ -245,16 +1103,24 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
 
         if message.photo:
             photo = message.photo[-1]
+            segments = []
             if message.caption:
-                translated_caption = await translate_text(message.caption)
-            try:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
+                segments = await translate_post(message.caption, chat_id)
+                translated_caption = join_translation(segments, TRANSLATION_ERROR)
+
+            async def _send_photo(destination: int, reply_to_message_id: int):
+                sent = await context.bot.send_photo(
+                    chat_id=destination,
                     photo=photo.file_id,
                     caption=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
+                    reply_to_message_id=reply_to_message_id,
                 )
-                logger.info(f"Sent translated photo to chat {chat_id}.")
+                return [sent.message_id]
+
+            try:
+                replies = await deliver(message, _send_photo)
+                logger.info(f"Sent translated photo to chats {list(replies)}.")
+                await save_post(chat_id, message.message_id, "photo", segments, replies)
             except Exception as e:
                 logger.error(f"Failed to send photo: {e}")
                 await context.bot.send_message(
@@ -264,18 +1130,32 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
                 )
         elif message.video:
             video = message.video
-            if message.caption:
-                # translated_caption = await translate_text(message.caption)
-                translated_caption = "ترجمه شد!"
 
             try:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=video.file_id,
-                    caption=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
-                )
-                logger.info(f"Sent translated video to chat {chat_id}.")
+                if job is None or not job.completed(REPLIED):
+                    segments = []
+                    if message.caption:
+                        segments = await translate_post(message.caption, chat_id)
+                        translated_caption = join_translation(
+                            segments, TRANSLATION_ERROR
+                        )
+
+                    async def _send_video(destination: int, reply_to_message_id: int):
+                        sent = await context.bot.send_video(
+                            chat_id=destination,
+                            video=video.file_id,
+                            caption=translated_caption if translated_caption else None,
+                            reply_to_message_id=reply_to_message_id,
+                        )
+                        return [sent.message_id]
+
+                    replies = await deliver(message, _send_video)
+                    logger.info(f"Sent translated video to chats {list(replies)}.")
+                    await save_post(
+                        chat_id, message.message_id, "video", segments, replies
+                    )
+                    if job:
+                        job.complete(REPLIED)
             except Exception as e:
                 logger.error(f"Failed to send video: {e}")
                 await context.bot.send_message(
@@ -283,26 +1163,50 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
                     text="Failed to send the translated video.",
                     reply_to_message_id=message.message_id,
                 )
+
+            # Bots can only download files up to 20 MB
+            if video.file_size and video.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+                logger.info(f"Video in chat {chat_id} is too large to transcribe.")
+            else:
+                key = f"telegram:{video.file_unique_id}"
+                try:
+                    await send_translated_segments(
+                        context=context,
+                        message=message,
+                        segments=transcribe_stream(
+                            key,
+                            lambda: download_speech_audio(
+                                context, video.file_id, video.file_name or "video.mp4"
+                            ),
+                            job,
+                        ),
+                        job=job,
+                        transcription_key=key,
+                    )
+                    logger.info(
+                        f"Sent translated video transcript to chats "
+                        f"{destinations(message)}."
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to transcribe video: {e}")
         elif message.audio:
             audio = message.audio
-            file_id = audio.file_id
-            new_file = await context.bot.get_file(file_id)
-
-            file_bytes = await new_file.download_as_bytearray()
-            audio_bytes = BytesIO(file_bytes)
-            audio_bytes.name = "audio.mp3"
-
-            transcription = await transcribe_audio(audio_bytes)
-            translated_caption = await translate_text(transcription)
+            key = f"telegram:{audio.file_unique_id}"
+            segments = transcribe_stream(
+                key,
+                lambda: download_telegram_audio(context, audio.file_id, "audio.mp3"),
+                job,
+            )
 
             try:
-                await send_long_message(
+                await send_translated_segments(
                     context=context,
-                    chat_id=chat_id,
-                    text=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
+                    message=message,
+                    segments=segments,
+                    job=job,
+                    transcription_key=key,
                 )
-                logger.info(f"Sent translated audio to chat {chat_id}.")
+                logger.info(f"Sent translated audio to chats {destinations(message)}.")
             except Exception as e:
                 logger.error(f"Failed to send audio: {e}")
                 await context.bot.send_message(
@@ -312,42 +1216,67 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
                 )
         elif message.document:
             document = message.document
-            if message.caption:
-                translated_caption = await translate_text(message.caption)
-            try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
-                )
-                logger.info(f"Sent translated document to chat {chat_id}.")
-            except Exception as e:
-                logger.error(f"Failed to send document: {e}")
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Failed to send the translated document.",
-                    reply_to_message_id=message.message_id,
-                )
+            format = downloadable_document_format(document)
+            if format:
+                try:
+                    await send_translated_document(context, message, format, job)
+                    logger.info(
+                        f"Sent translated document to chats {destinations(message)}."
+                    )
+                except DocumentError as e:
+                    logger.warning(f"Could not read document: {e}")
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=f"Could not read the document. {e}",
+                        reply_to_message_id=message.message_id,
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to translate document: {e}")
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text="Failed to send the translated document.",
+                        reply_to_message_id=message.message_id,
+                    )
+            else:
+                if message.caption:
+                    translated_caption = await translate_text(message.caption, chat_id)
+                try:
+                    replies = await deliver(
+                        message,
+                        text_sender(
+                            context, translated_caption if translated_caption else None
+                        ),
+                    )
+                    logger.info(f"Sent translated document to chats {list(replies)}.")
+                except Exception as e:
+                    logger.error(f"Failed to send document: {e}")
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text="Failed to send the translated document.",
+                        reply_to_message_id=message.message_id,
+                    )
 
         elif message.voice:
             voice = message.voice
-            file_id = voice.file_id
-            new_file = await context.bot.get_file(file_id)
-
-            file_bytes = await new_file.download_as_bytearray()
-            audio_bytes = BytesIO(file_bytes)
-            audio_bytes.name = "voice_message.ogg"
-
-            transcription = await transcribe_audio(audio_bytes)
-            translated_caption = await translate_text(transcription)
+            key = f"telegram:{voice.file_unique_id}"
+            transcription = await transcribe_cached(
+                key,
+                lambda: download_telegram_audio(
+                    context, voice.file_id, "voice_message.ogg"
+                ),
+            )
+            translated_caption = await translate_transcription(
+                transcription, key, chat_id
+            )
 
             try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
+                replies = await deliver(
+                    message,
+                    text_sender(
+                        context, translated_caption if translated_caption else None
+                    ),
                 )
-                logger.info(f"Sent translated audio to chat {chat_id}.")
+                logger.info(f"Sent translated audio to chats {list(replies)}.")
             except Exception as e:
                 logger.error(f"Failed to send audio: {e}")
                 await context.bot.send_message(
@@ -357,37 +1286,25 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
                 )
         elif message.video_note:
             video_note = message.video_note
-            file_id = video_note.file_id
-            new_file = await context.bot.get_file(file_id)
-            if not os.path.exists("./tempfiles"):
-                os.makedirs("./tempfiles")
-            path = f"./tempfiles/{file_id}.mp4"
-
-            if not os.path.exists(path):
-                await new_file.download_to_drive(custom_path=path)
-            mp4_file = path
-            mp3_file = f"./tempfiles/{file_id}.mp3"
-            video_clip = VideoFileClip(mp4_file)
-            audio_clip = video_clip.audio
-            if not os.path.exists(mp3_file):
-                audio_clip.write_audiofile(mp3_file)
-
-            audio_clip.close()
-            video_clip.close()
-
-            with open(mp3_file, "rb") as f:
-                audio_bytes = BytesIO(f.read())
-                audio_bytes.name = f"{file_id}.mp3"
-                transcription = await transcribe_audio(audio_bytes)
-                translated_caption = await translate_text(transcription)
+            key = f"telegram:{video_note.file_unique_id}"
+            transcription = await transcribe_cached(
+                key,
+                lambda: download_speech_audio(
+                    context, video_note.file_id, "video_note.mp4"
+                ),
+            )
+            translated_caption = await translate_transcription(
+                transcription, key, chat_id
+            )
             try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=translated_caption if translated_caption else None,
-                    reply_to_message_id=message.message_id,
+                replies = await deliver(
+                    message,
+                    text_sender(
+                        context, translated_caption if translated_caption else None
+                    ),
                 )
 
-                logger.info(f"Sent translated audio to chat {chat_id}.")
+                logger.info(f"Sent translated audio to chats {list(replies)}.")
             except Exception as e:
                 logger.error(f"Failed to send audio: {e}")
                 await context.bot.send_message(
@@ -395,14 +1312,6 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
                     text="Failed to send the translated audio.",
                     reply_to_message_id=message.message_id,
                 )
-            finally:
-                for file_path in [mp4_file, mp3_file]:
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            logger.info(f"Removed temporary file: {file_path}")
-                    except Exception as remove_error:
-                        logger.error(f"Error removing file {file_path}: {remove_error}")
 
     elif message.text:
         original_text = message.text
@@ -410,32 +1319,44 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
             # Check if the message contains a YouTube URL
             if is_youtube_url(original_text):
 
-                # Download YouTube audio
-                audio_bytes = await download_youtube_audio(original_text)
-
-                # Transcribe the audio
-                transcription = await transcribe_audio(audio_bytes)
-
-                # Translate the transcription
-                translated_text = await translate_text(transcription)
-
-                # Send the translated text
-                await send_long_message(
+                # Download and transcribe the YouTube audio, then translate
+                # and send every segment as soon as it is transcribed
+                await send_translated_segments(
+                    context=context,
+                    message=message,
+                    segments=transcribe_youtube(original_text, job),
+                    job=job,
+                    transcription_key=youtube_transcription_key(original_text),
+                )
+                logger.info(
+                    f"Processed YouTube video for chats {destinations(message)}"
+                )
+            elif (
+                settings.STREAM_TRANSLATIONS
+                and not admission.busy(TEXT_JOB)
+                and message.chat.type != "channel"
+                and chat_id not in settings.FANOUT_CHATS
+            ):
+                # Under load, the edits of a streamed reply are left out
+                message_ids, translated_text = await stream_translation(
                     context=context,
                     chat_id=chat_id,
-                    text=translated_text,
+                    text=original_text,
                     reply_to_message_id=message.message_id,
                 )
-                logger.info(f"Processed YouTube video for chat {chat_id}")
+                await save_post(
+                    chat_id,
+                    message.message_id,
+                    "text",
+                    [[original_text, translated_text]],
+                    {chat_id: message_ids},
+                )
+                logger.info(f"Sent translated text to chat {chat_id}.")
             else:
-                translated_text = await translate_text(original_text)
-                if translated_text:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=translated_text,
-                        reply_to_message_id=message.message_id,
-                    )
-                    logger.info(f"Sent translated text to chat {chat_id}.")
+                # Kept by paragraph once edited, so later edits only cost the
+                # paragraphs that changed
+                await send_translated_post(context, message)
+                logger.info(f"Sent translated text to chats {destinations(message)}.")
         except Exception as e:
             logger.error(f"Failed to translate/send text: {e}")
             await context.bot.send_message(
@@ -453,20 +1374,205 @@ async def handle_single_message(message, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def main():
+async def start_metrics(application, port: int):
     """
-    Initializes and runs the Telegram bot.
+    Publishes the queue depths, serves all metrics for Prometheus on `port`
+    (unless 0) and logs a summary every METRICS_LOG_INTERVAL seconds.
     """
+    processor = application.update_processor
+    for lane in [TEXT_JOB, MEDIA_JOB]:
+        metrics.queue_depth.set_function(
+            lambda lane=lane: processor.lane_depths()[lane], queue=f"{lane}_lane"
+        )
+    metrics.queue_depth.set_function(
+        lambda: sum(processor.queue_depths().values()), queue="chat_updates"
+    )
+    for job_class in [TEXT_JOB, MEDIA_JOB]:
+        metrics.queue_depth.set_function(
+            lambda job_class=job_class: admission.waiting(job_class),
+            queue=f"{job_class}_admitted",
+        )
+    metrics.queue_depth.set_function(lambda: media_pool.waiting, queue="media_pool")
+    metrics.queue_depth.set_function(
+        lambda: document_pool.waiting, queue="document_pool"
+    )
+    metrics.queue_depth.set_function(lambda: media_budget.waiting, queue="media_budget")
+    metrics.media_bytes_reserved.set_function(lambda: media_budget.reserved)
+    metrics.queue_depth.set_function(
+        lambda: translation_batcher.pending, queue="translation_batch"
+    )
+    metrics.queue_depth.set_function(
+        lambda: fast_translator.batcher.pending, queue="fast_translation_batch"
+    )
+    metrics.queue_depth.set_function(
+        lambda: local_translator.pending, queue="local_translation"
+    )
+    metrics.queue_depth.set_function(
+        lambda: local_transcriber.pending, queue="local_transcription"
+    )
+
+    if port:
+        application.bot_data["metrics_server"] = await metrics.serve(
+            settings.METRICS_HOST, port
+        )
+        logger.info(f"Serving metrics on port {port}.")
+    if settings.METRICS_LOG_INTERVAL:
+        application.bot_data["metrics_summary"] = asyncio.create_task(
+            metrics.log_summary_periodically(settings.METRICS_LOG_INTERVAL)
+        )
+
+
+async def stop_metrics(application):
+    """
+    Stops the metrics endpoint and summary started by `start_metrics`.
+    """
+    summary = application.bot_data.pop("metrics_summary", None)
+    if summary is not None:
+        summary.cancel()
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+
+def build_application(processes: int = 1, worker_index: int = 0):
+    """
+    Creates the Application with all handlers. When `processes` bot
+    processes run side by side, each one keeps to its share of the global
+    Telegram and OpenAI rate limits, and worker `worker_index` serves its
+    metrics on METRICS_PORT + worker_index.
+    """
+    startup.mark(startup.IMPORTED)
+    if processes > 1:
+        openai_limiter.share(processes)
+
+    async def post_init(application):
+        # Token counts are estimated until the tokenizer is loaded, which
+        # may mean a download, so updates are not held up by it
+        application.bot_data["tokenizer"] = asyncio.create_task(warm_up_tokenizer())
+        # Telegram's connection is open after getMe; open OpenAI's meanwhile
+        if settings.PREWARM_CONNECTIONS:
+            application.bot_data["prewarm"] = asyncio.create_task(
+                prewarm_connections(openai_client().models.retrieve(settings.MODEL))
+            )
+        metrics_port = settings.METRICS_PORT + worker_index
+        await start_metrics(application, metrics_port if settings.METRICS_PORT else 0)
+        if local_translation_enabled() and await local_translator.warm_up():
+            logger.info("Local translation model is ready.")
+        if (
+            settings.TRANSCRIPTION_BACKEND == "local"
+            and await local_transcriber.warm_up()
+        ):
+            logger.info("Local transcription model is ready.")
+        await resume_journaled_jobs(application)
+        startup.mark(startup.READY)
+
+    async def post_shutdown(application):
+        for name in ["prewarm", "tokenizer"]:
+            task = application.bot_data.pop(name, None)
+            if task is not None:
+                task.cancel()
+        await stop_metrics(application)
+        await close_http_client()
+
     # Create the Application and pass it your bot's token
-    application = ApplicationBuilder().token(settings.TELEGRAM_BOT_TOKEN).build()
+    builder = ApplicationBuilder().token(settings.TELEGRAM_BOT_TOKEN)
+    if settings.TELEGRAM_API_URL:
+        builder = builder.base_url(settings.TELEGRAM_API_URL)
+    if settings.TELEGRAM_FILE_URL:
+        builder = builder.base_file_url(settings.TELEGRAM_FILE_URL)
+    # Bot API calls and long polling share one connection pool with OpenAI
+    application = (
+        builder.request(SharedHTTPXRequest())
+        .get_updates_request(SharedHTTPXRequest())
+        .concurrent_updates(ChatOrderedUpdateProcessor(classify_update, admit_update))
+        .rate_limiter(
+            TelegramRateLimiter(global_rate=settings.TELEGRAM_GLOBAL_RATE / processes)
+        )
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Add a handler for all message types
     message_handler = MessageHandler(filters.ALL, handle_message)
     application.add_handler(message_handler)
+    return application
+
+
+def webhook_socket(port: int, shared: bool) -> socket.socket:
+    """
+    Binds the listening socket of a webhook worker. With `shared`, several
+    processes bind the same port and the kernel spreads connections among
+    them.
+    """
+    family = socket.AF_INET6 if ":" in settings.WEBHOOK_LISTEN else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if shared:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((settings.WEBHOOK_LISTEN, port))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+def run_webhook_worker(index: int, processes: int):
+    """
+    Runs one webhook worker process. Where the platform supports
+    SO_REUSEPORT all workers share WEBHOOK_PORT; otherwise worker `index`
+    listens on WEBHOOK_PORT + index behind your load balancer.
+    """
+    shared = processes > 1 and hasattr(socket, "SO_REUSEPORT")
+    port = settings.WEBHOOK_PORT + (0 if shared or processes == 1 else index)
+    application = build_application(processes, index)
+    logger.info(f"Webhook worker {index} is listening on port {port}...")
+    application.run_webhook(
+        unix=webhook_socket(port, shared),
+        url_path=urlparse(settings.WEBHOOK_URL).path,
+        webhook_url=settings.WEBHOOK_URL,
+        secret_token=settings.WEBHOOK_SECRET,
+    )
+
+
+def main():
+    """
+    Initializes and runs the Telegram bot: with long polling in this
+    process, or as WEB_WORKERS webhook worker processes when WEBHOOK_URL
+    is set.
+    """
+    if not settings.WEBHOOK_URL:
+        application = build_application()
+        # Start the Bot
+        logger.info("Bot is running...")
+        application.run_polling()
+        return
+
+    processes = max(1, settings.WEB_WORKERS)
+    if processes == 1:
+        run_webhook_worker(0, 1)
+        return
 
-    # Start the Bot
-    logger.info("Bot is running...")
-    application.run_polling()
+    logger.info(
+        f"Starting {processes} webhook workers sharing state via "
+        f"{urlparse(settings.SHARED_STORE_URL).scheme}..."
+    )
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_webhook_worker, args=(index, processes))
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Workers stop gracefully on SIGTERM; Ctrl+C reaches them directly
+    signal.signal(signal.SIGTERM, lambda *_: [worker.terminate() for worker in workers])
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+# cache.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import metrics
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Access times of disk hits are written in one go with the next write, or
+# once this many are waiting
+ACCESS_FLUSH_ENTRIES = 100
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text so that forwarded copies differing only in unicode form or
+    incidental whitespace map to the same cache key. Line structure is kept
+    because the translation preserves it.
+    """
+    text = unicodedata.normalize("NFC", text)
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(lines).strip()
+
+
+def make_key(*parts) -> str:
+    """
+    Builds a content-addressed key from the given parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class TwoTierCache:
+    """
+    A string cache with an in-process LRU in front of a persistent SQLite table.
+
+    Entries expire after `ttl` seconds and each tier is bounded by its own
+    maximum number of entries (least recently used entries are evicted first).
+    Disk hits do not write to the database: their access times are kept and
+    stored with the next write. Lookups are counted in `metrics.cache_lookups`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 100_000,
+        ttl: float = 30 * 24 * 3600,
+    ):
+        self.name = name
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._accessed = {}
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self._db = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.name}_accessed "
+                f"ON {self.name} (accessed_at)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the cached value for `key`, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    metrics.cache_lookups.inc(cache=self.name, result="memory")
+                    return value
+                del self._memory[key]
+
+            try:
+                db = self._connection()
+                row = db.execute(
+                    f"SELECT value, created_at FROM {self.name} WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and row[1] + self.ttl > now:
+                    self._accessed[key] = now
+                    if len(self._accessed) >= ACCESS_FLUSH_ENTRIES:
+                        self._flush_access_times(db)
+                        db.commit()
+                    self._remember(key, row[0], row[1] + self.ttl)
+                    self.hits_disk += 1
+                    metrics.cache_lookups.inc(cache=self.name, result="disk")
+                    return row[0]
+            except sqlite3.Error as e:
+                logger.error(f"Cache {self.name} read failed: {e}")
+
+            self.misses += 1
+            metrics.cache_lookups.inc(cache=self.name, result="miss")
+            return None
+
+    def _flush_access_times(self, db: sqlite3.Connection):
+        accessed, self._accessed = self._accessed, {}
+        db.executemany(
+            f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in accessed.items()],
+        )
+
+    def set(self, key: str, value: str):
+        """
+        Stores `value` under `key` in both tiers.
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl)
+            try:
+                db = self._connection()
+                self._flush_access_times(db)
+                db.execute(
+                    f"INSERT OR REPLACE INTO {self.name} "
+                    "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                db.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    self._prune(db, now)
+            except sqlite3.Error as e:
+                logger.error(f"Cache {self.name} write failed: {e}")
+
+    def _prune(self, db: sqlite3.Connection, now: float):
+        self._writes_since_prune = 0
+        db.execute(f"DELETE FROM {self.name} WHERE created_at < ?", (now - self.ttl,))
+        db.execute(
+            f"DELETE FROM {self.name} WHERE key IN ("
+            f"SELECT key FROM {self.name} ORDER BY accessed_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        db.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of the cache.
+        """
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_ratio": (
+                (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0
+            ),
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._flush_access_times(self._db)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Cache {self.name} write failed: {e}")
+                self._db.close()
+                self._db = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one in-flight task.
+
+    Callers that arrive while a task for their key is running await the same
+    result instead of starting duplicate work. Cancelling one waiter does not
+    cancel the shared task.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._inflight
+
+    def start(self, key, func) -> asyncio.Future:
+        """
+        Returns the in-flight task for `key`, starting `func()` if there is none.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+
+            def _forget(done, key=key):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(_forget)
+        return task
+
+    async def do(self, key, func):
+        """
+        Runs `func()` for `key` unless a call for `key` is already running,
+        and returns its result.
+        """
+        return await asyncio.shield(self.start(key, func))
+
+
+translation_cache = TwoTierCache(
+    "translations",
+    settings.CACHE_DB_PATH,
+    max_memory_entries=settings.CACHE_MEMORY_ENTRIES,
+    max_disk_entries=settings.CACHE_DISK_ENTRIES,
+    ttl=settings.CACHE_TTL,
+)
+
+transcription_cache = TwoTierCache(
+    "transcriptions",
+    settings.CACHE_DB_PATH,
+    max_memory_entries=settings.CACHE_MEMORY_ENTRIES,
+    max_disk_entries=settings.CACHE_DISK_ENTRIES,
+    ttl=settings.CACHE_TTL,
+)
@@ -0,0 +1,114 @@
+# chunking.py
+
+import asyncio
+import logging
+import os
+import re
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+_tokenizer = None
+_tokenizer_failed = False
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?؟।])\s+")
+
+
+def get_tokenizer():
+    """
+    Returns the tokenizer once `load_tokenizer` has loaded it, else None.
+    """
+    return _tokenizer
+
+
+def load_tokenizer():
+    """
+    Loads the tokenizer configured in settings.TOKENIZER_NAME (a local
+    tokenizer.json or a Hugging Face Hub id), which may mean a download.
+    Returns None if it cannot be loaded (e.g. when offline).
+    """
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is None and not _tokenizer_failed:
+        try:
+            from tokenizers import Tokenizer
+
+            if os.path.isfile(settings.TOKENIZER_NAME):
+                _tokenizer = Tokenizer.from_file(settings.TOKENIZER_NAME)
+            else:
+                _tokenizer = Tokenizer.from_pretrained(settings.TOKENIZER_NAME)
+        except Exception as e:
+            _tokenizer_failed = True
+            logger.warning(
+                f"Could not load tokenizer {settings.TOKENIZER_NAME}, "
+                f"estimating token counts instead: {e}"
+            )
+    return _tokenizer
+
+
+async def warm_up_tokenizer() -> bool:
+    """
+    Loads the tokenizer in a thread, off the event loop. Returns whether it
+    is ready.
+    """
+    return await asyncio.to_thread(load_tokenizer) is not None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Returns the number of model tokens in `text`. Until the tokenizer is
+    loaded, or if it cannot be, a conservative estimate of one token per
+    three UTF-8 bytes is used.
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return len(text.encode("utf-8")) // 3 + 1
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _split_oversized(text: str, max_tokens: int) -> list:
+    """
+    Breaks a paragraph that is too long on its own into sentences, and
+    sentences that are still too long into runs of words.
+    """
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        pieces.extend(sentence.split())
+    return pieces
+
+
+def split_by_tokens(text: str, max_tokens: int) -> list:
+    """
+    Splits `text` into chunks of at most `max_tokens` model tokens, cutting at
+    paragraph boundaries where possible, then at sentence and word boundaries.
+    Chunks keep the original order.
+    """
+    units = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        if not paragraph.strip():
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            units.append(("\n\n", paragraph))
+        else:
+            pieces = _split_oversized(paragraph, max_tokens)
+            units.append(("\n\n", pieces[0]))
+            units.extend((" ", piece) for piece in pieces[1:])
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for separator, unit in units:
+        unit_tokens = count_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("".join(current).strip())
+            current = []
+            current_tokens = 0
+        current.append((separator if current else "") + unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return chunks
@@ -0,0 +1,103 @@
+# connections.py
+
+import asyncio
+import logging
+
+import httpx
+from telegram.request import HTTPXRequest
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Defaults for requests that set no timeouts of their own, as python-telegram-bot
+# uses them; OpenAI and media downloads always pass theirs
+REQUEST_TIMEOUT = 5.0  # seconds
+POOL_TIMEOUT = 30.0  # seconds to wait for a free connection
+PREWARM_TIMEOUT = 10.0  # seconds
+
+_http_client = None
+
+
+def http2_enabled() -> bool:
+    """
+    Tells whether the shared pool speaks HTTP/2, which needs the h2 package.
+    """
+    if not settings.HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def http_client() -> httpx.AsyncClient:
+    """
+    Returns the connection pool shared by all Telegram, OpenAI and media
+    download traffic, creating it on first use.
+
+    Connections are kept alive between requests, and with HTTP/2 all
+    requests to one host are multiplexed over a single connection, so only
+    the first request to a host pays for the TCP and TLS handshakes.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        http2 = http2_enabled()
+        if settings.HTTP2 and not http2:
+            logger.warning("HTTP/2 needs the h2 package, using HTTP/1.1 instead.")
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, pool=POOL_TIMEOUT),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """
+    Closes the shared connection pool; the next use opens a new one.
+    """
+    global _http_client
+    if _http_client is not None:
+        client, _http_client = _http_client, None
+        await client.aclose()
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """
+    Sends Bot API requests through the shared connection pool. Shutting the
+    bot down leaves the pool open for the other clients; it is closed with
+    `close_http_client` once everything has stopped.
+    """
+
+    def __init__(self):
+        # Self-hosted Bot API servers only speak HTTP/1.1, which the pool
+        # falls back to by itself
+        http2 = http2_enabled() and not settings.TELEGRAM_API_URL
+        super().__init__(http_version="2" if http2 else "1.1")
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return http_client()
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def prewarm_connections(*requests):
+    """
+    Opens the pooled connections ahead of the first update by running the
+    given cheap coroutines concurrently. Failures are only logged: the
+    connection is then opened by the first real request instead.
+    """
+    results = await asyncio.gather(
+        *(asyncio.wait_for(request, PREWARM_TIMEOUT) for request in requests),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning(f"Failed to prewarm a connection: {result!r}")
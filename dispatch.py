@@ -0,0 +1,156 @@
+# dispatch.py
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from telegram.ext import BaseUpdateProcessor
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+TEXT_JOB = "text"
+MEDIA_JOB = "media"
+
+# Upper bound of updates the processor accepts at once; the real concurrency
+# limits are applied per lane and globally in do_process_update
+MAX_QUEUED_UPDATES = 4096
+
+
+def update_chat_id(update: object):
+    """
+    Returns the chat an update belongs to, or None for chat-less updates.
+    """
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat else None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently while keeping the
+    updates of each chat in arrival order.
+
+    Every update is classified by `classify(update)` into the text or media
+    lane. Each lane has its own concurrency limit, so cheap text jobs never
+    queue behind slow media jobs, and both lanes share a global limit.
+    Updates only take a lane and global slot once it is their chat's turn,
+    so a busy chat cannot hold slots that other chats could use.
+
+    With `admit`, every update is first passed to `await admit(update,
+    job_class)` on arrival, before it waits for its turn. That returns an
+    admission ticket, which is started once the update holds its slots and
+    released when it is done, or None to drop the update unhandled.
+    """
+
+    def __init__(
+        self,
+        classify,
+        admit=None,
+        max_concurrent_updates: int = settings.MAX_CONCURRENT_UPDATES,
+        text_concurrency: int = settings.TEXT_LANE_CONCURRENCY,
+        media_concurrency: int = settings.MEDIA_LANE_CONCURRENCY,
+    ):
+        super().__init__(max_concurrent_updates=MAX_QUEUED_UPDATES)
+        self._classify = classify
+        self._admit = admit
+        self._global = asyncio.Semaphore(max_concurrent_updates)
+        self._lanes = {
+            TEXT_JOB: asyncio.Semaphore(text_concurrency),
+            MEDIA_JOB: asyncio.Semaphore(media_concurrency),
+        }
+        self._chat_locks = {}
+        self._chat_waiters = {}
+        self._lane_waiting = {TEXT_JOB: 0, MEDIA_JOB: 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def queue_depths(self) -> dict:
+        """
+        Returns the number of updates waiting or running per chat.
+        """
+        return dict(self._chat_waiters)
+
+    def lane_depths(self) -> dict:
+        """
+        Returns the number of updates waiting to start per lane.
+        """
+        return dict(self._lane_waiting)
+
+    def slot(self, job_class: str, ticket=None):
+        """
+        Holds a lane and global slot of `job_class` for work that does not
+        come from a single update, such as a complete media group.
+        """
+        return self._enter(job_class, ticket)
+
+    @asynccontextmanager
+    async def _enter(self, job_class: str, ticket=None):
+        # Counts the update as waiting until it holds its lane and global slot
+        lane = self._lanes[job_class]
+        self._lane_waiting[job_class] += 1
+        try:
+            await lane.acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                lane.release()
+                raise
+        finally:
+            self._lane_waiting[job_class] -= 1
+        if ticket is not None:
+            ticket.start()
+        try:
+            yield
+        finally:
+            self._global.release()
+            lane.release()
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat_id = update_chat_id(update)
+        try:
+            job_class = self._classify(update)
+        except Exception as e:
+            logger.error(f"Failed to classify update, using the media lane: {e}")
+            job_class = MEDIA_JOB
+        if job_class not in self._lanes:
+            job_class = MEDIA_JOB
+
+        ticket = None
+        if self._admit is not None:
+            try:
+                ticket = await self._admit(update, job_class)
+            except Exception as e:
+                logger.error(f"Failed to admit update, handling it anyway: {e}")
+            else:
+                if ticket is None:
+                    coroutine.close()
+                    return
+
+        try:
+            await self._process(coroutine, chat_id, job_class, ticket)
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    async def _process(self, coroutine, chat_id, job_class: str, ticket):
+        if chat_id is None:
+            async with self._enter(job_class, ticket):
+                await coroutine
+            return
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                async with self._enter(job_class, ticket):
+                    await coroutine
+        finally:
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
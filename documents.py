@@ -0,0 +1,337 @@
+# documents.py
+
+import asyncio
+import io
+import logging
+import os
+import re
+import shutil
+import zipfile
+from collections import deque
+from xml.sax.saxutils import escape, unescape
+
+import settings
+from chunking import count_tokens
+from workers import document_pool
+
+logger = logging.getLogger(__name__)
+
+# Document formats by file extension and MIME type
+EXTENSIONS = {".txt": "txt", ".srt": "srt", ".pdf": "pdf", ".docx": "docx"}
+MIME_TYPES = {
+    "text/plain": "txt",
+    "application/x-subrip": "srt",
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+}
+
+READ_BATCH_SIZE = 32  # segments parsed per worker pool job
+DOCX_READ_SIZE = 64 * 1024  # characters of a Word document body read at a time
+MAX_SEGMENT_CHARS = 4000  # longer paragraphs are cut at a line break
+
+SRT_TIMING = re.compile(r"\s*\d+:\d+:\d+[,.]\d+\s*-->\s*\d+:\d+:\d+[,.]\d+")
+# Innermost Word paragraphs (text boxes nest paragraphs) and their text runs
+DOCX_PARAGRAPH = re.compile(
+    r"<w:p(?:\s[^>]*)?(?<!/)>(?:(?!<w:p\b).)*?</w:p>", re.DOTALL
+)
+DOCX_PARAGRAPH_START = re.compile(r"<w:p[\s/>]")
+DOCX_TEXT = re.compile(r"(<w:t(?:\s[^>]*)?>)(.*?)(</w:t>)", re.DOTALL)
+DOCX_BODY = "word/document.xml"
+
+
+class DocumentError(Exception):
+    """
+    Raised when a document cannot be read.
+    """
+
+
+def document_format(file_name: str, mime_type: str = None):
+    """
+    Returns the format of a document ("txt", "srt", "pdf" or "docx"), or
+    None when it is not supported.
+    """
+    extension = os.path.splitext(file_name or "")[1].lower()
+    return EXTENSIONS.get(extension) or MIME_TYPES.get(mime_type)
+
+
+def translated_file_name(file_name: str, format: str) -> str:
+    """
+    Names the translated copy of a document: report.pdf becomes
+    report.fa.txt, since PDF pages are translated into plain text.
+    """
+    base = os.path.splitext(file_name)[0] or "document"
+    extension = "txt" if format == "pdf" else format
+    return f"{base}.fa.{extension}"
+
+
+def _read_lines(path: str):
+    """
+    Yields the decoded lines of a text file and the share of the file read.
+    """
+    size = os.path.getsize(path) or 1
+    with open(path, "rb") as file:
+        for line in file:
+            yield line.decode("utf-8", errors="replace").lstrip("\ufeff"), (
+                file.tell() / size
+            )
+
+
+def _text_segments(path: str):
+    """
+    Yields a plain text file paragraph by paragraph as (text, translate,
+    progress): paragraphs to translate, and the line breaks between them to
+    keep as they are.
+    """
+    lines = []
+    progress = 0.0
+
+    def _flush():
+        text = "".join(lines)
+        body = text.rstrip("\r\n")
+        lines.clear()
+        return [(body, True, progress), (text[len(body) :], False, progress)]
+
+    for line, progress in _read_lines(path):
+        if not line.strip():
+            if lines:
+                yield from _flush()
+            yield line, False, progress
+            continue
+        lines.append(line)
+        if sum(len(line) for line in lines) >= MAX_SEGMENT_CHARS:
+            yield from _flush()
+    if lines:
+        yield from _flush()
+
+
+def _srt_segments(path: str):
+    """
+    Yields a subtitle file cue by cue as (text, translate, progress): the
+    cue numbers and timings are kept, the subtitle lines are translated.
+    """
+    cue = []
+    progress = 0.0
+
+    def _flush():
+        timing = next(
+            (index for index, line in enumerate(cue) if SRT_TIMING.match(line)), None
+        )
+        text = "".join(cue[timing + 1 :]) if timing is not None else ""
+        body = text.rstrip("\r\n")
+        head = "".join(cue[: timing + 1] if timing is not None else cue)
+        cue.clear()
+        return [
+            (head, False, progress),
+            (body, True, progress),
+            (text[len(body) :], False, progress),
+        ]
+
+    for line, progress in _read_lines(path):
+        if not line.strip():
+            if cue:
+                yield from _flush()
+            yield line, False, progress
+            continue
+        cue.append(line)
+    if cue:
+        yield from _flush()
+
+
+def _pdf_segments(path: str):
+    """
+    Yields the text of a PDF page by page as (text, translate, progress),
+    each page under a page heading. Pages are only read when reached.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise DocumentError("PDF support needs pypdf.") from e
+
+    try:
+        reader = PdfReader(path)
+        pages = len(reader.pages)
+    except Exception as e:
+        raise DocumentError(f"Could not read the PDF: {e}") from e
+    for number in range(pages):
+        progress = (number + 1) / pages
+        text = (reader.pages[number].extract_text() or "").strip()
+        yield f"— صفحه {number + 1} —\n\n", False, progress
+        yield text, True, progress
+        yield "\n\n", False, progress
+
+
+def _docx_segments(body, size: int, pieces: deque):
+    """
+    Reads a Word document body from the text stream `body` a chunk at a
+    time and yields its paragraphs as (text, translate, progress), with
+    empty segments for the XML between them. The XML of every segment is
+    appended to `pieces`, with whether it is a paragraph, for
+    `_replace_docx_paragraph`.
+    """
+    size = size or 1
+    read = 0
+    buffer = ""
+    while chunk := body.read(DOCX_READ_SIZE):
+        read += len(chunk.encode("utf-8"))
+        buffer += chunk
+        position = 0
+        for match in DOCX_PARAGRAPH.finditer(buffer):
+            pieces.append((buffer[position : match.start()], False))
+            yield "", False, read / size
+            text = "".join(
+                unescape(run.group(2)) for run in DOCX_TEXT.finditer(match.group(0))
+            )
+            pieces.append((match.group(0), True))
+            yield text, True, read / size
+            position = match.end()
+        # A paragraph not read to its end starts at the last paragraph tag
+        # at the earliest, and the read may have stopped inside a tag
+        starts = [
+            start.start() for start in DOCX_PARAGRAPH_START.finditer(buffer, position)
+        ]
+        keep = starts[-1] if starts else max(buffer.rfind("<", position), position)
+        pieces.append((buffer[position:keep], False))
+        yield "", False, read / size
+        buffer = buffer[keep:]
+    pieces.append((buffer, False))
+    yield "", False, 1.0
+
+
+def _replace_docx_paragraph(paragraph: str, translation: str) -> str:
+    """
+    Puts the translation of a Word paragraph in its first text run and
+    empties the other runs, so the formatting of the paragraph and its
+    first run is kept.
+    """
+    first = True
+
+    def _run(run):
+        nonlocal first
+        text = escape(translation) if first else ""
+        first = False
+        return f'<w:t xml:space="preserve">{text}{run.group(3)}'
+
+    return DOCX_TEXT.sub(_run, paragraph)
+
+
+def _next_batch(segments) -> list:
+    return [segment for _, segment in zip(range(READ_BATCH_SIZE), segments)]
+
+
+async def _iterate(segments):
+    """
+    Pulls segments from a blocking parser in the document worker pool, a
+    batch at a time.
+    """
+    while True:
+        batch = await document_pool.run(_next_batch, segments)
+        if not batch:
+            return
+        for segment in batch:
+            yield segment
+
+
+async def translate_segments(segments, translate, write, progress=None):
+    """
+    Translates the (text, translate, progress) segments of the async
+    iterator `segments` with `translate` and passes the results to `write`
+    in document order.
+
+    Segments are translated concurrently while at most
+    DOCUMENT_TOKEN_BUDGET tokens are in flight; parsing waits for the
+    oldest segment to be written once the budget is used up, so only a
+    window of the document is ever held in memory. `progress`, if given, is
+    awaited with the share of the document written.
+    """
+    pending = deque()
+    in_flight = 0
+
+    async def _write_next():
+        nonlocal in_flight
+        task, tokens, share = pending.popleft()
+        write(await task)
+        in_flight -= tokens
+        if progress:
+            await progress(share)
+
+    try:
+        async for text, needs_translation, share in segments:
+            tokens = count_tokens(text) if needs_translation and text.strip() else 0
+            while pending and (
+                in_flight + tokens > settings.DOCUMENT_TOKEN_BUDGET
+                or pending[0][0].done()
+            ):
+                await _write_next()
+            if tokens:
+                task = asyncio.ensure_future(translate(text))
+            else:
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(text)
+            pending.append((task, tokens, share))
+            in_flight += tokens
+        while pending:
+            await _write_next()
+    finally:
+        for task, _, _ in pending:
+            task.cancel()
+
+
+async def _translate_docx(source: str, output: str, translate, progress=None):
+    def _open():
+        try:
+            archive = zipfile.ZipFile(source)
+            archive.getinfo(DOCX_BODY)
+            return archive
+        except (zipfile.BadZipFile, KeyError) as e:
+            raise DocumentError(f"Could not read the Word document: {e}") from e
+
+    def _copy(item: zipfile.ZipInfo):
+        with archive.open(item) as part, copy.open(item, "w") as target:
+            shutil.copyfileobj(part, target)
+
+    # The parts are copied over in chunks and the body is translated as it
+    # is read and written, so no part is held in memory as a whole
+    archive = await document_pool.run(_open)
+    with archive, zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as copy:
+        for item in archive.infolist():
+            if item.filename != DOCX_BODY:
+                await document_pool.run(_copy, item)
+                continue
+            pieces = deque()
+
+            def _write(text: str):
+                xml, is_paragraph = pieces.popleft()
+                if is_paragraph:
+                    xml = _replace_docx_paragraph(xml, text)
+                target.write(xml.encode("utf-8"))
+
+            with archive.open(item) as part, copy.open(item, "w") as target:
+                body = io.TextIOWrapper(part, encoding="utf-8")
+                await translate_segments(
+                    _iterate(_docx_segments(body, item.file_size, pieces)),
+                    translate,
+                    _write,
+                    progress,
+                )
+
+
+SEGMENT_PARSERS = {"txt": _text_segments, "srt": _srt_segments, "pdf": _pdf_segments}
+
+
+async def translate_document(
+    source: str, format: str, output: str, translate, progress=None
+):
+    """
+    Translates the document at `source` into `output`, keeping its
+    structure: paragraphs of text files, the numbers and timings of
+    subtitles, the pages of PDFs (as plain text) and the formatting of Word
+    documents. `translate` is an async function from text to its
+    translation, `progress` as in translate_segments.
+    """
+    if format == "docx":
+        await _translate_docx(source, output, translate, progress)
+        return
+    with open(output, "w", encoding="utf-8", newline="") as file:
+        await translate_segments(
+            _iterate(SEGMENT_PARSERS[format](source)), translate, file.write, progress
+        )
@@ -0,0 +1,233 @@
+# journal.py
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages recorded for a job. Items of a stage are numbered, e.g. one
+# item per transcribed segment; COMPLETE marks a stage as finished.
+REPLIED = "replied"
+DOWNLOADED = "downloaded"
+TRANSCRIBED = "transcribed"
+TRANSLATED = "translated"
+SENT = "sent"
+COMPLETE = -1
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Identifies this process as the owner of the jobs it runs
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """
+    Tells whether the process that owns a job still runs. Owners on other
+    hosts are assumed alive.
+    """
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, ValueError):
+        return True
+    return True
+
+
+class Job:
+    """
+    The journal entry of one update. Each pipeline stage records its
+    results as it goes, so a job interrupted by a restart can continue
+    from its last completed step.
+    """
+
+    def __init__(self, journal, update_id: int, payload: str, resumed: bool = False):
+        self.journal = journal
+        self.update_id = update_id
+        self.payload = payload
+        self.resumed = resumed
+
+    def results(self, stage: str) -> dict:
+        """
+        Returns the recorded items of `stage` by index.
+        """
+        return self.journal.results(self.update_id, stage)
+
+    def completed(self, stage: str) -> bool:
+        return COMPLETE in self.results(stage)
+
+    def record(self, stage: str, index: int, value: str = ""):
+        self.journal.record(self.update_id, stage, index, value)
+
+    def complete(self, stage: str):
+        self.record(stage, COMPLETE)
+
+    def file_path(self, name: str) -> str:
+        """
+        Returns where the job keeps its intermediate file `name`.
+        """
+        return os.path.join(self.journal.files_dir, f"{self.update_id}-{name}")
+
+    def finish(self, status: str = DONE):
+        self.journal.finish(self.update_id, status)
+
+
+class JobJournal:
+    """
+    A persistent record of the updates the bot has taken on, in a SQLite
+    file in WAL mode.
+
+    Every update id is journaled once, so updates Telegram delivers again
+    (also after a restart) are recognized. Jobs still marked as running
+    after their process died are handed out again by `orphaned_jobs`.
+    """
+
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600):
+        self.path = path
+        self.files_dir = os.path.join(os.path.dirname(path) or ".", "jobs")
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            if not os.path.exists(self.files_dir):
+                os.makedirs(self.files_dir, exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "update_id INTEGER PRIMARY KEY, chat_id INTEGER, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, owner TEXT NOT NULL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_steps ("
+                "update_id INTEGER NOT NULL, stage TEXT NOT NULL, "
+                "item INTEGER NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (update_id, stage, item))"
+            )
+        return self._db
+
+    def begin(self, update_id: int, chat_id: int, payload: str):
+        """
+        Journals a new job and returns it, or returns None when the update
+        was journaled before.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(update_id, chat_id, payload, status, owner, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (update_id, chat_id, payload, RUNNING, OWNER, now, now),
+            )
+        if cursor.rowcount != 1:
+            return None
+        return Job(self, update_id, payload)
+
+    def results(self, update_id: int, stage: str) -> dict:
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT item, value FROM job_steps WHERE update_id = ? AND stage = ?",
+                    (update_id, stage),
+                )
+                .fetchall()
+            )
+        return dict(rows)
+
+    def record(self, update_id: int, stage: str, index: int, value: str):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO job_steps (update_id, stage, item, value) "
+                "VALUES (?, ?, ?, ?)",
+                (update_id, stage, index, value),
+            )
+            db.execute(
+                "UPDATE jobs SET updated_at = ? WHERE update_id = ?",
+                (time.time(), update_id),
+            )
+
+    def finish(self, update_id: int, status: str):
+        """
+        Marks a job as done or failed and drops its intermediate results.
+        """
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE update_id = ?",
+                (status, time.time(), update_id),
+            )
+            db.execute("DELETE FROM job_steps WHERE update_id = ?", (update_id,))
+            db.execute("COMMIT")
+        self._remove_files(update_id)
+
+    def _remove_files(self, update_id: int):
+        prefix = f"{update_id}-"
+        for name in os.listdir(self.files_dir):
+            if name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.files_dir, name))
+                except OSError as e:
+                    logger.warning(f"Failed to remove job file {name}: {e}")
+
+    def orphaned_jobs(self) -> list:
+        """
+        Takes over the running jobs whose process has died and returns them
+        for resuming. Also forgets finished jobs past the retention period.
+        Meant to be called once when the process starts.
+        """
+        jobs = []
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "DELETE FROM jobs WHERE status != ? AND updated_at < ?",
+                (RUNNING, time.time() - self.retention),
+            )
+            rows = db.execute(
+                "SELECT update_id, payload, owner FROM jobs WHERE status = ?",
+                (RUNNING,),
+            ).fetchall()
+            for update_id, payload, owner in rows:
+                # Called at startup, so jobs under our own name are from an
+                # earlier process that had the same pid (e.g. pid 1 in a container)
+                if owner != OWNER and _owner_alive(owner):
+                    continue
+                # Only one of several starting processes wins the job
+                cursor = db.execute(
+                    "UPDATE jobs SET owner = ?, updated_at = ? "
+                    "WHERE update_id = ? AND owner = ?",
+                    (OWNER, time.time(), update_id, owner),
+                )
+                if cursor.rowcount == 1:
+                    jobs.append(Job(self, update_id, payload, resumed=True))
+        return jobs
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+journal = JobJournal(
+    settings.JOURNAL_DB_PATH, retention=settings.JOURNAL_RETENTION_DAYS * 24 * 3600
+)
@@ -0,0 +1,167 @@
+# media.py
+
+import asyncio
+import io
+import os
+import tempfile
+
+import settings
+from connections import http_client
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+
+
+class ByteBudget:
+    """
+    Caps the bytes of media held in memory at once across all jobs. A job
+    reserves the memory its file may take before downloading or producing
+    it and waits while the budget is used up, so peak memory stays
+    predictable however many media jobs run concurrently.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = 0
+        self._waiters = []
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, size: int):
+        # A file larger than the whole budget still gets to run on its own
+        size = min(size, self.limit)
+        loop = asyncio.get_running_loop()
+        while self.reserved + size > self.limit:
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self.reserved += size
+        return size
+
+    def release(self, size: int):
+        self.reserved -= size
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+media_budget = ByteBudget(settings.MEDIA_MEMORY_BUDGET)
+
+
+class MediaFile(tempfile.SpooledTemporaryFile):
+    """
+    A named media file held in memory up to MEDIA_SPOOL_SIZE bytes and
+    moved to an anonymous temporary file beyond that. Closing it returns
+    its reservation to the media budget.
+
+    While in memory it reports no file descriptor, so uploads stream it
+    from its buffer instead of moving it to disk to measure it.
+    """
+
+    def __init__(self, name: str, reserved: int = 0):
+        super().__init__(max_size=settings.MEDIA_SPOOL_SIZE)
+        self._name = name
+        self._reserved = reserved
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+
+    @property
+    def in_memory(self) -> bool:
+        return not self._rolled
+
+    def getbuffer(self) -> memoryview:
+        """
+        Returns a view of the content of a file held in memory, without
+        copying it.
+        """
+        if self._rolled:
+            raise io.UnsupportedOperation("The file is not held in memory.")
+        return self._file.getbuffer()
+
+    def fileno(self) -> int:
+        if not self._rolled:
+            raise io.UnsupportedOperation("The file is held in memory.")
+        return super().fileno()
+
+    def size(self) -> int:
+        if self._rolled:
+            return os.fstat(self.fileno()).st_size
+        with self._file.getbuffer() as view:
+            return view.nbytes
+
+    def take_reservation(self) -> int:
+        """
+        Hands the file's reservation over to the caller, e.g. to a file
+        derived from this one.
+        """
+        reserved, self._reserved = self._reserved, 0
+        return reserved
+
+    def close(self):
+        super().close()
+        if self._reserved:
+            media_budget.release(self.take_reservation())
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+
+
+async def open_media_file(name: str, size: int = None, source=None) -> MediaFile:
+    """
+    Returns an empty MediaFile once the memory it may take fits in the
+    media budget: `size` bytes at most the spool size, or the spool size
+    when the size is not known.
+
+    A file produced from the MediaFile `source` takes over the reservation
+    of its source instead, so a job never waits for the budget while
+    holding a share of it.
+    """
+    if isinstance(source, MediaFile):
+        return MediaFile(name, source.take_reservation())
+    if not size:
+        size = settings.MEDIA_SPOOL_SIZE
+    reserved = await media_budget.acquire(min(size, settings.MEDIA_SPOOL_SIZE))
+    return MediaFile(name, reserved)
+
+
+async def stream_download(url: str, file) -> int:
+    """
+    Streams the file at `url` into the binary file object `file` chunk by
+    chunk, so it is never held in memory as a whole, over the shared
+    connection pool. Returns the number of bytes written.
+    """
+    size = 0
+    async with http_client().stream(
+        "GET", url, timeout=settings.MEDIA_JOB_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+            file.write(chunk)
+            size += len(chunk)
+    return size
+
+
+async def download_media(url: str, name: str, size: int = None) -> MediaFile:
+    """
+    Downloads the file at `url` into a MediaFile named `name`, reserving
+    `size` bytes (if known) of the media budget first. The file is returned
+    rewound.
+    """
+    media_file = await open_media_file(name, size)
+    try:
+        await stream_download(url, media_file)
+    except BaseException:
+        media_file.close()
+        raise
+    media_file.seek(0)
+    return media_file
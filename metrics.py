@@ -0,0 +1,390 @@
+# metrics.py
+
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Stage latencies range from milliseconds (cache hits) to many minutes
+# (long YouTube transcriptions)
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    A named metric with optional labels, rendered in the Prometheus text
+    exposition format.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def samples(self) -> list:
+        """
+        Returns (suffix, label values, extra label, value) for every sample.
+        """
+        with self._lock:
+            return [("", key, "", value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, key, extra, value in self.samples():
+            labels = _format_labels(self.label_names, key, extra)
+            lines.append(f"{self.name}{suffix}{labels} {value:g}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Instead of being set, a gauge can also
+    read its values from a function when it is collected.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func, **labels):
+        """
+        Reports `func()` as the value for `labels` whenever collected.
+        """
+        self._functions[self._key(labels)] = func
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self) -> list:
+        samples = super().samples()
+        for key, func in list(self._functions.items()):
+            try:
+                samples.append(("", key, "", func()))
+            except Exception as e:
+                logger.warning(f"Failed to collect {self.name}: {e}")
+        return samples
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def quantile(self, q: float, **labels) -> float:
+        """
+        Estimates the `q` quantile from the buckets, like Prometheus'
+        histogram_quantile.
+        """
+        entry = self._values.get(self._key(labels))
+        if not entry or not sum(entry[0]):
+            return 0.0
+        counts = entry[0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def label_sets(self) -> list:
+        with self._lock:
+            return [dict(zip(self.label_names, key)) for key in self._values]
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            entries = list(self._values.items())
+        for key, (counts, total) in entries:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                samples.append(("_bucket", key, f'le="{le}"', cumulative))
+            samples.append(("_sum", key, "", total))
+            samples.append(("_count", key, "", cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = Histogram(
+    "bot_stage_duration_seconds", "Time spent in each processing stage.", ("stage",)
+)
+stage_in_flight = Gauge(
+    "bot_stage_in_flight", "Operations currently running per stage.", ("stage",)
+)
+stage_errors = Counter(
+    "bot_stage_errors_total", "Operations per stage that raised.", ("stage",)
+)
+queue_depth = Gauge("bot_queue_depth", "Work items waiting per queue.", ("queue",))
+media_bytes_reserved = Gauge(
+    "bot_media_bytes_reserved", "Bytes of the media memory budget in use."
+)
+jobs_shed = Counter(
+    "bot_jobs_shed_total",
+    "Jobs turned away by admission control.",
+    ("job_class", "reason"),
+)
+bytes_processed = Counter(
+    "bot_bytes_processed_total", "Bytes downloaded or produced per stage.", ("stage",)
+)
+cache_lookups = Counter(
+    "bot_cache_lookups_total",
+    "Cache lookups per cache and result: memory hit, disk hit or miss.",
+    ("cache", "result"),
+)
+audio_seconds = Counter(
+    "bot_audio_seconds_total", "Seconds of audio sent for transcription."
+)
+translation_routes = Counter(
+    "bot_translation_routes_total",
+    "Translations per route: passed through, glossary or translation backend.",
+    ("route",),
+)
+startup_seconds = Gauge(
+    "bot_startup_seconds",
+    "Seconds from process launch to each startup milestone.",
+    ("milestone",),
+)
+post_paragraphs = Counter(
+    "bot_post_paragraphs_total",
+    "Paragraphs of posts and their edits, translated or reused from before.",
+    ("result",),
+)
+openai_tokens = Counter(
+    "bot_openai_tokens_total",
+    "Tokens reported by the OpenAI API.",
+    ("model", "kind"),
+)
+
+
+@contextmanager
+def track(stage: str):
+    """
+    Measures the enclosed block as one operation of `stage`: its latency,
+    whether it is in flight and whether it raised.
+    """
+    stage_in_flight.inc(stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+            stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+        stage_in_flight.dec(stage=stage)
+
+
+def timed(stage: str):
+    """
+    Decorates a coroutine function so every call is tracked as `stage`.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(stage):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_usage(usage, model: str):
+    """
+    Counts the prompt and completion tokens of an OpenAI usage object.
+    """
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            openai_tokens.inc(tokens, model=model, kind=kind)
+
+
+def summary() -> str:
+    """
+    Returns a one-line-per-stage text summary of the collected metrics.
+    """
+    lines = []
+    for labels in sorted(stage_seconds.label_sets(), key=lambda l: l["stage"]):
+        stage = labels["stage"]
+        lines.append(
+            f"{stage}: {stage_seconds.count(stage=stage)} done, "
+            f"{stage_in_flight.value(stage=stage):g} running, "
+            f"{stage_errors.value(stage=stage):g} failed, "
+            f"p50 {stage_seconds.quantile(0.5, stage=stage):.2f}s, "
+            f"p95 {stage_seconds.quantile(0.95, stage=stage):.2f}s"
+        )
+    tokens = {
+        kind: sum(
+            value for _, key, _, value in openai_tokens.samples() if key[1] == kind
+        )
+        for kind in ("prompt", "completion")
+    }
+    lines.append(
+        f"openai tokens: {tokens['prompt']:g} prompt, "
+        f"{tokens['completion']:g} completion; "
+        f"audio transcribed: {audio_seconds.value():.0f}s"
+    )
+    startup = ", ".join(
+        f"{key[0]} {value:.2f}s" for _, key, _, value in startup_seconds.samples()
+    )
+    if startup:
+        lines.append(f"startup: {startup}")
+    depths = ", ".join(
+        f"{key[0]}={value:g}" for _, key, _, value in queue_depth.samples()
+    )
+    if depths:
+        lines.append(f"queues: {depths}")
+    return "\n".join(lines)
+
+
+async def log_summary_periodically(interval: float):
+    """
+    Logs `summary()` every `interval` seconds, until cancelled.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Metrics summary:\n{summary()}")
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # skip the headers
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].startswith("/metrics"):
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    """
+    Serves the metrics in the Prometheus text format on
+    http://host:port/metrics and returns the asyncio server.
+    """
+    return await asyncio.start_server(_handle_scrape, host, port)
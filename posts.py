@@ -0,0 +1,104 @@
+# posts.py
+
+import asyncio
+import json
+import re
+
+import metrics
+import settings
+from store import shared_store
+
+# Paragraphs are separated by blank lines; the separators are kept as they are
+PARAGRAPH_BREAK = re.compile(r"(\n[ \t]*\n\s*)")
+
+
+def split_paragraphs(text: str) -> list:
+    """
+    Splits text into its paragraphs and the blank lines between them, in
+    turn, so that joining the parts gives the text back.
+    """
+    return PARAGRAPH_BREAK.split(text)
+
+
+async def translate_paragraphs(text: str, translate, previous: list = None) -> list:
+    """
+    Translates `text` paragraph by paragraph, concurrently, with the
+    coroutine function `translate`, which returns None when it fails.
+
+    Paragraphs that also occur in `previous`, the segments of an earlier
+    version of the text, keep their translation, so an edited post only
+    costs the paragraphs that changed. Returns the segments of the text as
+    [source, translation] pairs; failed paragraphs have no translation and
+    are tried again on the next edit.
+    """
+    known = {
+        source: translation
+        for source, translation in previous or []
+        if translation is not None
+    }
+    parts = split_paragraphs(text)
+
+    async def _translate(index: int, part: str):
+        # Odd parts are the blank lines between paragraphs
+        if index % 2 or not part.strip():
+            return part
+        if part in known:
+            metrics.post_paragraphs.inc(result="reused")
+            return known[part]
+        metrics.post_paragraphs.inc(result="translated")
+        return await translate(part)
+
+    translations = await asyncio.gather(
+        *(_translate(index, part) for index, part in enumerate(parts))
+    )
+    return [[part, translation] for part, translation in zip(parts, translations)]
+
+
+def join_translation(segments: list, failed: str) -> str:
+    """
+    Joins the translated segments into one text, with `failed` in place of
+    paragraphs that could not be translated.
+    """
+    return "".join(
+        failed if translation is None else translation for _, translation in segments
+    )
+
+
+def post_key(chat_id: int, message_id: int) -> str:
+    return f"post:{chat_id}:{message_id}"
+
+
+async def load_post(chat_id: int, message_id: int):
+    """
+    Returns what was stored about the translation of a message, or None:
+    a dict with its "kind" ("text", or "photo" or "video" for a caption),
+    its "segments" and its "replies", the ids of the messages sent by
+    destination chat.
+    """
+    value = await shared_store.get(post_key(chat_id, message_id))
+    if value is None:
+        return None
+    post = json.loads(value)
+    post["replies"] = {
+        int(chat_id): message_ids for chat_id, message_ids in post["replies"].items()
+    }
+    return post
+
+
+async def save_post(
+    chat_id: int, message_id: int, kind: str, segments: list, replies: dict
+):
+    """
+    Stores the translation of a message and its replies for
+    EDIT_TRACKING_TTL seconds, so that edits of the message can update them.
+    """
+    if not settings.EDIT_TRACKING or not replies:
+        return
+    await shared_store.set(
+        post_key(chat_id, message_id),
+        json.dumps(
+            {"kind": kind, "segments": segments, "replies": replies},
+            ensure_ascii=False,
+        ),
+        settings.EDIT_TRACKING_TTL,
+    )
@@ -0,0 +1,255 @@
+# ratelimit.py
+
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+import openai
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket: `rate` tokens per second, bursts up to
+    `capacity`. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """
+        Waits until `amount` tokens are available and takes them.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def available(self) -> float:
+        """
+        Returns the tokens that could be taken right now.
+        """
+        now = time.monotonic()
+        if now < self._blocked_until or self._lock.locked():
+            return 0.0
+        self._refill(now)
+        return self._tokens
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """
+        Takes `amount` tokens if they are available right now, without
+        waiting. Returns whether they were taken.
+        """
+        amount = min(amount, self.capacity)
+        if self.available() < amount:
+            return False
+        self._tokens -= amount
+        return True
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out tokens for `seconds`, e.g. after a Retry-After reply.
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """
+    Returns how long to wait before retry number `attempt` (0-based): the
+    server's Retry-After plus a little jitter when given, otherwise a
+    jittered exponential backoff.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return min(60.0, 2**attempt) * random.uniform(0.5, 1.5)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Throttles outgoing Bot API requests to stay within Telegram's limits: a
+    global bucket for the bot and one bucket per destination chat (stricter
+    for groups and channels). Requests that still hit flood control are
+    queued again after the `retry_after` Telegram asks for, instead of being
+    dropped.
+
+    Bot methods accept `rate_limit_args={"max_retries": n}` to override how
+    often a request is retried.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = settings.TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = settings.TELEGRAM_CHAT_RATE,
+        group_rate: float = settings.TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+        max_retries: int = settings.TELEGRAM_MAX_RETRIES,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10_000:
+                self._chat_buckets = {
+                    key: value
+                    for key, value in self._chat_buckets.items()
+                    if not value.is_idle()
+                }
+            # Group, supergroup and channel ids are negative
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, 3)
+        return bucket
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        chat_id = data.get("chat_id")
+        max_retries = (rate_limit_args or {}).get("max_retries", self.max_retries)
+
+        for attempt in itertools.count():
+            with metrics.track("telegram_rate_wait"):
+                if endpoint != "getUpdates":
+                    await self.global_bucket.acquire()
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+            try:
+                if endpoint == "getUpdates":
+                    return await callback(*args, **kwargs)
+                with metrics.track("telegram_api"):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= max_retries:
+                    raise
+                retry_after = getattr(e.retry_after, "total_seconds", None)
+                delay = backoff_delay(
+                    attempt, retry_after() if retry_after else e.retry_after
+                )
+                logger.warning(
+                    f"Telegram flood control on {endpoint} for chat {chat_id}, "
+                    f"retrying in {delay:.1f}s."
+                )
+                bucket = (
+                    self._chat_bucket(chat_id)
+                    if chat_id is not None
+                    else self.global_bucket
+                )
+                bucket.pause(delay)
+
+
+def _retry_after_header(error: openai.APIStatusError):
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class OpenAIRateLimiter:
+    """
+    Keeps OpenAI calls within the account's requests-per-minute and
+    tokens-per-minute quotas, and retries rate-limited or failed calls with
+    jittered backoff, honoring the Retry-After header. A Retry-After pauses
+    all calls, since the quota is shared.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = settings.OPENAI_RPM,
+        tokens_per_minute: float = settings.OPENAI_TPM,
+        max_retries: int = settings.OPENAI_MAX_RETRIES,
+    ):
+        self.requests = TokenBucket(
+            requests_per_minute / 60, max(1.0, requests_per_minute / 60)
+        )
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 6)
+        self.max_retries = max_retries
+
+    def share(self, processes: int):
+        """
+        Limits this process to its part of the quotas when `processes` bot
+        processes use the same OpenAI account.
+        """
+        for bucket in (self.requests, self.tokens):
+            bucket.rate /= processes
+            bucket.capacity = max(1.0, bucket.capacity / processes)
+
+    async def call(self, func, *args, tokens: int = 0, **kwargs):
+        """
+        Awaits `func(*args, **kwargs)` once the quotas allow a request that
+        uses an estimated `tokens` tokens, retrying transient failures.
+        """
+        for attempt in itertools.count():
+            with metrics.track("openai_rate_wait"):
+                await self.requests.acquire()
+                if tokens:
+                    await self.tokens.acquire(tokens)
+            try:
+                with metrics.track("openai_request"):
+                    result = await func(*args, **kwargs)
+                metrics.record_usage(
+                    getattr(result, "usage", None), kwargs.get("model")
+                )
+                return result
+            except openai.RateLimitError as e:
+                if attempt >= self.max_retries or e.code == "insufficient_quota":
+                    raise
+                delay = backoff_delay(attempt, _retry_after_header(e))
+                logger.warning(f"OpenAI rate limit hit, retrying in {delay:.1f}s.")
+                self.requests.pause(delay)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    f"OpenAI request failed ({e}), retrying in {delay:.1f}s."
+                )
+                await asyncio.sleep(delay)
+
+
+openai_limiter = OpenAIRateLimiter()
@@ -0,0 +1,212 @@
+# router.py
+
+import re
+
+import settings
+
+PASS_THROUGH = "pass_through"
+GLOSSARY = "glossary"
+
+# Links, mentions and hashtags are kept as they are
+LINK = re.compile(r"(?:https?://|www\.)\S+|[@#]\w+", re.IGNORECASE)
+GLOSSARY_TERM = re.compile(r"([A-Za-z]+)(\d*)")
+GLOSSARY_WORD = re.compile(r"\b[A-Za-z]+\d*\b")
+TICKER_PAIR = re.compile(r"[A-Z0-9]{2,10}/[A-Z0-9]{2,10}")
+DOLLAR_TICKER = re.compile(r"\$[A-Za-z]{1,6}")
+ABBREVIATED_NUMBER = re.compile(r"\d[\d.,]*[kKmMbB]")
+
+# Letters only Persian uses, and Arabic letters Persian keyboards never type
+PERSIAN_LETTERS = set("پچژگکی")
+ARABIC_ONLY_LETTERS = set("ةيكى")
+PERSIAN_SCRIPT_SHARE = 0.8
+
+QUOTE_CURRENCIES = (
+    "USDT",
+    "USDC",
+    "USD",
+    "EUR",
+    "GBP",
+    "JPY",
+    "CHF",
+    "CAD",
+    "AUD",
+    "NZD",
+    "BTC",
+    "ETH",
+)
+KNOWN_TICKERS = set(QUOTE_CURRENCIES) | {
+    "XAU",
+    "XAG",
+    "GOLD",
+    "SILVER",
+    "OIL",
+    "WTI",
+    "BRENT",
+    "DXY",
+    "US30",
+    "US100",
+    "US500",
+    "NAS100",
+    "SPX",
+    "SPX500",
+    "NDX",
+    "DJI",
+    "DAX",
+    "GER40",
+    "UK100",
+    "JP225",
+    "VIX",
+    "BNB",
+    "SOL",
+    "XRP",
+    "ADA",
+    "DOGE",
+    "TON",
+    "TRX",
+    "CNY",
+    "IRR",
+    "IRT",
+}
+
+# Trading terms that make up signal posts, in the words Persian traders use
+TRADING_GLOSSARY = {
+    "buy": "خرید",
+    "sell": "فروش",
+    "long": "لانگ",
+    "short": "شورت",
+    "entry": "ورود",
+    "target": "تارگت",
+    "tp": "حد سود",
+    "sl": "حد ضرر",
+    "stoploss": "حد ضرر",
+    "limit": "لیمیت",
+    "stop": "استاپ",
+    "now": "اکنون",
+    "zone": "محدوده",
+    "support": "حمایت",
+    "resistance": "مقاومت",
+    "bullish": "صعودی",
+    "bearish": "نزولی",
+    "profit": "سود",
+    "loss": "ضرر",
+    "pip": "پیپ",
+    "pips": "پیپ",
+    "signal": "سیگنال",
+    "breakout": "شکست",
+    "closed": "بسته شد",
+    "hold": "نگه‌داری",
+    "update": "آپدیت",
+}
+
+
+def _strip_symbols(token: str) -> str:
+    """
+    Strips punctuation, emoji and other symbols around a token, except a
+    leading $ (tickers) and a trailing % (numbers).
+    """
+    start, end = 0, len(token)
+    while start < end and not token[start].isalnum() and token[start] != "$":
+        start += 1
+    while end > start and not token[end - 1].isalnum() and token[end - 1] != "%":
+        end -= 1
+    return token[start:end]
+
+
+def is_number(token: str) -> bool:
+    return not any(char.isalpha() for char in token) or bool(
+        ABBREVIATED_NUMBER.fullmatch(token)
+    )
+
+
+def is_ticker(token: str) -> bool:
+    """
+    Recognizes instrument symbols such as $AAPL, EUR/USD, XAUUSD or BTCUSDT.
+    """
+    if token in KNOWN_TICKERS:
+        return True
+    if DOLLAR_TICKER.fullmatch(token) or TICKER_PAIR.fullmatch(token):
+        return True
+    for quote in QUOTE_CURRENCIES:
+        base = token[: -len(quote)]
+        if token.endswith(quote) and 2 <= len(base) <= 6 and base.isupper():
+            return base.isalnum()
+    return False
+
+
+def glossary_term(token: str):
+    """
+    Returns the Persian of a trading term, keeping a number suffix as in
+    TP2, or None when `token` is not in the glossary.
+    """
+    match = GLOSSARY_TERM.fullmatch(token)
+    if match is None or match.group(1).lower() not in TRADING_GLOSSARY:
+        return None
+    translation = TRADING_GLOSSARY[match.group(1).lower()]
+    return f"{translation} {match.group(2)}" if match.group(2) else translation
+
+
+def apply_glossary(text: str) -> str:
+    """
+    Replaces the trading terms in `text` outside of links.
+    """
+
+    def _replace(match):
+        return glossary_term(match.group(0)) or match.group(0)
+
+    parts = []
+    position = 0
+    for link in LINK.finditer(text):
+        parts.append(GLOSSARY_WORD.sub(_replace, text[position : link.start()]))
+        parts.append(link.group(0))
+        position = link.end()
+    parts.append(GLOSSARY_WORD.sub(_replace, text[position:]))
+    return "".join(parts)
+
+
+def is_persian(text: str) -> bool:
+    """
+    Tells whether `text` is written in Persian: its letters are mostly in
+    the Arabic script, and it has no letters that only Arabic uses, unless
+    letters that only Persian uses show up as well.
+    """
+    letters = [char for char in text if char.isalpha()]
+    if not letters:
+        return False
+    arabic_script = sum(1 for char in letters if "\u0600" <= char <= "\u06ff")
+    if arabic_script / len(letters) < PERSIAN_SCRIPT_SHARE:
+        return False
+    if any(char in PERSIAN_LETTERS for char in letters):
+        return True
+    return not any(char in ARABIC_ONLY_LETTERS for char in letters)
+
+
+def fast_path(text: str):
+    """
+    Handles texts that need no translation model. Returns (route, result):
+    PASS_THROUGH for text that is already Persian or only consists of
+    links, numbers, tickers and emoji, GLOSSARY for signal-style text made
+    of tickers, numbers and trading terms. Returns None for everything else.
+    """
+    words = []
+    for token in LINK.sub(" ", text).split():
+        token = _strip_symbols(token)
+        if token and not is_number(token) and not is_ticker(token):
+            words.append(token)
+
+    if not words or is_persian(" ".join(words)):
+        return PASS_THROUGH, text
+    if all(glossary_term(word) for word in words):
+        return GLOSSARY, apply_glossary(text)
+    return None
+
+
+def use_fast_model(text: str, tokens: int) -> bool:
+    """
+    Tells whether a text is simple enough for FAST_MODEL: a single line of
+    at most FAST_MODEL_MAX_TOKENS tokens, like most captions.
+    """
+    return bool(
+        settings.FAST_MODEL
+        and tokens <= settings.FAST_MODEL_MAX_TOKENS
+        and "\n" not in text.strip()
+    )
@@ -5,9 +5,14 @@ load_dotenv()
 
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_API_TOKEN")
+TELEGRAM_API_URL = os.environ.get(
+    "TELEGRAM_API_URL"
+)  # e.g. a local Bot API server; the token is appended
+TELEGRAM_FILE_URL = os.environ.get("TELEGRAM_FILE_URL")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 MEDIA_GROUP_TIMEOUT = 2
+MEDIA_GROUP_DEBOUNCE = float(os.environ.get("MEDIA_GROUP_DEBOUNCE", "0.5"))
 
 # Authentication settings
 ALLOWED_USERS = (
@@ -28,3 +33,241 @@ ALLOWED_GROUPS = (
 
 MODEL = os.environ.get("MODEL", "gpt-4o-mini")
 PROMPT = os.environ.get("PROMPT")
+
+# Translation cache settings
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", "./data/cache.sqlite3")
+CACHE_MEMORY_ENTRIES = int(os.environ.get("CACHE_MEMORY_ENTRIES", "2048"))
+CACHE_DISK_ENTRIES = int(os.environ.get("CACHE_DISK_ENTRIES", "200000"))
+CACHE_TTL = int(os.environ.get("CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+
+# Segmented transcription settings
+TRANSCRIPTION_SEGMENT_SECONDS = int(
+    os.environ.get("TRANSCRIPTION_SEGMENT_SECONDS", "300")
+)
+TRANSCRIPTION_SEGMENT_OVERLAP_MS = int(
+    os.environ.get("TRANSCRIPTION_SEGMENT_OVERLAP_MS", "1000")
+)
+TRANSCRIPTION_SILENCE_SEARCH_MS = 30_000  # how far before a cut to look for silence
+TRANSCRIPTION_MIN_SILENCE_MS = 300
+TRANSCRIPTION_WORKERS = int(os.environ.get("TRANSCRIPTION_WORKERS", "4"))
+
+# Transcription backend settings
+TRANSCRIPTION_BACKEND = os.environ.get(
+    "TRANSCRIPTION_BACKEND", "openai"
+)  # "openai" (whisper-1) or "local" (faster-whisper)
+LOCAL_TRANSCRIPTION_MODEL = os.environ.get("LOCAL_TRANSCRIPTION_MODEL", "small")
+LOCAL_TRANSCRIPTION_COMPUTE_TYPE = os.environ.get(
+    "LOCAL_TRANSCRIPTION_COMPUTE_TYPE", "int8"
+)
+LOCAL_TRANSCRIPTION_THREADS = int(os.environ.get("LOCAL_TRANSCRIPTION_THREADS", "4"))
+LOCAL_TRANSCRIPTION_WORKERS = int(
+    os.environ.get("LOCAL_TRANSCRIPTION_WORKERS", "1")
+)  # files transcribed at the same time
+LOCAL_TRANSCRIPTION_VAD = os.environ.get("LOCAL_TRANSCRIPTION_VAD", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Long text translation settings
+TOKENIZER_NAME = os.environ.get("TOKENIZER_NAME", "Xenova/gpt-4o")
+TRANSLATION_CHUNK_TOKENS = int(os.environ.get("TRANSLATION_CHUNK_TOKENS", "1500"))
+TRANSLATION_CONCURRENCY = int(os.environ.get("TRANSLATION_CONCURRENCY", "4"))
+TRANSLATION_RETRIES = int(os.environ.get("TRANSLATION_RETRIES", "2"))
+
+# Streaming translation settings
+STREAM_TRANSLATIONS = os.environ.get("STREAM_TRANSLATIONS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+STREAM_EDIT_INTERVAL = float(
+    os.environ.get("STREAM_EDIT_INTERVAL", "1.5")
+)  # seconds between edits of a streamed message
+
+# Edit tracking and fan-out settings
+EDIT_TRACKING = os.environ.get("EDIT_TRACKING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)  # edits of a translated message update its translation in place
+EDIT_TRACKING_TTL = float(
+    os.environ.get("EDIT_TRACKING_TTL", str(2 * 24 * 3600))
+)  # seconds a translation is kept for later edits of its message
+FANOUT_CHATS = (
+    {
+        int(source): [int(id) for id in destinations.split(",")]
+        for source, destinations in (
+            route.split(":") for route in os.environ["FANOUT_CHATS"].split(";")
+        )
+    }
+    if os.environ.get("FANOUT_CHATS")
+    else {}
+)  # e.g. "-1001:-1002,-1003": posts of chat -1001 go to chats -1002 and -1003
+
+# Document translation settings
+DOCUMENT_TOKEN_BUDGET = int(
+    os.environ.get("DOCUMENT_TOKEN_BUDGET", "6000")
+)  # tokens of a document translated at the same time
+DOCUMENT_PROGRESS_INTERVAL = float(
+    os.environ.get("DOCUMENT_PROGRESS_INTERVAL", "3")
+)  # seconds between progress updates
+DOCUMENT_WORKERS = int(
+    os.environ.get("DOCUMENT_WORKERS", "2")
+)  # threads parsing and writing documents, apart from the media workers
+DOCUMENT_JOB_TIMEOUT = float(
+    os.environ.get("DOCUMENT_JOB_TIMEOUT", "60")
+)  # seconds before a single parsing or writing job is cancelled
+
+# Update dispatching settings
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "64"))
+TEXT_LANE_CONCURRENCY = int(os.environ.get("TEXT_LANE_CONCURRENCY", "32"))
+MEDIA_LANE_CONCURRENCY = int(os.environ.get("MEDIA_LANE_CONCURRENCY", "4"))
+
+# Admission control settings (per bot process; 0 disables a limit)
+TEXT_QUEUE_LIMIT = int(
+    os.environ.get("TEXT_QUEUE_LIMIT", "1000")
+)  # text jobs waiting or running at once, further ones are turned away
+TEXT_QUEUE_TOKENS = int(
+    os.environ.get("TEXT_QUEUE_TOKENS", "500000")
+)  # estimated tokens of those text jobs
+MEDIA_QUEUE_LIMIT = int(os.environ.get("MEDIA_QUEUE_LIMIT", "50"))
+MEDIA_QUEUE_SECONDS = float(
+    os.environ.get("MEDIA_QUEUE_SECONDS", str(4 * 3600))
+)  # estimated seconds of audio of the media jobs waiting or running
+MEDIA_QUEUE_BYTES = int(
+    os.environ.get("MEDIA_QUEUE_BYTES", str(2 * 1024 * 1024 * 1024))
+)  # estimated bytes those media jobs download
+SENDER_TEXT_JOBS = int(
+    os.environ.get("SENDER_TEXT_JOBS", "20")
+)  # text jobs one chat or user may have waiting or running
+SENDER_MEDIA_JOBS = int(os.environ.get("SENDER_MEDIA_JOBS", "3"))
+SENDER_JOBS_PER_MINUTE = float(os.environ.get("SENDER_JOBS_PER_MINUTE", "30"))
+SENDER_MEDIA_SECONDS_PER_HOUR = float(
+    os.environ.get("SENDER_MEDIA_SECONDS_PER_HOUR", "7200")
+)  # seconds of audio one user or channel may send for transcription
+YOUTUBE_COST_SECONDS = float(
+    os.environ.get("YOUTUBE_COST_SECONDS", "1800")
+)  # assumed length of a YouTube video, which is only known once downloaded
+DEGRADE_QUEUE_SHARE = float(
+    os.environ.get("DEGRADE_QUEUE_SHARE", "0.5")
+)  # beyond this share of TEXT_QUEUE_LIMIT, translations are sent without streaming
+ADMISSION_NOTICE_INTERVAL = float(
+    os.environ.get("ADMISSION_NOTICE_INTERVAL", "30")
+)  # seconds between "busy" replies to one chat
+
+# Media worker pool settings
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", "4"))
+MEDIA_JOB_TIMEOUT = float(os.environ.get("MEDIA_JOB_TIMEOUT", "1800"))  # seconds
+MEDIA_SPOOL_SIZE = int(
+    os.environ.get("MEDIA_SPOOL_SIZE", str(8 * 1024 * 1024))
+)  # bytes of a media file kept in memory, larger files go to a temporary file
+MEDIA_MEMORY_BUDGET = int(
+    os.environ.get("MEDIA_MEMORY_BUDGET", str(128 * 1024 * 1024))
+)  # bytes of media all jobs together keep in memory
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+# Translation micro-batching settings
+BATCH_TRANSLATIONS = os.environ.get("BATCH_TRANSLATIONS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "25"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "16"))
+BATCH_MAX_TOKENS = int(os.environ.get("BATCH_MAX_TOKENS", "2000"))
+BATCH_ITEM_MAX_TOKENS = int(
+    os.environ.get("BATCH_ITEM_MAX_TOKENS", "200")
+)  # longer texts are never batched
+
+# Translation routing settings
+FAST_PATH_TRANSLATIONS = os.environ.get("FAST_PATH_TRANSLATIONS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)  # pass Persian text, links and tickers through without a model
+FAST_MODEL = os.environ.get("FAST_MODEL")  # smaller model for short simple texts
+FAST_MODEL_MAX_TOKENS = int(os.environ.get("FAST_MODEL_MAX_TOKENS", "40"))
+
+# Translation backend settings
+TRANSLATION_BACKEND = os.environ.get(
+    "TRANSLATION_BACKEND", "openai"
+)  # "openai" or "local", the backend for everything not routed otherwise
+LOCAL_TRANSLATION_CHATS = (
+    [int(id) for id in os.environ.get("LOCAL_TRANSLATION_CHATS", "").split(",")]
+    if os.environ.get("LOCAL_TRANSLATION_CHATS")
+    else []
+)  # chats always served by the local model
+LOCAL_TRANSLATION_MAX_TOKENS = int(
+    os.environ.get("LOCAL_TRANSLATION_MAX_TOKENS", "0")
+)  # texts up to this long are served by the local model, 0 disables this
+LOCAL_TRANSLATION_MODEL = os.environ.get(
+    "LOCAL_TRANSLATION_MODEL", "facebook/nllb-200-distilled-600M"
+)
+LOCAL_TRANSLATION_SOURCE_LANG = os.environ.get(
+    "LOCAL_TRANSLATION_SOURCE_LANG", "eng_Latn"
+)
+LOCAL_TRANSLATION_TARGET_LANG = os.environ.get(
+    "LOCAL_TRANSLATION_TARGET_LANG", "pes_Arab"
+)
+LOCAL_TRANSLATION_THREADS = int(os.environ.get("LOCAL_TRANSLATION_THREADS", "4"))
+LOCAL_TRANSLATION_BATCH_SIZE = int(os.environ.get("LOCAL_TRANSLATION_BATCH_SIZE", "16"))
+LOCAL_TRANSLATION_MAX_INPUT_TOKENS = int(
+    os.environ.get("LOCAL_TRANSLATION_MAX_INPUT_TOKENS", "200")
+)
+
+# Rate limit settings
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))  # per second
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))  # per second
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(
+    os.environ.get("TELEGRAM_GROUP_RATE_PER_MINUTE", "20")
+)
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "5"))
+OPENAI_RPM = float(os.environ.get("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.environ.get("OPENAI_TPM", "200000"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "5"))
+
+# Connection settings
+HTTP2 = os.environ.get("HTTP2", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)  # multiplex the requests to each host over one connection; needs h2
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+HTTP_KEEPALIVE_EXPIRY = float(
+    os.environ.get("HTTP_KEEPALIVE_EXPIRY", "120")
+)  # seconds an idle connection is kept open
+PREWARM_CONNECTIONS = os.environ.get("PREWARM_CONNECTIONS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)  # open the OpenAI connection at startup, before the first update
+
+# Webhook and multi-process settings
+WEBHOOK_URL = os.environ.get(
+    "WEBHOOK_URL"
+)  # public HTTPS URL Telegram posts updates to; long polling is used when unset
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+SHARED_STORE_URL = os.environ.get("SHARED_STORE_URL") or (
+    "memory://" if WEB_WORKERS <= 1 else "sqlite:///./data/shared.sqlite3"
+)
+UPDATE_DEDUPE_TTL = 24 * 3600  # seconds an update id is remembered
+
+# Job journal settings
+JOURNAL_DB_PATH = os.environ.get("JOURNAL_DB_PATH", "./data/journal.sqlite3")
+JOURNAL_RETENTION_DAYS = float(os.environ.get("JOURNAL_RETENTION_DAYS", "7"))
+
+# Metrics settings
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(
+    os.environ.get("METRICS_PORT", "9464")
+)  # Prometheus endpoint, 0 disables it; worker n of several uses METRICS_PORT + n
+METRICS_LOG_INTERVAL = float(
+    os.environ.get("METRICS_LOG_INTERVAL", "300")
+)  # seconds between metrics summaries in the log, 0 disables them
@@ -0,0 +1,66 @@
+# startup.py
+
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _launch_time() -> float:
+    """
+    Returns when this process was started on the time.monotonic() clock, so
+    the interpreter's own startup counts too. Falls back to now where the
+    process start time is not available.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The process name may contain spaces; the fields follow its ")"
+            fields = stat.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (OSError, AttributeError, ValueError, IndexError):
+        return time.monotonic()
+    return time.monotonic() - max(0.0, uptime - started)
+
+
+LAUNCHED_AT = _launch_time()
+
+# Milestones in the order they are reached, with seconds since launch
+IMPORTED = "imported"  # the bot's modules are loaded
+READY = "ready"  # the application is initialized and about to take updates
+FIRST_UPDATE = "first_update"  # the first update has been handled
+
+_reached = {}
+
+
+def mark(milestone: str) -> float:
+    """
+    Records the first time `milestone` is reached, as seconds since launch,
+    and publishes it as bot_startup_seconds. Returns the recorded time.
+    """
+    if milestone not in _reached:
+        _reached[milestone] = time.monotonic() - LAUNCHED_AT
+        metrics.startup_seconds.set(_reached[milestone], milestone=milestone)
+        if milestone == FIRST_UPDATE:
+            logger.info(f"First update handled {report()}.")
+    return _reached[milestone]
+
+
+def report() -> str:
+    """
+    Describes the milestones reached so far, e.g. "1.52s after launch
+    (imported 0.81s, ready 1.20s)".
+    """
+    if not _reached:
+        return "not started yet"
+    *earlier, last = _reached.items()
+    text = f"{last[1]:.2f}s after launch"
+    if earlier:
+        steps = ", ".join(
+            f"{milestone} {seconds:.2f}s" for milestone, seconds in earlier
+        )
+        text += f" ({steps})"
+    return text
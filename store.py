@@ -0,0 +1,388 @@
+# store.py
+
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStore:
+    """
+    Short-lived state that every bot process must see: media groups being
+    collected and the ids of updates already handled. All keys expire after
+    their `ttl` (seconds).
+
+    Values are strings. Lists only support appending and reading as a whole,
+    which is all media group collection needs.
+    """
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """
+        Stores `value` under `key` unless the key exists. Returns True when
+        the value was stored, so exactly one caller wins a race.
+        """
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    async def get(self, key: str):
+        """
+        Returns the value stored under `key`, or None.
+        """
+        raise NotImplementedError
+
+    async def append(self, key: str, value: str, ttl: float) -> int:
+        """
+        Appends `value` to the list under `key` and returns its new length.
+        """
+        raise NotImplementedError
+
+    async def members(self, key: str) -> list:
+        """
+        Returns the list under `key` in insertion order (empty if missing).
+        """
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryStore(SharedStore):
+    """
+    A store in process memory, for a single bot process.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._writes_since_prune = 0
+
+    def _live(self, key: str):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] <= time.time():
+            del self._values[key]
+            return None
+        return entry
+
+    def _write(self, key: str, value, ttl: float):
+        self._values[key] = (value, time.time() + ttl)
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 1000:
+            self._writes_since_prune = 0
+            now = time.time()
+            for expired in [k for k, (_, exp) in self._values.items() if exp <= now]:
+                del self._values[expired]
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._write(key, value, ttl)
+        return True
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._write(key, value, ttl)
+
+    async def get(self, key: str):
+        entry = self._live(key)
+        return entry[0] if entry is not None else None
+
+    async def append(self, key: str, value: str, ttl: float) -> int:
+        entry = self._live(key)
+        values = entry[0] if entry is not None else []
+        values.append(value)
+        self._write(key, values, ttl)
+        return len(values)
+
+    async def members(self, key: str) -> list:
+        entry = self._live(key)
+        return list(entry[0]) if entry is not None else []
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+
+
+class SQLiteStore(SharedStore):
+    """
+    A store in a SQLite file in WAL mode, shared by the bot processes on one
+    host.
+
+    The connection is used by a single worker thread, so the event loop
+    never waits for the file's write lock while another process holds it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._writes_since_prune = 0
+        self._db = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shared-store"
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS shared_values ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS shared_lists ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS shared_lists_key ON shared_lists (key)"
+            )
+        return self._db
+
+    def _transaction(self, func):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(db, time.time())
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 1000:
+            self._writes_since_prune = 0
+            now = time.time()
+            db.execute("DELETE FROM shared_values WHERE expires_at <= ?", (now,))
+            db.execute("DELETE FROM shared_lists WHERE expires_at <= ?", (now,))
+        return result
+
+    def _query(self, sql: str, key: str) -> list:
+        return self._connection().execute(sql, (key, time.time())).fetchall()
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        def _add(db, now):
+            db.execute(
+                "DELETE FROM shared_values WHERE key = ? AND expires_at <= ?",
+                (key, now),
+            )
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO shared_values (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            return cursor.rowcount == 1
+
+        return await self._run(self._transaction, _add)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._run(
+            self._transaction,
+            lambda db, now: db.execute(
+                "INSERT OR REPLACE INTO shared_values (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            ),
+        )
+
+    async def get(self, key: str):
+        rows = await self._run(
+            self._query,
+            "SELECT value FROM shared_values WHERE key = ? AND expires_at > ?",
+            key,
+        )
+        return rows[0][0] if rows else None
+
+    async def append(self, key: str, value: str, ttl: float) -> int:
+        def _append(db, now):
+            db.execute(
+                "INSERT INTO shared_lists (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            # Like Redis, appending extends the lifetime of the whole list
+            db.execute(
+                "UPDATE shared_lists SET expires_at = ? WHERE key = ?",
+                (now + ttl, key),
+            )
+            return db.execute(
+                "SELECT COUNT(*) FROM shared_lists WHERE key = ?", (key,)
+            ).fetchone()[0]
+
+        return await self._run(self._transaction, _append)
+
+    async def members(self, key: str) -> list:
+        rows = await self._run(
+            self._query,
+            "SELECT value FROM shared_lists WHERE key = ? AND expires_at > ? "
+            "ORDER BY id",
+            key,
+        )
+        return [row[0] for row in rows]
+
+    async def delete(self, *keys: str):
+        def _delete(db, now):
+            for key in keys:
+                db.execute("DELETE FROM shared_values WHERE key = ?", (key,))
+                db.execute("DELETE FROM shared_lists WHERE key = ?", (key,))
+
+        await self._run(self._transaction, _delete)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class RedisError(Exception):
+    """
+    An error reply from the Redis server.
+    """
+
+
+class RedisStore(SharedStore):
+    """
+    A store in Redis (or any server speaking the Redis protocol), shared by
+    bot processes on any number of hosts.
+
+    Talks RESP over a single asyncio connection, so no Redis client library
+    is needed. Commands are serialized on that connection.
+    """
+
+    def __init__(self, host: str, port: int = 6379, db: int = 0, password=None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip("AUTH", self.password)
+        if self.db:
+            await self._roundtrip("SELECT", self.db)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+    async def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _command(self, *args):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._roundtrip(*args)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                    self._close_connection()
+                    if attempt:
+                        raise
+                    logger.warning(f"Redis connection lost, reconnecting: {e}")
+
+    def _close_connection(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        reply = await self._command("SET", key, value, "NX", "PX", int(ttl * 1000))
+        return reply == "OK"
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._command("SET", key, value, "PX", int(ttl * 1000))
+
+    async def get(self, key: str):
+        return await self._command("GET", key)
+
+    async def append(self, key: str, value: str, ttl: float) -> int:
+        length = await self._command("RPUSH", key, value)
+        await self._command("PEXPIRE", key, int(ttl * 1000))
+        return length
+
+    async def members(self, key: str) -> list:
+        return await self._command("LRANGE", key, 0, -1) or []
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._command("DEL", *keys)
+
+    async def close(self):
+        async with self._lock:
+            self._close_connection()
+
+
+def open_store(url: str) -> SharedStore:
+    """
+    Creates the store described by `url`: memory://, sqlite:///path/to/file
+    or redis://[:password@]host[:port][/db].
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryStore()
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/path and sqlite:////absolute/path
+        return SQLiteStore(parsed.path[1:])
+    if parsed.scheme == "redis":
+        return RedisStore(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            int(parsed.path.lstrip("/") or 0),
+            parsed.password,
+        )
+    raise ValueError(f"Unsupported shared store URL: {url}")
+
+
+shared_store = open_store(settings.SHARED_STORE_URL)
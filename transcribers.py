@@ -0,0 +1,158 @@
+# transcribers.py
+
+import logging
+import threading
+from io import BytesIO
+
+import settings
+from workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Language codes and names the transcription engines use for Persian
+PERSIAN_LANGUAGES = {"fa", "fas", "per", "persian", "farsi"}
+
+
+def is_persian(language) -> bool:
+    return bool(language) and language.lower() in PERSIAN_LANGUAGES
+
+
+class Transcription:
+    """
+    The text of a recording, the language detected in it (a code such as
+    "fa" or a name such as "persian"; None when unknown) and its duration
+    in seconds (None when unknown).
+    """
+
+    def __init__(self, text: str, language: str = None, duration: float = None):
+        self.text = text
+        self.language = language
+        self.duration = duration
+
+
+class TranscriptionBackend:
+    """
+    An engine that turns speech into text.
+    """
+
+    name = "backend"
+
+    def available(self) -> bool:
+        """
+        Tells whether the backend can take requests.
+        """
+        return True
+
+    async def transcribe(self, audio_file: BytesIO) -> Transcription:
+        """
+        Transcribes the audio file. Raises on failure.
+        """
+        raise NotImplementedError
+
+
+class LocalTranscriber(TranscriptionBackend):
+    """
+    Transcribes on the CPU with a Whisper model through faster-whisper,
+    int8-quantized by default.
+
+    The model is loaded once and shared by `workers` threads, each decoding
+    one file at a time with `threads` CPU threads. Voice activity detection
+    drops silence before decoding, which saves time on voice messages with
+    pauses and keeps Whisper from inventing text for silent stretches.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_name: str,
+        compute_type: str = "int8",
+        threads: int = 4,
+        workers: int = 1,
+        vad: bool = True,
+        timeout: float = None,
+    ):
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.threads = threads
+        self.workers = workers
+        self.vad = vad
+        self.failed = False
+
+        self._pool = WorkerPool("local-transcription", workers, timeout=timeout)
+        self._load_lock = threading.Lock()
+        self._model = None
+
+    @property
+    def pending(self) -> int:
+        return self._pool.waiting
+
+    def available(self) -> bool:
+        return not self.failed
+
+    def load(self):
+        """
+        Loads the model unless loaded already. Raises, and marks the backend
+        as unavailable, if it cannot be loaded.
+        """
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                from faster_whisper import WhisperModel
+
+                self._model = WhisperModel(
+                    self.model_name,
+                    device="cpu",
+                    compute_type=self.compute_type,
+                    cpu_threads=self.threads,
+                    num_workers=self.workers,
+                )
+            except Exception as e:
+                self.failed = True
+                logger.warning(
+                    f"Could not load transcription model {self.model_name}: {e}"
+                )
+                raise
+            logger.info(f"Loaded transcription model {self.model_name}.")
+
+    async def warm_up(self) -> bool:
+        """
+        Loads the model ahead of the first request. Returns whether the
+        backend is ready.
+        """
+        try:
+            await self._pool.run(self.load)
+        except Exception:
+            return False
+        return True
+
+    def _transcribe(self, audio_file: BytesIO) -> Transcription:
+        self.load()
+        audio_file.seek(0)
+        # Greedy decoding; the segments are decoded while being iterated
+        segments, info = self._model.transcribe(
+            audio_file, beam_size=1, vad_filter=self.vad
+        )
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        logger.info(
+            f"Transcribed {info.duration:.1f}s of audio "
+            f"({info.duration_after_vad:.1f}s of speech) in {info.language} "
+            f"(probability {info.language_probability:.2f})."
+        )
+        return Transcription(text, info.language, info.duration)
+
+    async def transcribe(self, audio_file: BytesIO) -> Transcription:
+        if self.failed:
+            raise RuntimeError(f"Transcription model {self.model_name} is unavailable.")
+        return await self._pool.run(self._transcribe, audio_file)
+
+
+local_transcriber = LocalTranscriber(
+    settings.LOCAL_TRANSCRIPTION_MODEL,
+    compute_type=settings.LOCAL_TRANSCRIPTION_COMPUTE_TYPE,
+    threads=settings.LOCAL_TRANSCRIPTION_THREADS,
+    workers=settings.LOCAL_TRANSCRIPTION_WORKERS,
+    vad=settings.LOCAL_TRANSCRIPTION_VAD,
+    timeout=settings.MEDIA_JOB_TIMEOUT,
+)
@@ -0,0 +1,242 @@
+# translators.py
+
+import asyncio
+import logging
+import threading
+
+import metrics
+import settings
+from cache import make_key, normalize_text
+from chunking import PARAGRAPH_BREAK, count_tokens, split_by_tokens
+from workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class TranslationBackend:
+    """
+    An engine that translates text to Persian. `translate_text` picks a
+    backend per request, so each one also names the cache entries it
+    produces.
+    """
+
+    name = "backend"
+
+    def available(self) -> bool:
+        """
+        Tells whether the backend can take requests.
+        """
+        return True
+
+    def cache_key(self, text: str) -> str:
+        """
+        Returns the translation cache key of `text` for this backend.
+        """
+        raise NotImplementedError
+
+    async def translate(self, text: str, tokens: int) -> str:
+        """
+        Translates `text` (`tokens` model tokens long). Raises on failure.
+        """
+        raise NotImplementedError
+
+
+class LocalTranslator(TranslationBackend):
+    """
+    Translates on the CPU with a local seq2seq checkpoint (MarianMT, NLLB,
+    M2M100 and the like) through transformers.
+
+    The model is loaded once and kept in memory. It translates one batch at
+    a time on a dedicated thread using `threads` torch threads, and every
+    piece queued while a batch runs goes into the next batch (up to
+    `max_batch_size` pieces), so concurrent requests share the forward
+    passes. Texts are translated paragraph by paragraph in pieces of at most
+    `max_input_tokens` tokens, since these models are trained on sentences.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_name: str,
+        source_lang: str = None,
+        target_lang: str = None,
+        threads: int = 4,
+        max_batch_size: int = 16,
+        max_input_tokens: int = 200,
+        timeout: float = None,
+    ):
+        self.model_name = model_name
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.threads = threads
+        self.max_batch_size = max_batch_size
+        self.max_input_tokens = max_input_tokens
+        self.failed = False
+
+        self._pool = WorkerPool("local-translation", 1, timeout=timeout)
+        self._load_lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+        self._forced_bos_token_id = None
+        self._pending = []
+        self._worker = None
+
+        self.batches = 0
+        self.pieces = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def available(self) -> bool:
+        return not self.failed
+
+    def cache_key(self, text: str) -> str:
+        return make_key(
+            normalize_text(text),
+            self.name,
+            self.model_name,
+            self.source_lang,
+            self.target_lang,
+        )
+
+    def load(self):
+        """
+        Loads the tokenizer and model unless loaded already. Raises, and
+        marks the backend as unavailable, if they cannot be loaded.
+        """
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                import torch
+                from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+                torch.set_num_threads(self.threads)
+                tokenizer_args = (
+                    {"src_lang": self.source_lang} if self.source_lang else {}
+                )
+                tokenizer = AutoTokenizer.from_pretrained(
+                    self.model_name, **tokenizer_args
+                )
+                model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+                model.eval()
+            except Exception as e:
+                self.failed = True
+                logger.warning(
+                    f"Could not load translation model {self.model_name}: {e}"
+                )
+                raise
+            # Multilingual checkpoints such as NLLB start the output with the
+            # target language token
+            if self.target_lang:
+                self._forced_bos_token_id = tokenizer.get_vocab().get(self.target_lang)
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info(f"Loaded translation model {self.model_name}.")
+
+    async def warm_up(self) -> bool:
+        """
+        Loads the model ahead of the first request. Returns whether the
+        backend is ready.
+        """
+        try:
+            await self._pool.run(self.load)
+        except Exception:
+            return False
+        return True
+
+    def _generate(self, texts: list) -> list:
+        import torch
+
+        self.load()
+        inputs = self._tokenizer(
+            texts, return_tensors="pt", padding=True, truncation=True
+        )
+        generate_args = {
+            # Greedy decoding, Persian output is rarely more than twice as long
+            "num_beams": 1,
+            "max_new_tokens": 2 * inputs["input_ids"].shape[1] + 16,
+        }
+        if self._forced_bos_token_id is not None:
+            generate_args["forced_bos_token_id"] = self._forced_bos_token_id
+        with torch.inference_mode():
+            output = self._model.generate(**inputs, **generate_args)
+        return self._tokenizer.batch_decode(output, skip_special_tokens=True)
+
+    async def _run_batches(self):
+        """
+        Translates pending pieces batch by batch until none are left.
+        """
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.pieces += len(batch)
+            try:
+                with metrics.track("translate_local_batch"):
+                    results = await self._pool.run(
+                        self._generate, [text for text, _ in batch]
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result.strip())
+
+    async def _translate_pieces(self, pieces: list) -> list:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for piece in pieces:
+            future = loop.create_future()
+            self._pending.append((piece, future))
+            futures.append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run_batches())
+        return await asyncio.gather(*futures)
+
+    async def translate(self, text: str, tokens: int) -> str:
+        if self.failed:
+            raise RuntimeError(f"Translation model {self.model_name} is unavailable.")
+        paragraphs = [
+            (
+                split_by_tokens(paragraph, self.max_input_tokens)
+                if count_tokens(paragraph) > self.max_input_tokens
+                else [paragraph.strip()]
+            )
+            for paragraph in PARAGRAPH_BREAK.split(text.strip())
+            if paragraph.strip()
+        ]
+        translations = await self._translate_pieces(
+            [piece for pieces in paragraphs for piece in pieces]
+        )
+        results = []
+        for pieces in paragraphs:
+            results.append(" ".join(translations[: len(pieces)]))
+            translations = translations[len(pieces) :]
+        return "\n\n".join(results)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "pieces": self.pieces,
+            "average_batch_size": self.pieces / self.batches if self.batches else 0,
+        }
+
+
+local_translator = LocalTranslator(
+    settings.LOCAL_TRANSLATION_MODEL,
+    source_lang=settings.LOCAL_TRANSLATION_SOURCE_LANG,
+    target_lang=settings.LOCAL_TRANSLATION_TARGET_LANG,
+    threads=settings.LOCAL_TRANSLATION_THREADS,
+    max_batch_size=settings.LOCAL_TRANSLATION_BATCH_SIZE,
+    max_input_tokens=settings.LOCAL_TRANSLATION_MAX_INPUT_TOKENS,
+    timeout=settings.MEDIA_JOB_TIMEOUT,
+)
@@ -1,115 +1,837 @@
+import asyncio
+import functools
+import html as html_module
+import json
 from io import BytesIO
 import os
-import yt_dlp
-from openai import OpenAI, AsyncOpenAI
+import re
+import shutil
+import threading
+import unicodedata
+import uuid
+from openai import DEFAULT_TIMEOUT, AsyncOpenAI
+import metrics
+import router
 import settings
+from audio import transcribe_segments, extract_speech_audio
+from batching import TranslationBatcher
+from media import MediaFile, open_media_file
+from translators import TranslationBackend, local_translator
+from transcribers import (
+    Transcription,
+    TranscriptionBackend,
+    is_persian,
+    local_transcriber,
+)
+from ratelimit import openai_limiter
+from chunking import count_tokens, split_by_tokens
+from connections import http_client
+from workers import media_pool, JobCancelled
+from journal import DOWNLOADED, TRANSCRIBED
+from cache import (
+    translation_cache,
+    transcription_cache,
+    normalize_text,
+    make_key,
+    SingleFlight,
+)
 
-
-client = AsyncOpenAI(
-    api_key=settings.OPENAI_API_KEY,
+TRANSLATION_TEMPERATURE = 0.3
+TRANSLATION_ERROR = "مشکلی در ترجمه متن پیش آمد!"
+TRANSLATION_INSTRUCTION = "متن رو به صورت تخصصی در حوضه بازار مالی ترجمه و مرتب کن:"
+PROMPT_TOKEN_ALLOWANCE = 200  # system prompt and instruction
+BATCH_INSTRUCTION = (
+    "The user message is a JSON object whose values are independent texts. "
+    "Translate every value on its own as instructed, and reply with a JSON "
+    "object that has exactly the same keys and the translations as values."
 )
+TRANSCRIPTION_ERROR = "Failed to transcribe the audio."
+YOUTUBE_AUDIO_FORMAT = "bestaudio-opus-16k-mono"
+
+# Transcriptions currently being produced, keyed like the transcription cache
+transcriptions_in_flight = SingleFlight()
+
+
+@functools.lru_cache(maxsize=1)
+def _openai_client(pool) -> AsyncOpenAI:
+    # Retries are handled by openai_limiter, which honors Retry-After across calls
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        max_retries=0,
+        timeout=DEFAULT_TIMEOUT,
+        http_client=pool,
+    )
 
 
-async def download_youtube_audio(url: str) -> BytesIO:
+def openai_client() -> AsyncOpenAI:
     """
-    Downloads audio from a YouTube video and returns it as BytesIO object.
+    Returns the OpenAI client, created on first use on top of the shared
+    connection pool.
     """
-    try:
-        if not os.path.exists("./tempfiles"):
-            os.makedirs("./tempfiles")
-
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "192",
-                }
-            ],
-            "outtmpl": "./tempfiles/%(id)s.%(ext)s",
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            video_id = info["id"]
-            audio_path = f"./tempfiles/{video_id}.mp3"
-
-            # Read the audio file into BytesIO
-            with open(audio_path, "rb") as f:
-                audio_bytes = BytesIO(f.read())
-                audio_bytes.name = f"{video_id}.mp3"
+    return _openai_client(http_client())
+
+
+def youtube_video_id(url: str):
+    """
+    Extracts the video id from a YouTube URL, or returns None.
+    """
+    match = re.search(
+        r"(?:youtube\.com/watch\?(?:.*&)?v=|youtu\.be/)([a-zA-Z0-9_-]+)", url
+    )
+    return match.group(1) if match else None
+
 
+def _download_youtube_audio_sync(url: str, cancel_event) -> str:
+    """
+    Blocking part of `download_youtube_audio`, run in the media worker pool.
+    Returns the path of the downloaded file. Stops at the next progress
+    update once `cancel_event` is set.
+    """
+    # yt-dlp is slow to import and only needed for YouTube links
+    import yt_dlp
+
+    if not os.path.exists("./tempfiles"):
+        os.makedirs("./tempfiles")
+
+    def _check_cancelled(progress):
+        if cancel_event.is_set():
+            raise JobCancelled(f"Download of {url} was cancelled.")
+
+    # Keep the native audio stream; ffmpeg reads it from disk for conversion
+    ydl_opts = {
+        "format": "bestaudio/best",
+        "outtmpl": f"./tempfiles/%(id)s-{uuid.uuid4().hex}.%(ext)s",
+        "progress_hooks": [_check_cancelled],
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return ydl.prepare_filename(info)
+
+
+async def download_youtube_audio(url: str) -> MediaFile:
+    """
+    Downloads audio from a YouTube video and returns it as a MediaFile
+    holding mono 16 kHz Opus. The download runs in the media worker pool and
+    is subject to its concurrency limit and timeout; ffmpeg converts the
+    downloaded file straight from disk, which is removed afterwards.
+    """
+    try:
+        cancel_event = threading.Event()
+        with metrics.track("youtube_download"):
+            audio_path = await media_pool.run(
+                _download_youtube_audio_sync,
+                url,
+                cancel_event,
+                cancel_event=cancel_event,
+            )
+        try:
+            metrics.bytes_processed.inc(
+                os.path.getsize(audio_path), stage="youtube_download"
+            )
+            video_id = youtube_video_id(url) or "youtube"
+            with open(audio_path, "rb") as source:
+                return await extract_speech_audio(source, f"{video_id}.webm")
+        finally:
             # Clean up the temporary file
             os.remove(audio_path)
-
-            return audio_bytes
     except Exception as e:
         print(f"Error downloading YouTube audio: {e}")
         raise
 
 
-async def translate_text(text: str) -> str:
+@metrics.timed("translate")
+async def translate_text(text: str, chat_id: int = None) -> str:
     """
-    Translates the given text to Persian using OpenAI's Chat Completion API.
+    Translates the given text to Persian, with OpenAI's Chat Completion API
+    or the local model depending on the chat and the text length (see
+    `translation_backend`). Text that needs no model, such as Persian text or
+    bare tickers, takes the fast path (see `router.fast_path`). Results are
+    served from the translation cache when the same text was already
+    translated by the same backend. Texts longer than
+    TRANSLATION_CHUNK_TOKENS are translated in chunks, and short texts are
+    batched with other concurrent requests.
     """
+    routed = _fast_path(text)
+    if routed is not None:
+        return routed
+
+    tokens = count_tokens(text)
+    if tokens > settings.TRANSLATION_CHUNK_TOKENS:
+        return await translate_long_text(text, chat_id)
+
     try:
-        response = await client.chat.completions.create(
-            model=settings.MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": settings.PROMPT,
-                },
-                {
-                    "role": "user",
-                    "content": f"متن رو به صورت تخصصی در حوضه بازار مالی ترجمه و مرتب کن: \n\n{text}",
-                },
-            ],
-            temperature=0.3,
-        )
-        translated_text = response.choices[0].message.content.strip()
-        return translated_text
+        return await _translate_chunk(text, tokens, chat_id)
     except Exception as e:
         print(f"Error during translation: {e}")
-        return "مشکلی در ترجمه متن پیش آمد!"
+        metrics.stage_errors.inc(stage="translate")
+        return TRANSLATION_ERROR
+
+
+def _fast_path(text: str):
+    """
+    Returns the result of `router.fast_path` for `text`, or None when it
+    needs translating.
+    """
+    if not settings.FAST_PATH_TRANSLATIONS:
+        return None
+    routed = router.fast_path(text)
+    if routed is None:
+        return None
+    route, result = routed
+    metrics.translation_routes.inc(route=route)
+    return result
+
+
+def _translation_cache_key(text: str, model: str = settings.MODEL) -> str:
+    return make_key(
+        normalize_text(text),
+        model,
+        settings.PROMPT,
+        TRANSLATION_TEMPERATURE,
+    )
+
+
+def _translation_messages(text: str) -> list:
+    return [
+        {
+            "role": "system",
+            "content": settings.PROMPT,
+        },
+        {
+            "role": "user",
+            "content": f"{TRANSLATION_INSTRUCTION} \n\n{text}",
+        },
+    ]
+
+
+def _estimate_completion_tokens(text: str) -> int:
+    """
+    Estimates the prompt plus completion tokens a translation will use, for
+    the tokens-per-minute quota.
+    """
+    return 2 * count_tokens(text) + PROMPT_TOKEN_ALLOWANCE
+
+
+async def _request_translation(text: str, model: str = settings.MODEL) -> str:
+    response = await openai_limiter.call(
+        openai_client().chat.completions.create,
+        tokens=_estimate_completion_tokens(text),
+        model=model,
+        messages=_translation_messages(text),
+        temperature=TRANSLATION_TEMPERATURE,
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def _request_batch_translation(texts: list, model: str = settings.MODEL) -> list:
+    """
+    Translates several texts with one completion by sending them as numbered
+    JSON segments. Raises ValueError if the reply does not contain a
+    translation for every segment.
+    """
+    segments = {str(index + 1): text for index, text in enumerate(texts)}
+    response = await openai_limiter.call(
+        openai_client().chat.completions.create,
+        tokens=_estimate_completion_tokens("\n".join(texts)),
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": f"{settings.PROMPT}\n\n{BATCH_INSTRUCTION}",
+            },
+            {
+                "role": "user",
+                "content": f"{TRANSLATION_INSTRUCTION} \n\n"
+                + json.dumps(segments, ensure_ascii=False),
+            },
+        ],
+        temperature=TRANSLATION_TEMPERATURE,
+        response_format={"type": "json_object"},
+    )
+    translations = json.loads(response.choices[0].message.content or "")
+    if not isinstance(translations, dict) or not all(
+        isinstance(translations.get(key), str) for key in segments
+    ):
+        raise ValueError("Batched translation reply is missing segments.")
+    return [translations[key].strip() for key in segments]
 
 
-async def transcribe_audio(audio_file: BytesIO) -> str:
+class OpenAITranslator(TranslationBackend):
+    """
+    Translates with `model` through the OpenAI Chat Completion API. Short
+    texts are batched with other concurrent requests for the same model.
+    """
+
+    def __init__(self, model: str, name: str = "openai"):
+        self.model = model
+        self.name = name
+        self.batcher = TranslationBatcher(
+            functools.partial(_request_batch_translation, model=model),
+            functools.partial(_request_translation, model=model),
+            window=settings.BATCH_WINDOW_MS / 1000,
+            max_items=settings.BATCH_MAX_ITEMS,
+            max_tokens=settings.BATCH_MAX_TOKENS,
+        )
+
+    def cache_key(self, text: str) -> str:
+        return _translation_cache_key(text, self.model)
+
+    async def translate(self, text: str, tokens: int) -> str:
+        if settings.BATCH_TRANSLATIONS and tokens <= settings.BATCH_ITEM_MAX_TOKENS:
+            return await self.batcher.translate(text, tokens)
+        return await _request_translation(text, self.model)
+
+
+openai_translator = OpenAITranslator(settings.MODEL)
+fast_translator = OpenAITranslator(settings.FAST_MODEL or settings.MODEL, "openai_fast")
+translation_batcher = openai_translator.batcher
+
+
+def local_translation_enabled() -> bool:
+    """
+    Tells whether any translations are routed to the local model.
+    """
+    return bool(
+        settings.TRANSLATION_BACKEND == "local"
+        or settings.LOCAL_TRANSLATION_CHATS
+        or settings.LOCAL_TRANSLATION_MAX_TOKENS
+    )
+
+
+def translation_backend(
+    text: str, tokens: int, chat_id: int = None
+) -> TranslationBackend:
+    """
+    Picks the backend for `text` (`tokens` tokens long) from chat `chat_id`:
+    the local model for chats in LOCAL_TRANSLATION_CHATS, texts of at most
+    LOCAL_TRANSLATION_MAX_TOKENS tokens and, with TRANSLATION_BACKEND set to
+    "local", everything else. Otherwise, or when the local model could not
+    be loaded, OpenAI with FAST_MODEL for short simple texts and MODEL for
+    the rest.
+    """
+    if local_translation_enabled() and local_translator.available():
+        if (
+            settings.TRANSLATION_BACKEND == "local"
+            or chat_id in settings.LOCAL_TRANSLATION_CHATS
+            or tokens <= settings.LOCAL_TRANSLATION_MAX_TOKENS
+        ):
+            return local_translator
+    if router.use_fast_model(text, tokens):
+        return fast_translator
+    return openai_translator
+
+
+async def _translate_with(backend: TranslationBackend, text: str, tokens: int) -> str:
+    cache_key = backend.cache_key(text)
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    translated_text = await backend.translate(text, tokens)
+    translation_cache.set(cache_key, translated_text)
+    return translated_text
+
+
+async def _translate_chunk(text: str, tokens: int = None, chat_id: int = None) -> str:
+    """
+    Translates one piece of text through the cache with the backend chosen
+    for it. Falls back to OpenAI when the local model fails. Raises on API
+    errors.
+    """
+    routed = _fast_path(text)
+    if routed is not None:
+        return routed
+
+    if tokens is None:
+        tokens = count_tokens(text)
+    backend = translation_backend(text, tokens, chat_id)
+    metrics.translation_routes.inc(route=backend.name)
+    try:
+        return await _translate_with(backend, text, tokens)
+    except Exception as e:
+        if isinstance(backend, OpenAITranslator):
+            raise
+        print(f"Error during local translation, using OpenAI instead: {e}")
+        return await _translate_with(openai_translator, text, tokens)
+
+
+async def translate_text_stream(text: str, chat_id: int = None):
+    """
+    Translates like `translate_text`, but yields the translation in pieces as
+    the chat completion streams in. Fast-path, cached, batched (short),
+    chunked (long) and locally translated texts are yielded in one piece.
+    """
+    routed = _fast_path(text)
+    if routed is not None:
+        yield routed
+        return
+
+    tokens = count_tokens(text)
+    if tokens > settings.TRANSLATION_CHUNK_TOKENS:
+        yield await translate_long_text(text, chat_id)
+        return
+    backend = translation_backend(text, tokens, chat_id)
+    if not isinstance(backend, OpenAITranslator) or (
+        settings.BATCH_TRANSLATIONS and tokens <= settings.BATCH_ITEM_MAX_TOKENS
+    ):
+        # Short texts finish quickly; batching them saves more than streaming
+        yield await translate_text(text, chat_id)
+        return
+
+    metrics.translation_routes.inc(route=backend.name)
+    cache_key = backend.cache_key(text)
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
     try:
-        transcription = await client.audio.transcriptions.create(
-            model="whisper-1", file=audio_file
+        with metrics.track("translate_stream"):
+            stream = await openai_limiter.call(
+                openai_client().chat.completions.create,
+                tokens=_estimate_completion_tokens(text),
+                model=backend.model,
+                messages=_translation_messages(text),
+                temperature=TRANSLATION_TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for event in stream:
+                if event.usage:
+                    metrics.record_usage(event.usage, backend.model)
+                if event.choices and event.choices[0].delta.content:
+                    parts.append(event.choices[0].delta.content)
+                    yield event.choices[0].delta.content
+    except Exception as e:
+        print(f"Error during streamed translation: {e}")
+        yield f"\n\n{TRANSLATION_ERROR}" if parts else TRANSLATION_ERROR
+        return
+
+    translation_cache.set(cache_key, "".join(parts).strip())
+
+
+async def translate_long_text(text: str, chat_id: int = None) -> str:
+    """
+    Splits a long text into token-bounded chunks at paragraph and sentence
+    boundaries, translates them concurrently (at most TRANSLATION_CONCURRENCY
+    at a time) and joins the translations in the original order. A failed
+    chunk is retried on its own without redoing the others.
+    """
+    chunks = split_by_tokens(text, settings.TRANSLATION_CHUNK_TOKENS)
+    semaphore = asyncio.Semaphore(settings.TRANSLATION_CONCURRENCY)
+
+    async def _translate(index: int, chunk: str) -> str:
+        async with semaphore:
+            for attempt in range(settings.TRANSLATION_RETRIES + 1):
+                try:
+                    return await _translate_chunk(chunk, chat_id=chat_id)
+                except Exception as e:
+                    print(
+                        f"Error translating chunk {index + 1}/{len(chunks)} "
+                        f"(attempt {attempt + 1}): {e}"
+                    )
+                    if attempt < settings.TRANSLATION_RETRIES:
+                        await asyncio.sleep(2**attempt)
+            return TRANSLATION_ERROR
+
+    translations = await asyncio.gather(
+        *(_translate(index, chunk) for index, chunk in enumerate(chunks))
+    )
+    return "\n\n".join(translations)
+
+
+class OpenAITranscriber(TranscriptionBackend):
+    """
+    Transcribes with OpenAI's whisper-1, which also reports the language.
+    """
+
+    name = "openai"
+
+    async def transcribe(self, audio_file: BytesIO) -> Transcription:
+        # The file object is streamed into the upload in chunks, not read whole
+        response = await openai_limiter.call(
+            openai_client().audio.transcriptions.create,
+            model="whisper-1",
+            file=(os.path.basename(audio_file.name), audio_file),
+            response_format="verbose_json",
         )
-        return transcription.text
+        return Transcription(
+            response.text,
+            getattr(response, "language", None),
+            getattr(response, "duration", None),
+        )
+
+
+openai_transcriber = OpenAITranscriber()
+
+
+def transcription_backend() -> TranscriptionBackend:
+    """
+    Returns the backend selected by TRANSCRIPTION_BACKEND, or OpenAI when
+    the local model could not be loaded.
+    """
+    if settings.TRANSCRIPTION_BACKEND == "local" and local_transcriber.available():
+        return local_transcriber
+    return openai_transcriber
+
+
+def _language_key(key: str) -> str:
+    return f"language:{key}"
+
+
+def transcription_language(key: str):
+    """
+    Returns the language detected in the audio transcribed under `key`, or
+    None when unknown.
+    """
+    return transcription_cache.get(_language_key(key))
+
+
+@metrics.timed("transcribe")
+async def transcribe_audio(audio_file: BytesIO, key: str = None) -> str:
+    """
+    Transcribes the audio with the configured backend, falling back to
+    OpenAI when the local model fails. The detected language is remembered
+    under `key`, if given (see `transcription_language`), and the duration
+    the backend reports is counted in `metrics.audio_seconds`.
+    """
+    backend = transcription_backend()
+    try:
+        try:
+            transcription = await backend.transcribe(audio_file)
+        except Exception as e:
+            if backend is openai_transcriber:
+                raise
+            print(f"Error during local transcription, using OpenAI instead: {e}")
+            audio_file.seek(0)
+            transcription = await openai_transcriber.transcribe(audio_file)
     except Exception as e:
         print(e)
-        return "Failed to transcribe the audio."
+        metrics.stage_errors.inc(stage="transcribe")
+        return TRANSCRIPTION_ERROR
+    if transcription.duration:
+        metrics.audio_seconds.inc(transcription.duration)
+    if key is not None and transcription.language:
+        transcription_cache.set(_language_key(key), transcription.language)
+    return transcription.text
+
+
+async def translate_transcription(text: str, key: str = None, chat_id: int = None):
+    """
+    Translates transcribed text, unless the audio transcribed under `key`
+    was detected as Persian already; then the text is returned as is.
+    """
+    if key is not None and is_persian(transcription_language(key)):
+        return text
+    return await translate_text(text, chat_id)
+
+
+async def transcribe_cached(key: str, load_audio) -> str:
+    """
+    Transcribes the audio returned by the `load_audio` coroutine function,
+    reusing earlier transcriptions stored under `key`. Concurrent calls with
+    the same key share a single download and transcription.
+    """
+    cached = transcription_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def _load_and_transcribe():
+        with await load_audio() as audio_file:
+            transcription = await transcribe_audio(audio_file, key)
+        if transcription != TRANSCRIPTION_ERROR:
+            transcription_cache.set(key, transcription)
+        return transcription
+
+    return await transcriptions_in_flight.do(key, _load_and_transcribe)
+
+
+async def _load_journaled_audio(job, load_audio) -> MediaFile:
+    """
+    Returns the audio a job downloaded before a restart, or loads it with
+    `load_audio` and keeps a copy in the job's files.
+    """
+    path = job.file_path("audio")
+    recorded = job.results(DOWNLOADED)
+    if 0 in recorded and os.path.exists(path):
+        audio_file = await open_media_file(recorded[0], os.path.getsize(path))
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, audio_file)
+        audio_file.seek(0)
+        return audio_file
+
+    audio_file = await load_audio()
+    with open(path, "wb") as f:
+        shutil.copyfileobj(audio_file, f)
+    audio_file.seek(0)
+    job.record(DOWNLOADED, 0, getattr(audio_file, "name", "audio.ogg"))
+    return audio_file
+
+
+async def transcribe_stream(key: str, load_audio, job=None):
+    """
+    Transcribes the audio returned by the `load_audio` coroutine function
+    segment by segment and yields each segment's text in order as soon as it
+    is ready. Cached transcriptions are yielded in one piece, and a caller
+    arriving while the same key is in flight waits for the full result.
+
+    With a journal `job`, the downloaded audio and every transcribed segment
+    are recorded, and a resumed job only transcribes what is missing.
+    """
+    if job is not None:
+        transcribed = job.results(TRANSCRIBED)
+        if job.completed(TRANSCRIBED):
+            for index in sorted(i for i in transcribed if i >= 0):
+                yield transcribed[index]
+            return
+        # Failed segments are transcribed again
+        done = {i: t for i, t in transcribed.items() if t != TRANSCRIPTION_ERROR}
+        if done:
+            # Resume the interrupted transcription in this job only
+            async for text in _transcribe_journaled(key, load_audio, job, done):
+                yield text
+            return
+
+    cached = transcription_cache.get(key)
+    if cached is None and key in transcriptions_in_flight:
+        cached = await transcriptions_in_flight.do(key, None)
+    if cached is not None:
+        if job is not None:
+            job.record(TRANSCRIBED, 0, cached)
+            job.complete(TRANSCRIBED)
+        yield cached
+        return
+
+    segments = asyncio.Queue()
+
+    async def _load_and_transcribe():
+        parts = []
+        try:
+            async for text in _transcribe_journaled(key, load_audio, job, {}):
+                parts.append(text)
+                await segments.put(text)
+        finally:
+            await segments.put(None)
+        return "\n\n".join(parts)
 
+    task = transcriptions_in_flight.start(key, _load_and_transcribe)
+    while (text := await segments.get()) is not None:
+        yield text
+    await task
 
-def split_message(message, max_length=4096):
+
+async def _transcribe_journaled(key: str, load_audio, job, done: dict):
+    """
+    Transcribes segment by segment, recording the audio and the segments in
+    `job` (if any) and caching the complete transcription under `key`.
+    Segments in `done` are not transcribed again.
+    """
+    if job is not None:
+        audio_file = await _load_journaled_audio(job, load_audio)
+    else:
+        audio_file = await load_audio()
+
+    parts = []
+    transcribe = functools.partial(transcribe_audio, key=key)
+    with audio_file:
+        async for text in transcribe_segments(audio_file, transcribe, done):
+            if job is not None and len(parts) not in done:
+                job.record(TRANSCRIBED, len(parts), text)
+            parts.append(text)
+            yield text
+
+    if TRANSCRIPTION_ERROR not in parts:
+        transcription_cache.set(key, "\n\n".join(parts))
+    if job is not None:
+        job.complete(TRANSCRIBED)
+
+
+def youtube_transcription_key(url: str) -> str:
+    video_id = youtube_video_id(url) or url
+    return f"youtube:{video_id}:{YOUTUBE_AUDIO_FORMAT}"
+
+
+def transcribe_youtube(url: str, job=None):
+    """
+    Downloads and transcribes the audio of a YouTube video, cached by video id.
+    Yields the transcription segment by segment (see `transcribe_stream`).
+    """
+    return transcribe_stream(
+        youtube_transcription_key(url),
+        lambda: download_youtube_audio(url),
+        job,
+    )
+
+
+# Telegram tags in HTML messages, entities, and sentence ends to split at
+HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*>")
+HTML_MARKUP = re.compile(
+    r"</?[a-zA-Z][\w-]*[^<>]*>|&(?:#\d+|#x[0-9a-fA-F]+|[a-zA-Z]+);"
+)
+MARKUP_START = re.compile(r"[<&]")
+SENTENCE_END = re.compile(r"[.!?؟…](?=\s)")
+
+
+def utf16_length(text: str) -> int:
+    """
+    Returns the length of `text` in UTF-16 code units, the unit Telegram's
+    message length limits are measured in.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _visible_length(text: str, html: bool) -> int:
+    if html:
+        text = html_module.unescape(HTML_TAG.sub("", text))
+    return utf16_length(text)
+
+
+def _joins_previous(char: str) -> bool:
     """
-    Splits the message into chunks not exceeding max_length characters.
-    Attempts to split at newline characters or spaces for better readability.
+    Tells whether `char` belongs to the grapheme before it: combining marks
+    (vowel signs, harakat), joiners, variation selectors and emoji modifiers.
     """
-    if len(message) <= max_length:
-        return [message]
+    return (
+        unicodedata.category(char) in ("Mn", "Mc", "Me")
+        or char in "\u200c\u200d"
+        or "\ufe00" <= char <= "\ufe0f"
+        or "\U0001f3fb" <= char <= "\U0001f3ff"
+        or "\U000e0020" <= char <= "\U000e007f"
+    )
 
-    chunks = []
-    current_chunk = ""
 
-    for line in message.split("\n"):
-        if len(current_chunk) + len(line) + 1 > max_length:
-            if current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = ""
-        if len(line) + 1 > max_length:
-            # Split the line into smaller parts
-            for i in range(0, len(line), max_length):
-                chunks.append(line[i : i + max_length])
-        else:
-            current_chunk += line + "\n"
+def _safe_cut(text: str, start: int, end: int, html: bool) -> int:
+    """
+    Moves the cut before `end` back so it splits neither a grapheme nor,
+    in HTML, a tag or an entity. Returns `end` if no such cut exists after
+    `start`.
+    """
+    cut = end
+    while cut > start:
+        if html:
+            tag_start = text.rfind("<", start, cut)
+            if tag_start > text.rfind(">", start, cut):
+                cut = tag_start
+            entity_start = text.rfind("&", max(start, cut - 10), cut)
+            if entity_start >= 0 and text.find(";", entity_start, cut) < 0:
+                cut = entity_start
+        grapheme_end = cut
+        while cut > start and (
+            _joins_previous(text[cut]) or text[cut - 1] in "\u200c\u200d"
+        ):
+            cut -= 1
+        # Backing off a grapheme can land inside the tag before it
+        if cut == grapheme_end:
+            break
+    return cut if cut > start else end
+
+
+def _fitting_prefix(text: str, start: int, max_length: int) -> int:
+    """
+    Returns the end of the longest text after `start` that is at most
+    `max_length` UTF-16 code units long.
+    """
+    units = text[start : start + max_length].encode("utf-16-le")[: 2 * max_length]
+    # A character cut in half leaves a lone surrogate, which is dropped
+    return start + len(units.decode("utf-16-le", errors="ignore"))
+
+
+def _hard_limit(text: str, start: int, max_length: int, html: bool) -> int:
+    """
+    Returns the furthest end after `start` whose text fits in `max_length`
+    UTF-16 code units, not counting HTML markup.
+    """
+    position = scan = start
+    while html:
+        # Markup after this much text would not fit anyway
+        candidate = MARKUP_START.search(text, scan, position + max_length + 1)
+        if candidate is None:
+            break
+        markup = HTML_MARKUP.match(text, candidate.start())
+        if markup is None:
+            scan = candidate.start() + 1
+            continue
+        length = utf16_length(text[position : markup.start()])
+        if length > max_length:
+            break
+        max_length -= length
+        if markup.group(0).startswith("&"):
+            length = utf16_length(html_module.unescape(markup.group(0)))
+            if length > max_length:
+                return markup.start()
+            max_length -= length
+        position = scan = markup.end()
+    return _fitting_prefix(text, position, max_length)
+
+
+def _break_position(text: str, start: int, end: int) -> int:
+    """
+    Picks where to end a chunk that may run up to `end`: after the last
+    paragraph break, line break, sentence or word in its second half, in
+    that order of preference, or at `end` when there is none.
+    """
+    floor = start + (end - start) // 2
+    for separator in ("\n\n", "\n"):
+        position = text.rfind(separator, floor, end)
+        if position >= 0:
+            return position + len(separator)
+    last_sentence = None
+    for last_sentence in SENTENCE_END.finditer(text, floor, end):
+        pass
+    if last_sentence is not None:
+        return last_sentence.end()
+    position = text.rfind(" ", floor, end)
+    return position + 1 if position >= 0 else end
 
-    if current_chunk:
-        chunks.append(current_chunk)
 
-    return chunks
+def iter_message_chunks(message: str, max_length: int = 4096, html: bool = False):
+    """
+    Splits the message into chunks of at most `max_length` UTF-16 code units
+    in one pass, preferring paragraph, line, sentence and word breaks, and
+    never splitting a grapheme. Yields the chunks as they are cut, so the
+    first can be sent while the rest is still being split.
+
+    With `html`, the message is Telegram HTML: only its text counts
+    against the limit, tags and entities are never cut, and tags open at
+    the end of a chunk are closed there and opened again in the next.
+    """
+    if _visible_length(message, html) <= max_length:
+        yield message
+        return
+
+    open_tags = []  # (name, opening tag) of the tags open at `start`
+    start = 0
+    while start < len(message):
+        limit = _hard_limit(message, start, max_length, html)
+        end = limit
+        if end < len(message):
+            end = _safe_cut(message, start, _break_position(message, start, end), html)
+            if _visible_length(message[start:end], html) > max_length:
+                # No clean cut fits; the hard limit never cuts markup
+                end = limit
+        prefix = "".join(tag for _, tag in open_tags)
+        if html:
+            for tag in HTML_TAG.finditer(message, start, end):
+                if not tag.group(1):
+                    open_tags.append((tag.group(2).lower(), tag.group(0)))
+                    continue
+                name = tag.group(2).lower()
+                for index in range(len(open_tags) - 1, -1, -1):
+                    if open_tags[index][0] == name:
+                        del open_tags[index]
+                        break
+        suffix = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        chunk = message[start:end]
+        if chunk.strip():
+            yield prefix + chunk + suffix
+        start = end
+
+
+def split_message(message, max_length=4096, html=False):
+    """
+    Splits the message into chunks of at most max_length UTF-16 code units
+    (see `iter_message_chunks`).
+    """
+    return list(iter_message_chunks(message, max_length, html))
@@ -0,0 +1,90 @@
+# workers.py
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a blocking job when its cancel event has been set.
+    """
+
+
+class WorkerPool:
+    """
+    Runs blocking media work (downloads, decoding, transcoding) in a dedicated
+    thread pool so the event loop stays free for polling and text jobs.
+
+    At most `max_workers` jobs run at once; further jobs wait their turn
+    without occupying a thread. Jobs that time out or whose caller is
+    cancelled get their `cancel_event` (a threading.Event) set, so
+    cooperative jobs can stop early, and are dropped if not started yet.
+    """
+
+    def __init__(self, name: str, max_workers: int, timeout: float = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self.running = 0
+        self.waiting = 0
+
+    async def run(self, func, *args, timeout: float = None, cancel_event=None):
+        """
+        Runs `func(*args)` in the pool and returns its result.
+
+        Raises asyncio.TimeoutError when the job takes longer than `timeout`
+        (the pool default when not given).
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        loop = asyncio.get_running_loop()
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        job = self._executor.submit(functools.partial(func, *args))
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(job)), timeout
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if cancel_event is not None:
+                cancel_event.set()
+            job.cancel()
+            logger.warning(
+                f"{self.name} job {getattr(func, '__name__', func)} was cancelled or timed out."
+            )
+            raise
+        finally:
+            self.running -= 1
+            # Keep the slot until the thread has really finished the job
+            job.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(self._semaphore.release)
+            )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+media_pool = WorkerPool(
+    "media", settings.MEDIA_WORKERS, timeout=settings.MEDIA_JOB_TIMEOUT
+)
+
+# Documents are parsed a batch at a time, so their jobs are short and must
+# not wait behind long downloads and transcoding in the media pool
+document_pool = WorkerPool(
+    "document", settings.DOCUMENT_WORKERS, timeout=settings.DOCUMENT_JOB_TIMEOUT
+)